@@ -12,322 +12,649 @@ Original file is located at
 """
 
 from datetime import datetime
+from functools import lru_cache, partial
 
 import os
 import pandas as pd
-import geopandas as gpd
-import json
 import numpy as np
 
 import plotly.express as px
 import plotly.graph_objects as go
 
 import dash
-from dash import dcc, html, State
+from dash import dcc, html, Patch, State
 
 import dash_daq as daq
 
-import dash.dependencies as dd
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, ClientsideFunction
 
-import traceback
-
-"""## Import datasets for province shapes, active fault lines, and magnitude with population"""
+import export
+import metrics
+import tiles
+import warmup
+from gutenberg_richter import BootstrapCache, HistogramCube
+from indexes import CountCube, ProvinceEventIndex, ProvinceReducer, ProvinceTimeCube, grid_bins, widen_float32
+from snapshot import SnapshotWatcher, load_snapshot
 
+"""## Load precompiled data snapshot
 
+Parsing, the spatial join and the aggregations live in `snapshot.py`. The
+snapshot is memory-mapped here and rebuilt only when a source file changes.
+Everything the callbacks read is derived from it in `prepare_app_data`;
+when new events are ingested, the derived data of the new snapshot is built
+in the background and swapped in (see snapshot.SnapshotWatcher), so
+callbacks take `current_data()` once and work on a single version.
+"""
 
-gdf_ph_provinces = gpd.read_file("data/ph_provinces.geojson")
-active_faults = gpd.read_file("data/gem_active_faults.geojson")
-magnitude_df = pd.read_csv("data/[POP] FINAL_merged_earthquake_data.csv")
+with metrics.startup_phase("load_snapshot"):
+    snap = load_snapshot()
 
-"""### Processing datasets
+"""Simplified province geometry for the choropleth
 
-Processing dataframe for fault lines
+The snapshot holds several levels of detail. By default the coarsest level
+that is still sub-pixel at the main map zoom (with room to zoom in twice) is
+used; SEISMIC_MAP_TOLERANCE picks a simplification tolerance in degrees instead.
 """
 
-ph_faults = active_faults[active_faults["catalog_name"].str.contains("Philippines", case=False)]
-# print(ph_faults[["catalog_name", 'name', "geometry"]].head())
+MAIN_MAP_ZOOM = 4.5
 
-"""Added columns to simplify bubble map charting"""
+def degrees_per_pixel(zoom):
+    # Mapbox renders the world 512 px wide at zoom 0
+    return 360 / (512 * 2 ** zoom)
 
-magnitude_df['Date'] = pd.to_datetime(magnitude_df['Date'])
-magnitude_df['Year_Earthquake'] = magnitude_df['Date'].dt.year
+map_tolerance = float(os.environ.get("SEISMIC_MAP_TOLERANCE", degrees_per_pixel(MAIN_MAP_ZOOM + 2)))
 
-# print(magnitude_df.head())
+"""## Visualization"""
 
-"""Compute average magnitude of earthquakes per province to improve for chloropleth mapping"""
+magnitude_ranges = [
+    None, (1.0, 1.9), (2.0, 2.9), (3.0, 3.9), (4.0, 4.9),
+    (5.0, 5.9), (6.0, 6.9), (7.0, 7.9), (8.0, 8.9)]
 
-magnitude_gdf = gpd.GeoDataFrame(
-    magnitude_df, geometry=gpd.points_from_xy(magnitude_df["Longitude"], magnitude_df["Latitude"]), crs="EPSG:4326"
-)
+magnitude_labels = [
+    "All", "Micro (1.0-1.9)", "Minor (2.0–2.9)", "Minor (3.0-3.9)", "Light (4.0–4.9)",
+    "Moderate (5.0–5.9)", "Strong (6.0–6.9)", "Major (7.0–7.9)", "Great (8.0-8.9)"]
+
+magnitude_colors = ["#FFE500", "#FFC400", "#FFA400", "#FF8300",
+                    "#FF6200", "#FF4100", "#FF2100", "#FF0000"]
 
-# Calculate average magnitude per province
-magnitude_gdf = gpd.sjoin(magnitude_gdf, gdf_ph_provinces, how="left", predicate="intersects")
-province_ave_magnitudes = magnitude_gdf.groupby("adm2_en")["Magnitude"].mean().reset_index()
-# print(province_ave_magnitudes.head())
+"""Data shipped once to the browser for the client-side choropleth
 
-"""Create dataframe for population data"""
+The province geometry, the per-province statistics (with population for the
+hover) and the fault overlay are sent in dcc.Store components with the page.
+Magnitude-band filtering, metric selection and coloring run in
+`assets/choropleth.js`, so the slider, metric and fault toggle never call the
+server. Only the event-level magnitude/depth filters recompute the
+statistics on the server, and those are memoized.
+"""
+
+pop_cols = ["2020", "2015", "2010", "2000"]
+bubble_columns = ["Province", "Year_Earthquake", "Latitude", "Longitude", "Magnitude", "Location", "Depth_In_Km", "Date",
+                  "Fault_Distance_Km", "Nearest_Fault"]
 
-magnitude_df["2000"] = magnitude_df["2000"].replace({',': ''}, regex=True).astype(int)
+# Choices of the "within X km of a fault" filter (None: any distance)
+FAULT_DISTANCES_KM = [1, 5, 10, 25, 50, 100]
 
-# for Populations
-pop_columns = ["Province", "2020", "2015", "2010", "2000"]
-population_df = magnitude_df[pop_columns].drop_duplicates("Province")
-# print(population_df.head())
+class AppData:
+    """Every structure the layout and callbacks read, derived from one snapshot.
 
-"""Data preparation for line chart"""
+    Compared and hashed by identity, so it can key the memoized statistics.
+    """
 
-try:
-    magnitude_df['Date'] = pd.to_datetime(magnitude_df['Date'])
-    magnitude_df['Year'] = magnitude_df['Date'].dt.year
+def prepare_app_data(snap):
+    data = AppData()
+    data.version = snap.version
+    metrics.record_snapshot_build(snap.manifest.get("build_timings", {}))
 
-    grouping_cols = ['Year', 'Province', 'Region', 'Island Group']
-    if all(col in magnitude_df.columns for col in grouping_cols):
-        earthquake_counts = magnitude_df.groupby(grouping_cols).size().reset_index(name='Number of Earthquakes')
-        overall_counts = magnitude_df.groupby('Year').size().reset_index(name='Number of Earthquakes')
+    gdf_ph_provinces = snap.provinces # Only needed while the indexes are built
+    data.fault_overlay = snap.fault_overlay # All fault segments flattened into one set of arrays
+    data.magnitude_df = magnitude_df = snap.magnitude_df
+    data.population_df = population_df = snap.population_df
+    data.province_geojson = snap.province_geojson(snap.pick_lod(map_tolerance)) # Pre-serialized, avoids __geo_interface__ per request
+
+    # Data preparation for line chart
+    try:
+        earthquake_counts = snap.earthquake_counts
+        overall_counts = snap.overall_counts
 
-        provinces = sorted(earthquake_counts['Province'].dropna().unique())
-        regions = sorted(earthquake_counts['Region'].dropna().unique())
-        island_groups = sorted(earthquake_counts['Island Group'].dropna().unique())
+        data.provinces = sorted(earthquake_counts['Province'].dropna().unique())
+        data.regions = sorted(earthquake_counts['Region'].dropna().unique())
+        data.island_groups = sorted(earthquake_counts['Island Group'].dropna().unique())
         if 'Year' in earthquake_counts.columns and not earthquake_counts.empty:
-             min_year = int(earthquake_counts['Year'].min())
-             max_year = int(earthquake_counts['Year'].max())
-             available_years = sorted(earthquake_counts['Year'].unique())
+             data.min_year = int(earthquake_counts['Year'].min())
+             data.max_year = int(earthquake_counts['Year'].max())
+             data.available_years = sorted(earthquake_counts['Year'].unique())
         else:
              raise ValueError("'Year' column not found or empty in earthquake_counts")
-    else:
-        missing_cols = [col for col in grouping_cols if col not in magnitude_df.columns]
-        raise ValueError(f"Missing required columns for line chart aggregation: {missing_cols}")
-
-except Exception as e:
-    # print(f"FATAL ERROR preparing data for line chart explorer: {e}. Assigning defaults.")
-    earthquake_counts = pd.DataFrame()
-    overall_counts = pd.DataFrame()
-    provinces, regions, island_groups = [], [], []
-    min_year, max_year = datetime.now().year - 10, datetime.now().year
-    available_years = list(range(min_year, max_year + 1))
 
-"""## Visualization"""
+        # Dense [entity, year] count arrays so the trends explorer only slices columns
+        with metrics.startup_phase("count_cubes"):
+            data.count_cubes = {
+                "Overall": CountCube(overall_counts),
+                "Province": CountCube(earthquake_counts, "Province"),
+                "Region": CountCube(earthquake_counts, "Region"),
+                "Island Group": CountCube(earthquake_counts, "Island Group"),
+            }
+            # The same counts restricted to mainshocks (see declustering.py)
+            data.mainshock_count_cubes = {}
+            if "Number of Mainshocks" in earthquake_counts.columns:
+                mainshocks = "Number of Mainshocks"
+                data.mainshock_count_cubes = {
+                    "Overall": CountCube(overall_counts, count_col=mainshocks),
+                    "Province": CountCube(earthquake_counts, "Province", count_col=mainshocks),
+                    "Region": CountCube(earthquake_counts, "Region", count_col=mainshocks),
+                    "Island Group": CountCube(earthquake_counts, "Island Group", count_col=mainshocks),
+                }
 
-magnitude_ranges = [
-    None, (1.0, 1.9), (2.0, 2.9), (3.0, 3.9), (4.0, 4.9),
-    (5.0, 5.9), (6.0, 6.9), (7.0, 7.9), (8.0, 8.9)]
+    except Exception as e:
+        # print(f"FATAL ERROR preparing data for line chart explorer: {e}. Assigning defaults.")
+        data.count_cubes, data.mainshock_count_cubes = {}, {}
+        data.provinces, data.regions, data.island_groups = [], [], []
+        data.min_year, data.max_year = datetime.now().year - 10, datetime.now().year
+        data.available_years = list(range(data.min_year, data.max_year + 1))
+
+    # Integer province codes per event for np.bincount reductions
+    data.province_names = gdf_ph_provinces["adm2_en"].dropna().unique().tolist()
+    with metrics.startup_phase("province_reducer"):
+        data.province_reducer = ProvinceReducer(data.province_names, magnitude_df["adm2_en"],
+                                                magnitude_df["Magnitude"], magnitude_df["Depth_In_Km"],
+                                                magnitude_df.get("Fault_Distance_Km"), magnitude_df["Year_Earthquake"],
+                                                magnitude_df.get("Mainshock"))
+    data.province_positions = {name: i for i, name in enumerate(data.province_names)}
+
+    # Month of every event (0 = January of the first catalog year) and the
+    # unfiltered [province, month] statistics the playback frames start from
+    with metrics.startup_phase("time_cube"):
+        data.first_month_year = int(magnitude_df["Year_Earthquake"].min()) if len(magnitude_df) else data.min_year
+        years = magnitude_df["Year_Earthquake"].to_numpy().astype(np.int32) - data.first_month_year
+        data.event_months = years * 12 + magnitude_df["Date"].dt.month.to_numpy().astype(np.int32) - 1
+        data.n_months = 12 * (int(years.max()) + 1) if len(years) else 12
+        data.month_cube = ProvinceTimeCube.from_events(data.province_reducer, data.event_months, data.n_months)
+
+    # [area, year, magnitude bin] histograms for the Gutenberg-Richter
+    # metrics, of all events and of the mainshocks only; regions sum the
+    # provinces whose events mostly carry that region
+    with metrics.startup_phase("gutenberg_richter"):
+        codes = data.province_reducer.codes
+        assigned = codes >= 0
+        regions = pd.crosstab(codes[assigned], magnitude_df["Region"].to_numpy()[assigned])
+        data.region_names = sorted(regions.columns.astype(str))
+        province_region = regions.idxmax(axis=1).reindex(range(len(data.province_names)))
+        data.province_region_codes = pd.Categorical(province_region, categories=data.region_names).codes
+        data.gr_cubes = {}
+        for declustered in (False, True):
+            if declustered and data.province_reducer.mainshock is not None:
+                codes = np.where(data.province_reducer.mainshock, codes, -1)
+            provinces = HistogramCube.from_events(codes, len(data.province_names),
+                                                  magnitude_df["Year_Earthquake"], magnitude_df["Magnitude"])
+            data.gr_cubes[declustered] = (provinces, provinces.group(data.province_region_codes, len(data.region_names)))
+
+    # Population rows aligned with province_names for the hover
+    data.province_population = None
+    if population_df is not None and not population_df.empty and 'Province' in population_df.columns:
+        data.province_population = (population_df.drop_duplicates("Province").set_index("Province")
+                                    .reindex(data.province_names, columns=pop_cols).fillna(0).astype(np.int64).to_numpy())
+
+    data.event_magnitude_bounds = [float(np.floor(magnitude_df["Magnitude"].min())), float(np.ceil(magnitude_df["Magnitude"].max()))]
+    data.event_depth_bounds = [0.0, float(np.ceil(magnitude_df["Depth_In_Km"].max()))]
+
+    # Events grouped by province and sorted by date, built once for the bubble map
+    data.bubble_index = None
+    if all(col in magnitude_df.columns for col in bubble_columns):
+        with metrics.startup_phase("bubble_index"):
+            data.bubble_index = ProvinceEventIndex(magnitude_df, gdf_ph_provinces, columns=bubble_columns)
+
+    # Events in web-map tile order for the "all events" layer (see tiles.py)
+    with metrics.startup_phase("tile_pyramid"):
+        data.tile_pyramid = tiles.TilePyramid(magnitude_df, snap.version)
+
+    for table in ["magnitude_df", "population_df", "province_ave_magnitudes"]:
+        metrics.record_table_memory(table, getattr(snap, table))
+    return data
+
+def build_choropleth_data(data, magnitude_range=None, depth_range=None, max_fault_distance=None, year_range=None,
+                          declustered=False):
+    stats = data.province_reducer.reduce(magnitude_range, depth_range, max_fault_distance, year_range=year_range,
+                                         declustered=declustered)
+    present = stats["count"] > 0
+    customdata = None
+    if data.province_population is not None:
+        customdata = data.province_population[present].tolist()
+    result = {
+        "locations": np.asarray(data.province_names, dtype=object)[present].tolist(),
+        "count": stats["count"][present].tolist(),
+        "mean": stats["mean"][present].round(4).tolist(),
+        "max": stats["max"][present].round(2).tolist(),
+        "energy": np.log10(stats["energy"][present]).round(3).tolist(),
+        "customdata": customdata,
+    }
+    # Gutenberg-Richter estimates only follow the year range and declustering:
+    # cutting the magnitude distribution (or the catalog by depth or fault)
+    # would bias them
+    for prefix, estimate in gutenberg_richter_estimates(data, year_range, declustered).items():
+        result[prefix + "b_value"] = nullable(estimate["b_value"][present], 2)
+        result[prefix + "mc"] = nullable(estimate["mc"][present], 1)
+    return result
+
+def gutenberg_richter_estimates(data, year_range, declustered=False):
+    """b-value and Mc per province, of the province itself and of its region."""
+    provinces, regions = data.gr_cubes[declustered]
+    region_estimate = regions.estimate(year_range)
+    return {
+        "": provinces.estimate(year_range),
+        "region_": {key: np.append(values, np.nan)[data.province_region_codes] for key, values in region_estimate.items()},
+    }
+
+# One entry per filter state, keyed on the app data (one per snapshot
+# version) so a new snapshot never serves stale statistics; maxsize bounds
+# the memory held and the cache is cleared whenever new data is swapped in.
+STATS_CACHE_SIZE = int(os.environ.get("SEISMIC_STATS_CACHE_SIZE", 256))
+
+@lru_cache(maxsize=STATS_CACHE_SIZE)
+def cached_choropleth_data(data, magnitude_range, depth_range, max_fault_distance=None, year_range=None,
+                           declustered=False):
+    return build_choropleth_data(data, magnitude_range, depth_range, max_fault_distance, year_range, declustered)
+
+"""Bootstrap uncertainty of the Gutenberg-Richter metrics
+
+Resampling every province and region histogram takes far longer than a
+callback should, so it runs in background threads per snapshot version,
+year range and declustering (see gutenberg_richter.BootstrapCache). Responses carry the
+uncertainties once they are ready; until then the hover shows the estimate alone.
+"""
 
-magnitude_labels = [
-    "All", "Micro (1.0-1.9)", "Minor (2.0–2.9)", "Minor (3.0-3.9)", "Light (4.0–4.9)",
-    "Moderate (5.0–5.9)", "Strong (6.0–6.9)", "Major (7.0–7.9)", "Great (8.0-8.9)"]
+gr_bootstrap = BootstrapCache()
+
+def gr_uncertainty(data, year_range, declustered=False, wait=False):
+    """Bootstrap standard deviations per province, or None while they are being computed.
+
+    With `wait=True` a scheduled computation is waited for (used by the warm-up).
+    """
+    n_provinces = len(data.province_names)
+    provinces, regions = data.gr_cubes[declustered]
+    histograms = np.concatenate((provinces.histograms(year_range), regions.histograms(year_range)))
+    lookup = gr_bootstrap.result if wait else gr_bootstrap.get
+    std = lookup((data.version, year_range, declustered), histograms, provinces.magnitudes)
+    if std is None:
+        return None
+    regions = np.append(np.arange(n_provinces, len(histograms)), -1)[data.province_region_codes]
+    # Provinces without a region point at the NaN appended to every row
+    padded = {key: np.append(values, np.nan) for key, values in std.items()}
+    return {
+        "": {key: values[:n_provinces] for key, values in std.items()},
+        "region_": {key: values[regions] for key, values in padded.items()},
+    }
+
+def choropleth_data(data, magnitude_range=None, depth_range=None, max_fault_distance=None, year_range=None,
+                    declustered=False):
+    result = cached_choropleth_data(data, magnitude_range, depth_range, max_fault_distance, year_range, declustered)
+    uncertainty = gr_uncertainty(data, year_range, declustered)
+    if uncertainty is None:
+        return result
+    present = [data.province_positions[name] for name in result["locations"]]
+    errors = {}
+    for prefix, std in uncertainty.items():
+        errors[prefix + "b_value_error"] = nullable(std["b_value"][present], 2)
+        errors[prefix + "mc_error"] = nullable(std["mc"][present], 2)
+    return {**result, **errors}
+
+"""Playback frames for the choropleth
+
+Per-province statistics per year or month, optionally over a trailing
+rolling window, derived from the [province, month] cube. Each frame holds
+only the values per province; the geometry is the one already in the
+browser. Values are rounded to what the hover shows and empty cells are null.
+"""
 
-magnitude_colors = ["#FFE500", "#FFC400", "#FFA400", "#FF8300",
-                    "#FF6200", "#FF4100", "#FF2100", "#FF0000"]
+PLAYBACK_WINDOWS = [1, 3, 6, 12, 24]
+FRAMES_CACHE_SIZE = int(os.environ.get("SEISMIC_FRAMES_CACHE_SIZE", 32))
+PLAYBACK_FRAME_MS = int(os.environ.get("SEISMIC_PLAYBACK_FRAME_MS", 200))
+
+def nullable(values, decimals):
+    rounded = values.round(decimals).astype(object)
+    rounded[np.isnan(values)] = None
+    return rounded.tolist()
+
+def build_choropleth_frames(data, granularity, window=1, magnitude_range=None, depth_range=None,
+                            max_fault_distance=None, year_range=None, declustered=False):
+    reducer = data.province_reducer
+    keep = reducer.mask(magnitude_range, depth_range, max_fault_distance, year_range, declustered)
+    cube = data.month_cube if keep is reducer.assigned else \
+        ProvinceTimeCube.from_events(reducer, data.event_months, data.n_months, keep)
+    n_buckets = data.n_months
+    if granularity == "year":
+        cube, n_buckets = cube.coarsen(12), n_buckets // 12
+        labels = [str(data.first_month_year + b) for b in range(n_buckets)]
+    else:
+        labels = [f"{data.first_month_year + b // 12}-{b % 12 + 1:02d}" for b in range(n_buckets)]
+    stats = cube.rolling(window or 1).statistics()
+    if year_range is not None:
+        # Periods outside the year range hold no events; play only the range
+        per_year = 1 if granularity == "year" else 12
+        periods = slice(max(int(year_range[0]) - data.first_month_year, 0) * per_year,
+                        max(int(year_range[1]) - data.first_month_year + 1, 0) * per_year)
+        stats = {key: values[periods] for key, values in stats.items()}
+        labels = labels[periods]
+
+    # Provinces without any event in the period are left out of every frame
+    present = stats["count"].any(axis=0)
+    with np.errstate(divide="ignore"):
+        energy = np.log10(stats["energy"][:, present])
+    return {
+        "granularity": granularity,
+        "window": window or 1,
+        "labels": labels,
+        "locations": np.asarray(data.province_names, dtype=object)[present].tolist(),
+        "count": stats["count"][:, present].tolist(),
+        "mean": nullable(stats["mean"][:, present], 2),
+        "max": nullable(stats["max"][:, present], 1),
+        "energy": nullable(energy, 2),
+    }
+
+@lru_cache(maxsize=FRAMES_CACHE_SIZE)
+def cached_choropleth_frames(data, granularity, window, magnitude_range, depth_range, max_fault_distance=None,
+                             year_range=None, declustered=False):
+    return build_choropleth_frames(data, granularity, window, magnitude_range, depth_range, max_fault_distance,
+                                   year_range, declustered)
+
+choropleth_metrics = {
+    "mean": {"label": "Average Magnitude", "format": ".2f", "colorbar": "Avg Magnitude", "bands": True},
+    "max": {"label": "Max Magnitude", "format": ".1f", "colorbar": "Max Magnitude", "bands": True},
+    "count": {"label": "Earthquakes", "format": ",", "colorbar": "Earthquakes", "bands": False},
+    "energy": {"label": "Energy Released (log10 J)", "format": ".2f", "colorbar": "log10 Energy (J)", "bands": False},
+    # "error" names the bootstrap uncertainty shown in the hover when available
+    "b_value": {"label": "Gutenberg-Richter b-value", "format": ".2f", "colorbar": "b-value", "bands": False,
+                "error": "b_value_error"},
+    "mc": {"label": "Magnitude of Completeness", "format": ".1f", "colorbar": "Mc", "bands": True,
+           "error": "mc_error"},
+    "region_b_value": {"label": "Region b-value", "format": ".2f", "colorbar": "Region b-value", "bands": False,
+                       "error": "region_b_value_error"},
+    "region_mc": {"label": "Region Magnitude of Completeness", "format": ".1f", "colorbar": "Region Mc",
+                  "bands": True, "error": "region_mc_error"},
+}
+
+choropleth_config = {
+    "ranges": magnitude_ranges,
+    "labels": magnitude_labels,
+    "colors": magnitude_colors,
+    "metrics": choropleth_metrics,
+    # Plotly.js reverses the named YlOrRd scale, so send the explicit colors
+    "colorscale": [[i / (len(px.colors.sequential.YlOrRd) - 1), c] for i, c in enumerate(px.colors.sequential.YlOrRd)],
+    "zoom": MAIN_MAP_ZOOM,
+    "center": {"lat": 12.8797, "lon": 121.7740},
+    "frame_ms": PLAYBACK_FRAME_MS,
+}
+
+def clear_caches(data):
+    cached_choropleth_data.cache_clear()
+    cached_choropleth_frames.cache_clear()
+    cached_bubble_bins.cache_clear()
+    cached_bubble_map_figure.cache_clear()
+    # Bootstrap work for the previous snapshot would only be computed to be dropped
+    gr_bootstrap.clear()
+    # Refill them for the new data in the background
+    warmups.start(data.version, warmup_tasks(data))
+
+# Re-check the snapshot pointer at most every SEISMIC_RELOAD_INTERVAL seconds
+RELOAD_INTERVAL = float(os.environ.get("SEISMIC_RELOAD_INTERVAL", 30))
+watcher = SnapshotWatcher(prepare_app_data, snap, interval=RELOAD_INTERVAL, on_swap=clear_caches)
+del snap # No module-level reference may keep a replaced snapshot alive
+
+def current_data():
+    return watcher.current
 
 app = dash.Dash(__name__,
                 external_stylesheets=["assets/style.css"],
                 suppress_callback_exceptions=True) # Important for dynamic layouts
 server = app.server
 
-min_year, max_year = 2000, datetime.now().year # Default fallbacks
-if 'Year_Earthquake' in magnitude_df.columns:
-    min_yr_val = magnitude_df['Year_Earthquake'].min()
-    max_yr_val = magnitude_df['Year_Earthquake'].max()
-    if pd.notna(min_yr_val): min_year = int(min_yr_val)
-    if pd.notna(max_yr_val): max_year = int(max_yr_val)
-
-app.layout = html.Div([
-    # Main controls
-    html.Div(id='main-controls', style={'display': 'block'}, children=[
-        html.Label("Select Average Earthquake Magnitude Range"),
-        html.Div(
-            dcc.Slider(id="magnitude-slider",
-                       min=0, max=len(magnitude_ranges) - 1, value=0, step=1,
-                       marks={ i: {"label": magnitude_labels[i].replace(" ", "\\n"), "style": {"white-space": "pre-line"}} for i in range(len(magnitude_ranges)) },
-                       className="colored-slider"
+# Time every callback registered below and serve /metrics
+metrics.install(app)
+# Filtered event downloads on /api/events
+export.install(server, lambda: current_data().magnitude_df)
+# Viewport tiles of the events on /api/tiles/<z>/<x>/<y>
+tiles.install(server, lambda: current_data().tile_pyramid)
+# Pick up newly ingested snapshots without a restart
+server.before_request(watcher.check)
+# Warm-up progress on /ready (see the end of this file)
+warmups = warmup.Warmup()
+warmup.install(server, warmups)
+
+# A function so every page load gets the bounds and data of the current snapshot
+def serve_layout():
+    data = current_data()
+    event_magnitude_bounds, event_depth_bounds = data.event_magnitude_bounds, data.event_depth_bounds
+    min_year, max_year, available_years = data.min_year, data.max_year, data.available_years
+    return html.Div([
+        # Main controls
+        html.Div(id='main-controls', style={'display': 'block'}, children=[
+            html.Label("Select Average Earthquake Magnitude Range"),
+            html.Div(
+                dcc.Slider(id="magnitude-slider",
+                           min=0, max=len(magnitude_ranges) - 1, value=0, step=1,
+                           marks={ i: {"label": magnitude_labels[i].replace(" ", "\\n"), "style": {"white-space": "pre-line"}} for i in range(len(magnitude_ranges)) },
+                           className="colored-slider"
+                ),
+                style={"margin-bottom": "15px"}
             ),
-            style={"margin-bottom": "15px"}
-        ),
-        html.Div([html.Label("Show Fault Lines", style={"margin-right": "10px"}), daq.ToggleSwitch(id="fault-toggle", value=True, color="#333")],
-                 style={"display": "flex", "alignItems": "center", "margin-bottom": "20px"}),
-    ]),
-
-    # Main map (choropleth map)
-    html.Div(id='main-map-container', style={'display': 'block', 'height': '75vh'}, children=[
-        dcc.Loading(id="loading-main-map", children=dcc.Graph(id="earthquake-map", style={'height': '100%'}))
-    ]),
-
-    # Detail map (bubble map + line chart)
-    html.Div(id='detail-view-container', style={'display': 'none', 'flexDirection': 'row', 'height': '85vh'}, children=[
-        html.Div(id='bubble-map-wrapper', style={'flex': '2', 'paddingRight': '10px', 'display': 'flex', 'flexDirection': 'column'}, children=[
-             html.H3(id="province-title", style={'textAlign': 'center', 'flexShrink': 0}),
-             html.Label("Filter Bubble Map by Year:", style={'flexShrink': 0, 'marginLeft': '15px'}),
-             html.Div(
-                 dcc.RangeSlider(
-                     id="bubble-year-slider", min=min_year, max=max_year, value=[min_year, max_year], step=1,
-                     marks={str(year): str(year) for year in available_years},
-                 ),
-                 style={'margin': '0 15px 15px 15px', 'flexShrink': 0}
-             ),
-             dcc.Loading(id="loading-bubble-map", children=dcc.Graph(id="bubble-map", style={'flexGrow': 1, 'minHeight': 0}))
+            html.Label("Filter Events by Year"),
+            html.Div(
+                dcc.RangeSlider(id="event-year-slider", min=min_year, max=max_year, value=[min_year, max_year], step=1,
+                                marks={str(year): str(year) for year in available_years}),
+                style={"margin-bottom": "15px"}
+            ),
+            html.Div([
+                html.Div([
+                    html.Label("Filter Events by Magnitude"),
+                    dcc.RangeSlider(id="event-magnitude-slider",
+                                    min=event_magnitude_bounds[0], max=event_magnitude_bounds[1], step=0.1,
+                                    value=event_magnitude_bounds,
+                                    marks={m: str(m) for m in range(int(event_magnitude_bounds[0]), int(event_magnitude_bounds[1]) + 1)},
+                                    tooltip={"placement": "bottom"}),
+                ], style={"flex": 1, "marginRight": "20px"}),
+                html.Div([
+                    html.Label("Filter Events by Depth (km)"),
+                    dcc.RangeSlider(id="event-depth-slider",
+                                    min=event_depth_bounds[0], max=event_depth_bounds[1], step=1,
+                                    value=event_depth_bounds,
+                                    tooltip={"placement": "bottom"}),
+                ], style={"flex": 1, "marginRight": "20px"}),
+                html.Div([
+                    html.Label("Distance to Nearest Fault"),
+                    dcc.Dropdown(id="fault-distance",
+                                 options=[{"label": f"Within {d} km of a fault", "value": d} for d in FAULT_DISTANCES_KM],
+                                 value=None, placeholder="Any distance"),
+                ], style={"width": "220px", "marginRight": "20px"}),
+                html.Div([
+                    html.Label("Color Provinces by"),
+                    dcc.Dropdown(id="choropleth-metric",
+                                 options=[{"label": m["label"], "value": key} for key, m in choropleth_metrics.items()],
+                                 value="mean", clearable=False),
+                ], style={"width": "250px"}),
+            ], style={"display": "flex", "margin-bottom": "15px"}),
+            html.Div([
+                html.Div([html.Label("Show Fault Lines", style={"margin-right": "10px"}), daq.ToggleSwitch(id="fault-toggle", value=True, color="#333")],
+                         style={"display": "flex", "alignItems": "center", "marginRight": "40px"}),
+                html.Div([html.Label("Show All Events", style={"margin-right": "10px"}),
+                          daq.ToggleSwitch(id="events-layer-toggle", value=False, color="#333")],
+                         style={"display": "flex", "alignItems": "center", "marginRight": "40px"}),
+                html.Div([html.Label("Mainshocks Only (Declustered)", style={"margin-right": "10px"}),
+                          daq.ToggleSwitch(id="declustered-toggle", value=False, color="#333")],
+                         style={"display": "flex", "alignItems": "center", "marginRight": "40px"}),
+                html.Label("Playback", style={"margin-right": "10px"}),
+                dcc.RadioItems(id="playback-granularity",
+                               options=[{"label": "Off", "value": "off"}, {"label": "By year", "value": "year"},
+                                        {"label": "By month", "value": "month"}],
+                               value="off", inline=True, style={"marginRight": "20px"}),
+                dcc.Dropdown(id="playback-window",
+                             options=[{"label": "Single period" if w == 1 else f"Rolling {w} periods", "value": w}
+                                      for w in PLAYBACK_WINDOWS],
+                             value=1, clearable=False, style={"width": "180px"}),
+            ], style={"display": "flex", "alignItems": "center", "margin-bottom": "20px"}),
         ]),
 
-        html.Div(id='line-chart-explorer-wrapper', style={'flex': '3', 'display': 'flex', 'borderLeft': '1px solid #ccc'}, children=[
-            html.Div([
-                html.H4("Options:", style={'marginTop':'0px'}),
-                dcc.Checklist(
-                    id="line-chart-overall-toggle",
-                    options=[ {"label": "Overall Earthquakes", "value": "overall"}, {"label": "Overall Provinces", "value": "overall_provinces"}, {"label": "Overall Regions", "value": "overall_regions"}, {"label": "Overall Island Groups", "value": "overall_island_groups"} ],
-                    value=["overall"]),
-                html.Br(), html.Label("Sort by:"), html.Br(), html.Br(),
-                dcc.Dropdown(
-                    id="line-chart-filter-type",
-                    options=[ {"label": "Province", "value": "Province"}, {"label": "Region", "value": "Region"}, {"label": "Island Group", "value": "Island Group"} ],
-                    placeholder="Select Filter Type"),
-                html.Div(id="line-chart-filter-selector-container", children=[
-                    dcc.Checklist(id="line-chart-filter-selector", value=[])
-                ], style={"display": "none", "maxHeight": "250px", "overflowY": "scroll"}),
-            ], style={"width": "250px", "overflowY": "auto", "borderRight": "1px solid #ccc", "padding": "10px", "flexShrink": 0, "backgroundColor": "#f9f9f9"}),
+        # Main map (choropleth map)
+        html.Div(id='main-map-container', style={'display': 'block', 'height': '75vh'}, children=[
+            dcc.Loading(id="loading-main-map", children=dcc.Graph(id="earthquake-map", style={'height': '100%'}))
+        ]),
 
-            html.Div([
-                html.Label("Select Year Range:", style={'marginLeft': '15px'}),
+        # Detail map (bubble map + line chart)
+        html.Div(id='detail-view-container', style={'display': 'none', 'flexDirection': 'row', 'height': '85vh'}, children=[
+            html.Div(id='bubble-map-wrapper', style={'flex': '2', 'paddingRight': '10px', 'display': 'flex', 'flexDirection': 'column'}, children=[
+                 html.H3(id="province-title", style={'textAlign': 'center', 'flexShrink': 0}),
+                 html.Label("Filter Bubble Map by Year:", style={'flexShrink': 0, 'marginLeft': '15px'}),
                  html.Div(
-                    dcc.RangeSlider(
-                        id="line-chart-year-slider", min=min_year, max=max_year, step=None,
-                        value=[min_year, max_year],
-                        marks={str(year): str(year) for year in available_years},
-                    ),
-                    style={'margin': '0 15px 15px 15px'}
+                     dcc.RangeSlider(
+                         id="bubble-year-slider", min=min_year, max=max_year, value=[min_year, max_year], step=1,
+                         marks={str(year): str(year) for year in available_years},
+                     ),
+                     style={'margin': '0 15px 15px 15px', 'flexShrink': 0}
                  ),
-                html.Br(),
-                dcc.Loading(id='loading-line-chart-explorer', children=dcc.Graph(id="line-chart-graph"))
-            ], style={"flexGrow": 1, 'display': 'flex', 'flexDirection': 'column'})
+                 dcc.Loading(id="loading-bubble-map", children=dcc.Graph(id="bubble-map", style={'flexGrow': 1, 'minHeight': 0}))
+            ]),
+
+            html.Div(id='line-chart-explorer-wrapper', style={'flex': '3', 'display': 'flex', 'borderLeft': '1px solid #ccc'}, children=[
+                html.Div([
+                    html.H4("Options:", style={'marginTop':'0px'}),
+                    dcc.Checklist(
+                        id="line-chart-overall-toggle",
+                        options=[ {"label": "Overall Earthquakes", "value": "overall"}, {"label": "Overall Provinces", "value": "overall_provinces"}, {"label": "Overall Regions", "value": "overall_regions"}, {"label": "Overall Island Groups", "value": "overall_island_groups"} ],
+                        value=["overall"]),
+                    dcc.Checklist(
+                        id="line-chart-declustered",
+                        options=[{"label": "Mainshocks only (declustered)", "value": "declustered"}],
+                        value=[]),
+                    html.Br(), html.Label("Sort by:"), html.Br(), html.Br(),
+                    dcc.Dropdown(
+                        id="line-chart-filter-type",
+                        options=[ {"label": "Province", "value": "Province"}, {"label": "Region", "value": "Region"}, {"label": "Island Group", "value": "Island Group"} ],
+                        placeholder="Select Filter Type"),
+                    html.Div(id="line-chart-filter-selector-container", children=[
+                        dcc.Checklist(id="line-chart-filter-selector", value=[])
+                    ], style={"display": "none", "maxHeight": "250px", "overflowY": "scroll"}),
+                ], style={"width": "250px", "overflowY": "auto", "borderRight": "1px solid #ccc", "padding": "10px", "flexShrink": 0, "backgroundColor": "#f9f9f9"}),
+
+                html.Div([
+                    html.Label("Select Year Range:", style={'marginLeft': '15px'}),
+                     html.Div(
+                        dcc.RangeSlider(
+                            id="line-chart-year-slider", min=min_year, max=max_year, step=None,
+                            value=[min_year, max_year],
+                            marks={str(year): str(year) for year in available_years},
+                        ),
+                        style={'margin': '0 15px 15px 15px'}
+                     ),
+                    html.Br(),
+                    dcc.Loading(id='loading-line-chart-explorer', children=dcc.Graph(id="line-chart-graph"))
+                ], style={"flexGrow": 1, 'display': 'flex', 'flexDirection': 'column'})
+            ]),
         ]),
-    ]),
 
-    html.Button("Back to Main Map", id="back-button", className="back-button-styled", style={"display": "none", 'marginTop': '15px'}),
-    html.Div(id="click-data", style={"display": "none"}),
-])
+        html.Button("Back to Main Map", id="back-button", className="back-button-styled", style={"display": "none", 'marginTop': '15px'}),
+        html.Div(id="click-data", style={"display": "none"}),
+
+        # Static data for the client-side choropleth, delivered once per page load
+        dcc.Store(id="province-geometry", data=data.province_geojson),
+        dcc.Store(id="choropleth-data", data=choropleth_data(data)),
+        dcc.Store(id="fault-overlay", data=data.fault_overlay),
+        dcc.Store(id="choropleth-config", data=choropleth_config),
+        dcc.Store(id="choropleth-frames"),
+        # Tiles of the "all events" layer for the current viewport (assets/event_tiles.js)
+        dcc.Store(id="event-tiles"),
+        dcc.Store(id="event-tile-config", data={"url": "/api/tiles", "version": data.version,
+                                                "max_zoom": tiles.MAX_ZOOM}),
+        # What the bubble map and line chart currently draw, so updates keeping
+        # the same traces can be sent as a Patch
+        dcc.Store(id="bubble-map-view"),
+        dcc.Store(id="line-chart-view"),
+    ])
+
+app.layout = serve_layout
+
+
+# Callback to update the main Choropleth Map (runs in the browser, see assets/choropleth.js)
+app.clientside_callback(
+    ClientsideFunction(namespace="seismic", function_name="updateMap"),
+    Output("earthquake-map", "figure"),
+    Input("magnitude-slider", "value"),
+    Input("fault-toggle", "value"),
+    Input("choropleth-metric", "value"),
+    Input("choropleth-data", "data"),
+    Input("choropleth-frames", "data"),
+    Input("event-tiles", "data"),
+    State("province-geometry", "data"),
+    State("fault-overlay", "data"),
+    State("choropleth-config", "data"),
+)
 
+# The "all events" layer fetches the tiles in view straight from /api/tiles
+# whenever the map is panned or zoomed or an event filter changes
+app.clientside_callback(
+    ClientsideFunction(namespace="seismic", function_name="loadEventTiles"),
+    Output("event-tiles", "data"),
+    Input("events-layer-toggle", "value"),
+    Input("earthquake-map", "relayoutData"),
+    Input("event-magnitude-slider", "value"),
+    Input("event-depth-slider", "value"),
+    Input("fault-distance", "value"),
+    Input("event-year-slider", "value"),
+    Input("declustered-toggle", "value"),
+    State("event-tile-config", "data"),
+    State("choropleth-config", "data"),
+)
 
-# Callback to update the main Choropleth Map
+def slider_range(value, bounds):
+    """A range slider value as a cache key; None when it covers every value."""
+    if not value:
+        return None
+    if value[0] <= bounds[0] and value[1] >= bounds[1]:
+        return None
+    return tuple(value)
+
+def filter_ranges(data, magnitude_range, depth_range, year_range, max_fault_distance):
+    """(magnitude, depth, fault distance, year) filters in the form the caches are keyed on."""
+    return (slider_range(magnitude_range, data.event_magnitude_bounds),
+            slider_range(depth_range, data.event_depth_bounds),
+            max_fault_distance,
+            slider_range(year_range, (data.min_year, data.max_year)))
+
+# Callback to recompute per-province statistics for the event-level filters
 @app.callback(
-    Output("earthquake-map", "figure"),
-    [Input("magnitude-slider", "value"),
-     Input("fault-toggle", "value")]
+    Output("choropleth-data", "data"),
+    Input("event-magnitude-slider", "value"),
+    Input("event-depth-slider", "value"),
+    Input("fault-distance", "value"),
+    Input("event-year-slider", "value"),
+    Input("declustered-toggle", "value"),
+    prevent_initial_call=True
 )
-def update_map(idx, fault_toggle):
-    # Default values in case of issues
-    choro_data = pd.DataFrame()
-    color_scale = px.colors.sequential.YlOrRd # Default scale
-    range_color = [1, 5] # Default range
-    show_scale_bar = False
-    fig = go.Figure() # Initialize empty figure
-
-    # Validate index
-    if idx < 0 or idx >= len(magnitude_ranges):
-        fig.update_layout(title="Error: Invalid magnitude selection")
-        return fig # Return empty fig with error
-
-    # Prepare data for choropleth based on slider
-    if magnitude_ranges[idx] is None: # "All" selected
-        if province_ave_magnitudes is None or province_ave_magnitudes.empty:
-            fig.update_layout(title="Error: Missing average magnitude data")
-            return fig
-        choro_data = province_ave_magnitudes.copy()
-        color_scale = px.colors.sequential.YlOrRd
-        if 'Magnitude' in choro_data.columns and not choro_data['Magnitude'].isnull().all():
-             range_color = [choro_data['Magnitude'].min(), choro_data['Magnitude'].max()]
-        show_scale_bar = True
-    else: # Specific magnitude range selected
-        if province_ave_magnitudes is None or province_ave_magnitudes.empty:
-            fig.update_layout(title="Error: Missing average magnitude data")
-            return fig
-        min_mag, max_mag = magnitude_ranges[idx]
-        choro_data = province_ave_magnitudes[
-            (province_ave_magnitudes["Magnitude"] >= min_mag) &
-            (province_ave_magnitudes["Magnitude"] <= max_mag)
-        ].copy()
-        if idx - 1 >= 0 and idx - 1 < len(magnitude_colors):
-             single_color = magnitude_colors[idx - 1]
-        else:
-             single_color = "#CCCCCC" # Default grey if color index is bad
-        color_scale = [[0, single_color], [1, single_color]]
-        range_color = [min_mag, max_mag]
-        show_scale_bar = False
-
-    # Handle empty selection for specific ranges
-    if choro_data.empty and magnitude_ranges[idx] is not None:
-         fig.update_layout(title=f"No provinces with average magnitude {magnitude_labels[idx]}")
-         return fig
-
-    # Merge population data for hover info
-    custom_data_array = np.array([[]]) # Initialize empty
-    pop_cols = ["2020", "2015", "2010", "2000"]
-    hover_template_pop = "Population data unavailable<extra></extra>"
-    if population_df is not None and not population_df.empty and 'Province' in population_df.columns and 'adm2_en' in choro_data.columns:
-        choro_data = choro_data.merge(population_df, left_on="adm2_en", right_on="Province", how="left")
-        # Ensure all pop columns exist before creating customdata
-        for col in pop_cols:
-            if col not in choro_data:
-                choro_data[col] = 0 # Add column with 0 if missing after merge
-        custom_data_array = choro_data[pop_cols].fillna(0).values
-        hover_template_pop = ("Pop (2020): %{customdata[0]:,}<br>" +
-                              "Pop (2015): %{customdata[1]:,}<br>" +
-                              "Pop (2010): %{customdata[2]:,}<br>" +
-                              "Pop (2000): %{customdata[3]:,}<extra></extra>")
-
-    # Add Choropleth trace if data exists
-    if not choro_data.empty and 'adm2_en' in choro_data.columns and 'Magnitude' in choro_data.columns:
-        fig.add_trace(go.Choroplethmapbox(
-            geojson=gdf_ph_provinces.__geo_interface__,
-            locations=choro_data["adm2_en"],
-            z=choro_data["Magnitude"],
-            featureidkey="properties.adm2_en",
-            colorscale=color_scale,
-            zmin=range_color[0], zmax=range_color[1],
-            marker_opacity=0.7, marker_line_width=0.5,
-            showscale=show_scale_bar,
-            colorbar_title="Avg Magnitude" if show_scale_bar else "",
-            customdata=custom_data_array,
-            hovertemplate=(
-                "<b>%{location}</b><br>" +
-                "Average Magnitude: %{z:.2f}<br>" +
-                hover_template_pop
-            )
-        ))
-
-    # Overlay fault lines if toggled and data exists
-    if fault_toggle and ph_faults is not None and not ph_faults.empty and 'geometry' in ph_faults.columns and 'name' in ph_faults.columns:
-        for _, row in ph_faults.iterrows():
-            fault_geometry = row.geometry
-            fault_name = row['name'] if pd.notna(row['name']) else "Unnamed Fault" # Handle potential null names
-            if fault_geometry is None or fault_geometry.is_empty: continue
-
-            lines_to_plot = []
-            if fault_geometry.geom_type == 'LineString':
-                lines_to_plot = [fault_geometry]
-            elif fault_geometry.geom_type == 'MultiLineString':
-                lines_to_plot = list(fault_geometry.geoms)
-
-            for line in lines_to_plot:
-                 if line is None or line.is_empty: continue
-                 lon, lat = line.xy
-                 fig.add_trace(go.Scattermapbox(
-                    lat=list(lat), lon=list(lon),
-                    mode='lines', line=dict(color='black', width=2),
-                    name="Fault Line",
-                    text=f"<b>Fault:</b> {fault_name}",
-                    hoverinfo='text',
-                    showlegend=False
-                 ))
-
-    # Update Layout
-    fig.update_layout(
-        mapbox_style="carto-positron",
-        mapbox_zoom=4.5,
-        mapbox_center={"lat": 12.8797, "lon": 121.7740},
-        margin={"r": 0, "t": 0, "l": 0, "b": 0},
-        clickmode='event+select'
-    )
+def update_choropleth_data(magnitude_range, depth_range, max_fault_distance=None, year_range=None, declustered=False):
+    data = current_data()
+    with metrics.phase("data"):
+        return choropleth_data(data, *filter_ranges(data, magnitude_range, depth_range, year_range, max_fault_distance),
+                               bool(declustered))
 
-    return fig
+# Callback to compute the playback frames; the animation itself runs in the browser
+@app.callback(
+    Output("choropleth-frames", "data"),
+    Input("playback-granularity", "value"),
+    Input("playback-window", "value"),
+    Input("event-magnitude-slider", "value"),
+    Input("event-depth-slider", "value"),
+    Input("fault-distance", "value"),
+    Input("event-year-slider", "value"),
+    Input("declustered-toggle", "value"),
+    prevent_initial_call=True
+)
+def update_choropleth_frames(granularity, window, magnitude_range, depth_range, max_fault_distance=None,
+                             year_range=None, declustered=False):
+    if granularity not in ("year", "month"):
+        # Filter changes while playback is off leave the (empty) frames alone
+        return None if dash.ctx.triggered_id == "playback-granularity" else dash.no_update
+    data = current_data()
+    with metrics.phase("data"):
+        return cached_choropleth_frames(data, granularity, int(window or 1),
+                                        *filter_ranges(data, magnitude_range, depth_range, year_range,
+                                                       max_fault_distance), bool(declustered))
 
 # Callback to handle clicks on the main map -> Show Bubble Map
 @app.callback(
@@ -365,85 +692,223 @@ def handle_map_click(clickData):
                  click_data_store, province_title_bubble,
                  line_chart_filter_type_init, line_chart_filter_selector_init)
     except Exception as e:
-         traceback.print_exc()
+         metrics.report_exception()
          return [dash.no_update] * 8
 
+# Above BUBBLE_MAX_POINTS events the bubble map switches to grid cells sized
+# by event count and colored by max magnitude; only the BUBBLE_TOP_EVENTS
+# strongest events are still drawn individually.
+BUBBLE_MAX_POINTS = int(os.environ.get("SEISMIC_BUBBLE_MAX_POINTS", 5000))
+BUBBLE_TOP_EVENTS = int(os.environ.get("SEISMIC_BUBBLE_TOP_EVENTS", 500))
+BUBBLE_BIN_SIZE = float(os.environ.get("SEISMIC_BUBBLE_BIN_SIZE", 0.05)) # degrees, roughly 5 km
+BUBBLE_CACHE_SIZE = int(os.environ.get("SEISMIC_BUBBLE_CACHE_SIZE", 128))
+# Finished figures, room for every province over the full year range (warmed
+# at startup) plus recently viewed ranges
+BUBBLE_FIGURE_CACHE_SIZE = int(os.environ.get("SEISMIC_BUBBLE_FIGURE_CACHE_SIZE", 256))
+
+def bubble_events(data, province, start_year, end_year, max_fault_distance=None):
+    # Slice the province's date-sorted block (see indexes.ProvinceEventIndex)
+    events = data.bubble_index.query(province, start_year, end_year)
+    if max_fault_distance is not None and "Fault_Distance_Km" in events.columns:
+        events = events[events["Fault_Distance_Km"].to_numpy() <= np.float32(max_fault_distance)]
+    return events
+
+@lru_cache(maxsize=BUBBLE_CACHE_SIZE)
+def cached_bubble_bins(data, province, start_year, end_year, max_fault_distance=None):
+    """(grid cells, strongest events) of a province, year range and fault distance."""
+    events = bubble_events(data, province, start_year, end_year, max_fault_distance)
+    bins = grid_bins(events["Latitude"], events["Longitude"], events["Magnitude"], BUBBLE_BIN_SIZE)
+    return bins, events.nlargest(BUBBLE_TOP_EVENTS, "Magnitude")
+
+BUBBLE_SIZE_MAX = 15
+
+def event_hover(events, province):
+    """(customdata, hovertemplate) for individual events of one province.
+
+    Values are sent at catalog precision (float32 columns widened to their
+    shortest decimal form), dates without the time of day and the province,
+    shared by every point, inside the template, so the per-point payload
+    stays small.
+    """
+    events = widen_float32(events)
+    columns = [events["Depth_In_Km"], events["Date"].dt.strftime("%Y-%m-%d")]
+    template = ("<b>%{hovertext}</b><br>Magnitude: %{marker.color:.1f}<br>Depth_In_Km: %{customdata[0]:.1f} km<br>"
+                f"Date: %{{customdata[1]}}<br>Province: {province}")
+    if "Fault_Distance_Km" in events.columns:
+        columns += [events["Nearest_Fault"].astype(object), events["Fault_Distance_Km"]]
+        template += "<br>Nearest_Fault: %{customdata[2]}<br>Fault_Distance_Km: %{customdata[3]:.1f} km"
+    return np.column_stack(columns), template + "<extra></extra>"
+
+def build_binned_bubble_figure(bins, top_events, province):
+    color_range = [float(min(bins["Max Magnitude"].min(), top_events["Magnitude"].min())),
+                   float(bins["Max Magnitude"].max())]
+    fig = go.Figure(layout={"template": "plotly_white"})
+    fig.add_trace(go.Scattermapbox(
+        lat=bins["Latitude"].round(5), lon=bins["Longitude"].round(5), mode="markers",
+        marker=dict(size=(4 + 16 * np.sqrt(bins["Count"] / bins["Count"].max())).round(2),
+                    color=bins["Max Magnitude"].round(1),
+                    colorscale="Reds", cmin=color_range[0], cmax=color_range[1],
+                    opacity=0.6, colorbar=dict(title="Max Magnitude")),
+        customdata=bins["Count"],
+        hovertemplate="<b>%{customdata:,} earthquakes</b><br>Max Magnitude: %{marker.color:.1f}<extra></extra>",
+        name="Earthquakes (binned)", showlegend=False,
+    ))
+    customdata, hovertemplate = event_hover(top_events, province)
+    top = widen_float32(top_events[["Latitude", "Longitude", "Magnitude"]])
+    fig.add_trace(go.Scattermapbox(
+        lat=top["Latitude"], lon=top["Longitude"], mode="markers",
+        marker=dict(size=7, color=top["Magnitude"], colorscale="Reds",
+                    cmin=color_range[0], cmax=color_range[1]),
+        hovertext=top_events["Location"], customdata=customdata, hovertemplate=hovertemplate,
+        name="Strongest earthquakes", showlegend=False,
+    ))
+    return fig
+
+def build_event_bubble_figure(events, province):
+    """Individual events sized and colored by magnitude, drawn as px.scatter_mapbox would."""
+    customdata, hovertemplate = event_hover(events, province)
+    values = widen_float32(events[["Latitude", "Longitude", "Magnitude"]])
+    magnitude = values["Magnitude"]
+    fig = go.Figure(layout={
+        "template": "plotly_white",
+        "coloraxis": {"colorscale": px.colors.sequential.Reds, "colorbar": {"title": {"text": "Magnitude"}}},
+    })
+    fig.add_trace(go.Scattermapbox(
+        lat=values["Latitude"], lon=values["Longitude"], mode="markers",
+        marker=dict(size=magnitude, color=magnitude, coloraxis="coloraxis", sizemode="area",
+                    sizeref=2.0 * float(magnitude.max()) / BUBBLE_SIZE_MAX ** 2),
+        hovertext=events["Location"], customdata=customdata, hovertemplate=hovertemplate,
+        name="", showlegend=False,
+    ))
+    return fig
+
+# Per-point arrays of the bubble map traces, and the marker scaling that follows the data
+PATCHED_TRACE_PROPERTIES = [("lat",), ("lon",), ("customdata",), ("hovertext",), ("marker", "size"),
+                            ("marker", "color"), ("marker", "cmin"), ("marker", "cmax"), ("marker", "sizeref")]
+
+def figure_patch(fig, layout=()):
+    """Patch turning a client figure with the same traces into `fig`.
+
+    Only the per-point arrays of each trace (and the marker scaling that
+    depends on them) are replaced, along with the given top-level layout
+    properties; trace styling, the template, map settings and the rest of
+    the layout stay as they are on the client. Values are assigned whole
+    rather than extended, so the result does not depend on which earlier
+    responses the client applied.
+    """
+    patch = Patch()
+    for i, trace in enumerate(fig.data):
+        for path in PATCHED_TRACE_PROPERTIES:
+            value = trace
+            for key in path:
+                value = value[key]
+            if value is not None:
+                target = patch["data"][i]
+                for key in path[:-1]:
+                    target = target[key]
+                target[path[-1]] = value
+    for name in layout:
+        patch["layout"][name] = fig.layout[name]
+    return patch
+
 # Callback to update the Bubble Map based on clicked province and year slider
+#
+# The view (snapshot version, province and whether events are binned) is
+# kept next to the figure. While it stays the same the traces do too, so a
+# slider or fault-distance change only sends a Patch with the new point arrays
+# and title, and the map keeps its trace styling, template, settings and the
+# user's pan/zoom.
 @app.callback(
     Output("bubble-map", "figure"),
+    Output("bubble-map-view", "data"),
     Input("click-data", "children"),
-    Input("bubble-year-slider", "value")
+    Input("bubble-year-slider", "value"),
+    Input("fault-distance", "value"),
+    State("bubble-map-view", "data")
 )
-def update_bubble_map(clicked_province, year_range):
+def update_bubble_map(clicked_province, year_range, max_fault_distance=None, shown_view=None):
+    data = current_data()
+    if isinstance(year_range, (list, tuple)) and len(year_range) == 2:
+        fig_bubble, view = cached_bubble_map_figure(data, clicked_province, tuple(year_range), max_fault_distance)
+    else:
+        fig_bubble, view = bubble_map_figure(data, clicked_province, year_range, max_fault_distance)
+    if view is not None and view == shown_view:
+        return figure_patch(fig_bubble, layout=["title"]), dash.no_update
+    return fig_bubble, view
+
+def bubble_map_figure(data, clicked_province, year_range, max_fault_distance=None):
+    """(figure, view) for the bubble map; the view is None for message-only figures."""
+    bubble_index = data.bubble_index
     # Initialize empty figure
     fig_bubble = go.Figure(layout={"template": "plotly_white"})
 
     # Check if province is selected
     if not clicked_province:
         fig_bubble.update_layout(title="Select a province on the main map")
-        return fig_bubble
+        return fig_bubble, None
 
     # Check if year range is valid
     if not isinstance(year_range, (list, tuple)) or len(year_range) != 2:
          fig_bubble.update_layout(title="Error: Invalid year range")
-         return fig_bubble
+         return fig_bubble, None
 
     # Ensure required columns exist in earthquake data
-    required_cols = ["Province", "Year_Earthquake", "Latitude", "Longitude", "Magnitude", "Location", "Depth_In_Km", "Date"]
-    if not all(col in magnitude_df.columns for col in required_cols):
+    if bubble_index is None:
          fig_bubble.update_layout(title="Error: Missing required earthquake data columns")
-         return fig_bubble
-
-    # Filter the main earthquake dataframe
-    filtered_eq = magnitude_df[
-        (magnitude_df["Province"].astype(str).str.strip() == str(clicked_province).strip()) &
-        (magnitude_df["Year_Earthquake"] >= year_range[0]) &
-        (magnitude_df["Year_Earthquake"] <= year_range[1])
-    ].copy()
+         return fig_bubble, None
+
+    fault_note = f" within {max_fault_distance} km of a fault" if max_fault_distance is not None else ""
+    with metrics.phase("data"):
+        # The year-range count bounds the filtered one, so large provinces go
+        # straight to the cached bins and a cache hit gathers no events
+        binned = bubble_index.count(clicked_province, year_range[0], year_range[1]) > BUBBLE_MAX_POINTS
+        if binned:
+            bins, top_events = cached_bubble_bins(data, clicked_province, year_range[0], year_range[1],
+                                                  max_fault_distance)
+            n_events = int(bins["Count"].sum())
+            binned = n_events > BUBBLE_MAX_POINTS
+        if not binned:
+            filtered_eq = bubble_events(data, clicked_province, year_range[0], year_range[1], max_fault_distance)
+            n_events = len(filtered_eq)
 
     # Handle case of no earthquakes found
-    if filtered_eq.empty:
-         fig_bubble.update_layout(title=f"No recorded earthquakes in {clicked_province} ({year_range[0]}-{year_range[1]})")
-         return fig_bubble
+    if n_events == 0:
+         fig_bubble.update_layout(title=f"No recorded earthquakes in {clicked_province} ({year_range[0]}-{year_range[1]})"
+                                        + fault_note)
+         return fig_bubble, None
 
-    # Get province geometry for centering
+    # Center on the province's precomputed bounding-box center
     center_lat, center_lon, zoom_level = 12.8797, 121.7740, 6 # Defaults
-    if gdf_ph_provinces is not None and 'adm2_en' in gdf_ph_provinces.columns and 'geometry' in gdf_ph_provinces.columns:
-        province_geo_series = gdf_ph_provinces[gdf_ph_provinces["adm2_en"] == clicked_province].geometry
-        if not province_geo_series.empty:
-             province_geom = province_geo_series.iloc[0]
-             if province_geom and not province_geom.is_empty:
-                 bounds = province_geom.bounds # This returns a tuple (minx, miny, maxx, maxy)
-                 center_lon = (bounds[0] + bounds[2]) / 2 # Use index 0 for minx, 2 for maxx
-                 center_lat = (bounds[1] + bounds[3]) / 2 # Use index 1 for miny, 3 for maxy
-                 zoom_level = 8 # Reset zoom for specific province
-
-    # Create the scatter mapbox figure if filtered data exists
-    fig_bubble = px.scatter_mapbox(
-        filtered_eq,
-        lat="Latitude", lon="Longitude",
-        size="Magnitude", color="Magnitude",
-        color_continuous_scale=px.colors.sequential.Reds,
-        size_max=15,
-        hover_name="Location",
-        hover_data={
-             "Magnitude": ":.1f", "Depth_In_Km": ":.1f km", "Date": "|%Y-%m-%d",
-             "Province": True, "Latitude": False, "Longitude": False
-        },
-        custom_data=['Date'] # Keep if needed for future interactions
-    )
-
-    # Update layout for bubble map
-    fig_bubble.update_layout(
-        mapbox_style="carto-positron",
-        mapbox_center={"lat": center_lat, "lon": center_lon},
-        mapbox_zoom=zoom_level,
-        margin={"r": 0, "t": 40, "l": 0, "b": 0},
-        title=f"Earthquakes in {clicked_province} ({year_range[0]}-{year_range[1]})",
-        legend_title_text='Magnitude'
-    )
-
-    return fig_bubble
+    province_center = bubble_index.center(clicked_province)
+    if province_center is not None:
+         center_lat, center_lon = province_center
+         zoom_level = 8 # Reset zoom for specific province
+
+    title = f"Earthquakes in {clicked_province} ({year_range[0]}-{year_range[1]})" + fault_note
+    with metrics.phase("figure"):
+        if binned:
+            fig_bubble = build_binned_bubble_figure(bins, top_events, clicked_province)
+            title += f": {n_events:,} events in {len(bins):,} cells, strongest {len(top_events):,} shown"
+        else:
+            fig_bubble = build_event_bubble_figure(filtered_eq, clicked_province)
+
+        # Update layout for bubble map
+        fig_bubble.update_layout(
+            mapbox_style="carto-positron",
+            mapbox_center={"lat": center_lat, "lon": center_lon},
+            mapbox_zoom=zoom_level,
+            margin={"r": 0, "t": 40, "l": 0, "b": 0},
+            title=title,
+            legend_title_text='Magnitude'
+        )
+
+    view = {"version": data.version, "province": clicked_province, "binned": bool(binned)}
+    return fig_bubble, view
+
+# Figures are shared between callers and never modified once built
+@lru_cache(maxsize=BUBBLE_FIGURE_CACHE_SIZE)
+def cached_bubble_map_figure(data, clicked_province, year_range, max_fault_distance=None):
+    return bubble_map_figure(data, clicked_province, year_range, max_fault_distance)
 
 
 # Callback for the Back Button -> Show Main Map
@@ -466,7 +931,8 @@ def go_back_to_main_map(n_clicks):
         line_chart_overall_reset = ["overall"]
         line_chart_filter_type_reset = None
         line_chart_filter_selector_reset = []
-        line_chart_year_slider_reset = [min_year, max_year]
+        data = current_data()
+        line_chart_year_slider_reset = [data.min_year, data.max_year]
         main_map_style = {"display": "block"}
         main_controls_style = {"display": "block"}
         detail_view_style = {"display": "none"}
@@ -477,7 +943,7 @@ def go_back_to_main_map(n_clicks):
                 click_data_store, line_chart_overall_reset, line_chart_filter_type_reset,
                 line_chart_filter_selector_reset, line_chart_year_slider_reset)
     except Exception as e:
-        traceback.print_exc()
+        metrics.report_exception()
         return [dash.no_update] * 9
 
 
@@ -488,6 +954,8 @@ def go_back_to_main_map(n_clicks):
     Input("line-chart-filter-type", "value")
 )
 def update_line_chart_checklist(filter_type):
+    data = current_data()
+    provinces, regions, island_groups = data.provinces, data.regions, data.island_groups
     options = []
     style = {"display": "none"}
     if filter_type == "Province":
@@ -502,82 +970,121 @@ def update_line_chart_checklist(filter_type):
     return style, options
 
 
+# The traces shown, (name, mode) pairs, are kept next to the figure; when a
+# change (typically the year slider) keeps the same traces, only their x/y
+# arrays and the x-axis range are sent as a Patch.
 @app.callback(
     Output("line-chart-graph", "figure"),
+    Output("line-chart-view", "data"),
     Input("line-chart-filter-selector", "value"),
     Input("line-chart-filter-type", "value"),
     Input("line-chart-overall-toggle", "value"),
-    Input("line-chart-year-slider", "value")
+    Input("line-chart-year-slider", "value"),
+    Input("line-chart-declustered", "value"),
+    State("line-chart-view", "data")
 )
-def update_line_chart_explorer_graph(selected_values, filter_type, overall_toggle, year_range):
-    if earthquake_counts.empty or overall_counts.empty:
-         return go.Figure(layout={"title": "Data unavailable", "template": "plotly_white"})
+def update_line_chart_explorer_graph(selected_values, filter_type, overall_toggle, year_range, declustered=(),
+                                     shown_view=None):
+    data = current_data()
+    count_cubes, available_years = data.count_cubes, data.available_years
+    declustered = bool(declustered) and bool(data.mainshock_count_cubes)
+    if declustered:
+        count_cubes = data.mainshock_count_cubes
+    provinces, regions, island_groups = data.provinces, data.regions, data.island_groups
+    if not count_cubes:
+         return go.Figure(layout={"title": "Data unavailable", "template": "plotly_white"}), None
 
     try:
         start_year, end_year = year_range
-        filtered_ec = earthquake_counts[ (earthquake_counts['Year'] >= start_year) & (earthquake_counts['Year'] <= end_year) ]
-        filtered_oc = overall_counts[ (overall_counts['Year'] >= start_year) & (overall_counts['Year'] <= end_year) ]
 
         fig = go.Figure()
         fig.update_layout(
             title="Earthquake Trends Explorer",
-            xaxis_title="Year", yaxis_title="Number of Earthquakes",
+            xaxis_title="Year", yaxis_title="Number of Mainshocks" if declustered else "Number of Earthquakes",
             template="plotly_white", margin=dict(l=40, r=20, t=60, b=40),
             xaxis=dict( tickmode='array', tickvals=available_years, ticktext=[str(year) for year in available_years], range=[start_year - 0.5, end_year + 0.5] )
         )
-        traces_added = False
 
-        if "overall" in overall_toggle and not filtered_oc.empty:
-            fig.add_trace(go.Scatter(x=filtered_oc["Year"], y=filtered_oc["Number of Earthquakes"], mode="lines", name="Overall Earthquakes", line=dict(dash="dot")))
-            traces_added = True
+        # (cube, entities, trace mode, line style) for every requested group of series
+        requests = []
+        if "overall" in overall_toggle:
+            requests.append((count_cubes["Overall"], ["Overall"], "lines", dict(dash="dot")))
         if "overall_provinces" in overall_toggle:
-            prov_agg = filtered_ec.groupby(['Year', 'Province'])['Number of Earthquakes'].sum().reset_index()
-            for province in provinces:
-                province_data = prov_agg[prov_agg['Province'] == province]
-                if not province_data.empty:
-                    fig.add_trace(go.Scatter(x=province_data["Year"], y=province_data["Number of Earthquakes"], mode="lines", name=province))
-                    traces_added = True
+            requests.append((count_cubes["Province"], provinces, "lines", None))
         if "overall_regions" in overall_toggle:
-             reg_agg = filtered_ec.groupby(['Year', 'Region'])['Number of Earthquakes'].sum().reset_index()
-             for region in regions:
-                region_data = reg_agg[reg_agg['Region'] == region]
-                if not region_data.empty:
-                    fig.add_trace(go.Scatter(x=region_data["Year"], y=region_data["Number of Earthquakes"], mode="lines", name=region))
-                    traces_added = True
+            requests.append((count_cubes["Region"], regions, "lines", None))
         if "overall_island_groups" in overall_toggle:
-             ig_agg = filtered_ec.groupby(['Year', 'Island Group'])['Number of Earthquakes'].sum().reset_index()
-             for ig in island_groups:
-                ig_data = ig_agg[ig_agg['Island Group'] == ig]
-                if not ig_data.empty:
-                    fig.add_trace(go.Scatter(x=ig_data["Year"], y=ig_data["Number of Earthquakes"], mode="lines", name=ig))
-                    traces_added = True
-
-        if selected_values and filter_type:
-            filtered_data_specific = filtered_ec[filtered_ec[filter_type].isin(selected_values)]
-            if not filtered_data_specific.empty:
-                 if filter_type in ["Region", "Island Group"]:
-                     grouped_data = filtered_data_specific.groupby(['Year', filter_type])['Number of Earthquakes'].sum().reset_index()
-                     for item in selected_values:
-                         subset = grouped_data[grouped_data[filter_type] == item]
-                         if not subset.empty:
-                              fig.add_trace(go.Scatter(x=subset["Year"], y=subset["Number of Earthquakes"], mode="lines+markers", name=item))
-                              traces_added = True
-                 else:
-                     prov_select_agg = filtered_data_specific.groupby(['Year', 'Province'])['Number of Earthquakes'].sum().reset_index()
-                     for item in selected_values:
-                        subset = prov_select_agg[prov_select_agg[filter_type] == item]
-                        if not subset.empty:
-                             fig.add_trace(go.Scatter(x=subset["Year"], y=subset["Number of Earthquakes"], mode="lines+markers", name=item))
-                             traces_added = True
+            requests.append((count_cubes["Island Group"], island_groups, "lines", None))
+        if selected_values and filter_type in count_cubes:
+            requests.append((count_cubes[filter_type], selected_values, "lines+markers", None))
+
+        with metrics.phase("data"):
+            series = []
+            for cube, entities, mode, line in requests:
+                for name, years, counts in cube.series(entities, start_year, end_year):
+                    if cube is count_cubes["Overall"]:
+                        name = "Overall Earthquakes"
+                    series.append((name, years, counts, mode, line))
+
+        view = {"version": data.version, "declustered": declustered,
+                "traces": [[name, mode] for name, _, _, mode, _ in series]}
+        if series and view == shown_view:
+            with metrics.phase("figure"):
+                patch = Patch()
+                for i, (_, years, counts, _, _) in enumerate(series):
+                    patch["data"][i].update({"x": years, "y": counts})
+                patch["layout"]["xaxis"]["range"] = [start_year - 0.5, end_year + 0.5]
+            return patch, dash.no_update
+
+        traces_added = False
+        with metrics.phase("figure"):
+            for name, years, counts, mode, line in series:
+                fig.add_trace(go.Scatter(x=years, y=counts, mode=mode, name=name, line=line))
+                traces_added = True
 
         if not traces_added:
              fig.update_layout(title="Select options or adjust year range to view trends")
 
-        return fig
+        return fig, view
 
     except Exception as e:
-        traceback.print_exc()
-        return go.Figure(layout={"title": "Error generating line chart", "template": "plotly_white"})
+        metrics.report_exception()
+        return go.Figure(layout={"title": "Error generating line chart", "template": "plotly_white"}), None
+
+
+"""## Warm-up
+
+The responses most visitors ask for first, computed in the background
+after startup and after every snapshot swap (see warmup.py): the
+per-province statistics of every fault-distance and declustering state
+with the sliders at their full range, the playback frames of those
+defaults, the bubble map of every province over the full year range, the
+unfiltered event tiles around the initial map zoom and, last as it takes
+longest, the bootstrap of the Gutenberg-Richter metrics.
+"""
+
+def warmup_tasks(data):
+    tasks = []
+    for declustered in (False, True):
+        for max_fault_distance in [None] + FAULT_DISTANCES_KM:
+            tasks.append(partial(choropleth_data, data, None, None, max_fault_distance, None, declustered))
+        for granularity in ("year", "month"):
+            for window in PLAYBACK_WINDOWS:
+                tasks.append(partial(cached_choropleth_frames, data, granularity, window, None, None, None, None,
+                                     declustered))
+    if data.bubble_index is not None:
+        # The names map clicks send
+        for province in data.province_names:
+            tasks.append(partial(cached_bubble_map_figure, data, province, (data.min_year, data.max_year), None))
+    # Unfiltered event tiles around the initial zoom of the main map
+    for zoom in range(int(MAIN_MAP_ZOOM) - 1, int(MAIN_MAP_ZOOM) + 3):
+        for x, y in data.tile_pyramid.occupied(zoom):
+            tasks.append(partial(data.tile_pyramid.response, zoom, x, y))
+    for declustered in (False, True):
+        tasks.append(partial(gr_uncertainty, data, None, declustered, wait=True))
+    return tasks
+
+warmups.start(current_data().version, warmup_tasks(current_data()))
 
 
 # --- Run the App ---
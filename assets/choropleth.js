@@ -0,0 +1,209 @@
+// Client-side rendering of the main choropleth map.
+// Geometry, per-province statistics and the fault overlay arrive through
+// dcc.Store; the magnitude slider, metric and fault toggle only restyle in the
+// browser. In playback mode the per-period statistics become Plotly animation
+// frames that only replace z (and the event counts for the hover), so the
+// geometry is drawn from the copy already in the figure. The "all events"
+// layer (assets/event_tiles.js) is drawn on top in both modes.
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    seismic: Object.assign({}, (window.dash_clientside || {}).seismic, {
+        updateMap: function (idx, faultToggle, metric, data, frames, eventTiles, geometry, faults, config) {
+            var fig = {data: [], layout: {}};
+            if (frames && frames.labels && frames.labels.length) {
+                return window.dash_clientside.seismic.playbackMap(idx, faultToggle, metric, frames, eventTiles, geometry, faults, config);
+            }
+
+            // Validate index
+            if (idx === null || idx === undefined || idx < 0 || idx >= config.ranges.length) {
+                fig.layout.title = "Error: Invalid magnitude selection";
+                return fig;
+            }
+            if (!data || !data.locations) {
+                fig.layout.title = "Error: Missing average magnitude data";
+                return fig;
+            }
+            if (data.locations.length === 0) {
+                fig.layout.title = "No earthquakes match the selected magnitude and depth filters";
+                return fig;
+            }
+
+            var info = config.metrics[metric] || config.metrics.mean;
+            var values = data[metric] || data.mean;
+
+            // Magnitude bands only apply to magnitude-valued metrics
+            var range = info.bands ? config.ranges[idx] : null;
+            var keep = [];
+            var colorscale, rangeColor, showScaleBar;
+            if (range === null) { // "All" selected
+                // Null where a metric has no estimate (too few events)
+                for (var i = 0; i < values.length; i++) if (values[i] !== null) keep.push(i);
+                colorscale = config.colorscale;
+                var kept = keep.map(function (k) { return values[k]; });
+                rangeColor = [Math.min.apply(null, kept), Math.max.apply(null, kept)];
+                showScaleBar = true;
+                if (keep.length === 0) {
+                    fig.layout.title = "Too few earthquakes for " + info.label.toLowerCase() + " in any province";
+                    return fig;
+                }
+            } else { // Specific magnitude range selected
+                for (var j = 0; j < values.length; j++) {
+                    if (values[j] !== null && values[j] >= range[0] && values[j] <= range[1]) keep.push(j);
+                }
+                var singleColor = config.colors[idx - 1] || "#CCCCCC";
+                colorscale = [[0, singleColor], [1, singleColor]];
+                rangeColor = range;
+                showScaleBar = false;
+                if (keep.length === 0) {
+                    fig.layout.title = "No provinces with " + info.label.toLowerCase() + " " + config.labels[idx];
+                    return fig;
+                }
+            }
+
+            var pick = function (arr) { return keep.map(function (k) { return arr[k]; }); };
+            // customdata: [events, population 2020, 2015, 2010, 2000, uncertainty]
+            var hoverPop = "Population data unavailable<extra></extra>";
+            var errors = info.error ? data[info.error] : null;
+            var customdata = keep.map(function (k) {
+                return [data.count[k]].concat(data.customdata ? data.customdata[k] : [], errors ? [errors[k]] : []);
+            });
+            var hoverError = errors ? " ± %{customdata[" + (data.customdata ? 5 : 1) + "]:.2f}" : "";
+            if (data.customdata) {
+                hoverPop = "Pop (2020): %{customdata[1]:,}<br>" +
+                           "Pop (2015): %{customdata[2]:,}<br>" +
+                           "Pop (2010): %{customdata[3]:,}<br>" +
+                           "Pop (2000): %{customdata[4]:,}<extra></extra>";
+            }
+
+            fig.data.push({
+                type: "choroplethmapbox",
+                geojson: geometry,
+                locations: pick(data.locations),
+                z: pick(values),
+                featureidkey: "properties.adm2_en",
+                colorscale: colorscale,
+                zmin: rangeColor[0], zmax: rangeColor[1],
+                marker: {opacity: 0.7, line: {width: 0.5}},
+                showscale: showScaleBar,
+                colorbar: {title: {text: showScaleBar ? info.colorbar : ""}},
+                customdata: customdata,
+                hovertemplate: "<b>%{location}</b><br>" +
+                               info.label + ": %{z:" + info.format + "}" + hoverError + "<br>" +
+                               (metric === "count" ? "" : "Earthquakes: %{customdata[0]:,}<br>") +
+                               hoverPop
+            });
+
+            window.dash_clientside.seismic.addFaults(fig, faultToggle, faults);
+            window.dash_clientside.seismic.addEventTiles(fig, eventTiles);
+            fig.layout = {
+                mapbox: {style: "carto-positron", zoom: config.zoom, center: config.center},
+                // Keep the user's pan and zoom when the figure is redrawn
+                uirevision: "main-map",
+                margin: {r: 0, t: 0, l: 0, b: 0},
+                clickmode: "event+select"
+            };
+            return fig;
+        },
+
+        // Overlay fault lines if toggled and data exists
+        addFaults: function (fig, faultToggle, faults) {
+            if (faultToggle && faults && faults.lat && faults.lat.length) {
+                fig.data.push({
+                    type: "scattermapbox",
+                    lat: faults.lat, lon: faults.lon,
+                    mode: "lines", line: {color: "black", width: 2},
+                    name: "Fault Line",
+                    text: faults.text,
+                    hovertemplate: "<b>Fault:</b> %{text}<extra></extra>",
+                    showlegend: false
+                });
+            }
+        },
+
+        playbackMap: function (idx, faultToggle, metric, frames, eventTiles, geometry, faults, config) {
+            var fig = {data: [], layout: {}, frames: []};
+            // Metrics without per-period values (e.g. the b-value) play the average magnitude
+            if (!frames[metric]) metric = "mean";
+            var info = config.metrics[metric];
+            var series = frames[metric];
+            var range = (info.bands && idx > 0 && idx < config.ranges.length) ? config.ranges[idx] : null;
+
+            // Provinces without events in a period, or outside the selected
+            // magnitude band, are left uncolored (null)
+            var lo = Infinity, hi = -Infinity;
+            var zFrames = series.map(function (values, f) {
+                return values.map(function (v, i) {
+                    if (v === null || frames.count[f][i] === 0 || (range && (v < range[0] || v > range[1]))) return null;
+                    if (v < lo) lo = v;
+                    if (v > hi) hi = v;
+                    return v;
+                });
+            });
+            var colorscale = config.colorscale, zrange = [lo, hi], showScale = true;
+            if (range) {
+                var singleColor = config.colors[idx - 1] || "#CCCCCC";
+                colorscale = [[0, singleColor], [1, singleColor]];
+                zrange = range;
+                showScale = false;
+            } else if (lo > hi) {
+                zrange = [0, 1]; // Nothing to color in any period
+            }
+            var counts = function (f) { return frames.count[f].map(function (c) { return [c]; }); };
+
+            fig.data.push({
+                type: "choroplethmapbox",
+                geojson: geometry,
+                locations: frames.locations,
+                z: zFrames[0],
+                customdata: counts(0),
+                featureidkey: "properties.adm2_en",
+                colorscale: colorscale,
+                zmin: zrange[0], zmax: zrange[1],
+                marker: {opacity: 0.7, line: {width: 0.5}},
+                showscale: showScale,
+                colorbar: {title: {text: showScale ? info.colorbar : ""}},
+                hovertemplate: "<b>%{location}</b><br>" +
+                               info.label + ": %{z:" + info.format + "}<br>" +
+                               (metric === "count" ? "" : "Earthquakes: %{customdata[0]:,}") + "<extra></extra>"
+            });
+            window.dash_clientside.seismic.addFaults(fig, faultToggle, faults);
+            window.dash_clientside.seismic.addEventTiles(fig, eventTiles);
+
+            // Frames only restyle the choropleth trace
+            fig.frames = frames.labels.map(function (label, f) {
+                return {name: label, traces: [0], data: [{z: zFrames[f], customdata: counts(f)}]};
+            });
+
+            var unit = frames.granularity === "year" ? "year" : "month";
+            var prefix = frames.window > 1 ? frames.window + " " + unit + "s to " : (unit === "year" ? "Year " : "Month ");
+            var step = function (duration) {
+                return {mode: "immediate", frame: {duration: duration, redraw: true}, transition: {duration: 0}};
+            };
+            fig.layout = {
+                mapbox: {style: "carto-positron", zoom: config.zoom, center: config.center},
+                uirevision: "main-map",
+                margin: {r: 0, t: 0, l: 0, b: 90},
+                clickmode: "event+select",
+                updatemenus: [{
+                    type: "buttons", direction: "left", showactive: false,
+                    x: 0, xanchor: "left", y: 0, yanchor: "top", pad: {t: 35, r: 10},
+                    buttons: [
+                        {label: "▶ Play", method: "animate",
+                         args: [null, Object.assign(step(config.frame_ms), {fromcurrent: true})]},
+                        {label: "❚❚ Pause", method: "animate", args: [[null], step(0)]}
+                    ]
+                }],
+                sliders: [{
+                    active: 0, x: 0.15, len: 0.85, y: 0, yanchor: "top", pad: {t: 30},
+                    // Step labels would overlap with 100+ periods; the current one is shown above
+                    font: {color: "rgba(0,0,0,0)"},
+                    currentvalue: {prefix: prefix, font: {size: 14}},
+                    steps: frames.labels.map(function (label) {
+                        return {label: label, method: "animate", args: [[label], step(0)]};
+                    })
+                }]
+            };
+            return fig;
+        }
+    })
+});
@@ -0,0 +1,170 @@
+// "All events" layer of the main map.
+// The tiles covering the visible part of the map are fetched from /api/tiles
+// with the event filters of the page; dense tiles come back as bins, sparse
+// ones as single events (see tiles.py). Tiles are cached per URL, so panning
+// back or toggling the layer only fetches what has not been seen yet, and
+// the URL carries the snapshot version so a new snapshot is never mixed in.
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    seismic: Object.assign({}, (window.dash_clientside || {}).seismic, {
+        // Bound on the tiles fetched for one view, and on the cached responses
+        maxTiles: 64,
+        tileCacheSize: 512,
+        _tileCache: new Map(),
+        _tileKey: null,
+
+        loadEventTiles: function (show, relayout, magnitudeRange, depthRange, faultDistance, yearRange, declustered,
+                                  tileConfig, config) {
+            var ns = window.dash_clientside.seismic;
+            if (!show || !tileConfig) {
+                var shown = ns._tileKey !== null;
+                ns._tileKey = null;
+                return shown ? null : window.dash_clientside.no_update;
+            }
+            var view = ns.mapView(relayout, config);
+            var zoom = Math.max(0, Math.min(tileConfig.max_zoom, Math.floor(view.zoom)));
+            var tiles = ns.visibleTiles(view, zoom);
+            while (tiles.length > ns.maxTiles && zoom > 0) tiles = ns.visibleTiles(view, --zoom);
+
+            var params = ["v=" + encodeURIComponent(tileConfig.version)];
+            var range = function (value, lo, hi) {
+                if (value && value.length === 2) params.push(lo + "=" + value[0], hi + "=" + value[1]);
+            };
+            range(magnitudeRange, "min_magnitude", "max_magnitude");
+            range(depthRange, "min_depth", "max_depth");
+            range(yearRange, "start_year", "end_year");
+            if (faultDistance !== null && faultDistance !== undefined) params.push("max_fault_distance=" + faultDistance);
+            if (declustered) params.push("declustered=1");
+            var query = "?" + params.join("&");
+            var urls = tiles.map(function (t) { return tileConfig.url + "/" + zoom + "/" + t[0] + "/" + t[1] + query; });
+
+            // Relayouts that keep the same tiles (or the figure update this
+            // layer itself triggers) change nothing
+            var key = urls.join(" ");
+            if (key === ns._tileKey) return window.dash_clientside.no_update;
+            ns._tileKey = key;
+            return Promise.all(urls.map(ns.fetchTile)).then(function (results) {
+                // A newer view was requested meanwhile; its result wins
+                if (ns._tileKey !== key) return window.dash_clientside.no_update;
+                return ns.mergeTiles(results);
+            });
+        },
+
+        // Zoom and bounds of the live map, else of the last relayout or the initial view
+        mapView: function (relayout, config) {
+            var gd = document.querySelector("#earthquake-map .js-plotly-plot");
+            var mapbox = gd && gd._fullLayout && gd._fullLayout.mapbox;
+            var map = mapbox && mapbox._subplot && mapbox._subplot.map;
+            if (map) {
+                var b = map.getBounds();
+                return {zoom: map.getZoom(), west: b.getWest(), east: b.getEast(), south: b.getSouth(), north: b.getNorth()};
+            }
+            var center = (relayout && relayout["mapbox.center"]) || config.center;
+            var zoom = (relayout && relayout["mapbox.zoom"]) || config.zoom;
+            var width = (gd && gd.clientWidth) || 1000, height = (gd && gd.clientHeight) || 600;
+            // Mapbox renders the world 512 px wide at zoom 0
+            var world = 512 * Math.pow(2, zoom);
+            var x = (center.lon + 180) / 360 * world, y = this.mercatorY(center.lat) * world;
+            var lat = function (py) { return Math.atan(Math.sinh(Math.PI * (1 - 2 * py / world))) * 180 / Math.PI; };
+            return {zoom: zoom, west: (x - width / 2) / world * 360 - 180, east: (x + width / 2) / world * 360 - 180,
+                    north: lat(Math.max(y - height / 2, 0)), south: lat(Math.min(y + height / 2, world))};
+        },
+
+        mercatorY: function (lat) {
+            var phi = Math.max(-85.05112878, Math.min(85.05112878, lat)) * Math.PI / 180;
+            return (1 - Math.log(Math.tan(phi) + 1 / Math.cos(phi)) / Math.PI) / 2;
+        },
+
+        // [x, y] of the tiles at `zoom` overlapping the view, wrapping around the antimeridian
+        visibleTiles: function (view, zoom) {
+            var n = Math.pow(2, zoom);
+            var clamp = function (v) { return Math.max(0, Math.min(n - 1, Math.floor(v))); };
+            var x0 = Math.floor((view.west + 180) / 360 * n), x1 = Math.floor((view.east + 180) / 360 * n);
+            var y0 = clamp(this.mercatorY(view.north) * n), y1 = clamp(this.mercatorY(view.south) * n);
+            var tiles = [], seen = {};
+            for (var x = x0; x <= Math.min(x1, x0 + n - 1); x++) {
+                var wx = ((x % n) + n) % n;
+                if (seen[wx]) continue;
+                seen[wx] = true;
+                for (var y = y0; y <= y1; y++) tiles.push([wx, y]);
+            }
+            return tiles;
+        },
+
+        // Tile JSON by URL, least recently used evicted first; failed fetches are not kept
+        fetchTile: function (url) {
+            var ns = window.dash_clientside.seismic, cache = ns._tileCache;
+            var hit = cache.get(url);
+            if (hit) {
+                cache.delete(url);
+                cache.set(url, hit);
+                return hit;
+            }
+            var pending = fetch(url).then(function (response) {
+                if (!response.ok) throw new Error(response.status + " " + response.statusText);
+                return response.json();
+            }).catch(function () {
+                cache.delete(url);
+                return null;
+            });
+            cache.set(url, pending);
+            while (cache.size > ns.tileCacheSize) cache.delete(cache.keys().next().value);
+            return pending;
+        },
+
+        // One set of columns for the single events and one for the bins of all tiles
+        mergeTiles: function (results) {
+            var merged = {
+                count: 0,
+                events: {lat: [], lon: [], magnitude: [], depth: [], date: [], location: []},
+                bins: {lat: [], lon: [], count: [], max_magnitude: []}
+            };
+            var append = function (target, source) {
+                for (var k in target) if (source[k]) Array.prototype.push.apply(target[k], source[k]);
+            };
+            results.forEach(function (tile) {
+                if (!tile) return;
+                merged.count += tile.count;
+                if (tile.events) append(merged.events, tile.events);
+                if (tile.bins) append(merged.bins, tile.bins);
+            });
+            return merged;
+        },
+
+        // Scatter traces of the layer, drawn over the choropleth and the faults
+        addEventTiles: function (fig, tiles) {
+            if (!tiles) return;
+            var bins = tiles.bins, events = tiles.events;
+            if (bins && bins.lat.length) {
+                fig.data.push({
+                    type: "scattermapbox",
+                    lat: bins.lat, lon: bins.lon,
+                    mode: "markers",
+                    marker: {
+                        size: bins.count.map(function (c) { return Math.min(4 + 4 * Math.log10(c), 24); }),
+                        color: "#253494", opacity: 0.45
+                    },
+                    customdata: bins.count.map(function (c, i) { return [c, bins.max_magnitude[i]]; }),
+                    hovertemplate: "%{customdata[0]:,} earthquakes<br>Max magnitude: %{customdata[1]:.1f}<extra></extra>",
+                    name: "Earthquakes", showlegend: false
+                });
+            }
+            if (events && events.lat.length) {
+                fig.data.push({
+                    type: "scattermapbox",
+                    lat: events.lat, lon: events.lon,
+                    mode: "markers",
+                    marker: {
+                        size: events.magnitude.map(function (m) { return m === null ? 3 : Math.max(3, Math.min(2 * m, 16)); }),
+                        color: "#081d58", opacity: 0.6
+                    },
+                    customdata: events.magnitude.map(function (m, i) { return [m, events.depth[i], events.date[i]]; }),
+                    text: events.location,
+                    hovertemplate: "<b>M %{customdata[0]:.1f}</b>, %{customdata[1]:.0f} km deep<br>" +
+                                   "%{customdata[2]}<br>%{text}<extra></extra>",
+                    name: "Earthquake", showlegend: false
+                });
+            }
+        }
+    })
+});
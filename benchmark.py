@@ -0,0 +1,455 @@
+"""Benchmark and load-test suite for the data pipeline and the Dash callbacks.
+
+For every catalog size a synthetic earthquake CSV in the same schema as the
+real one is generated (placed inside the actual province shapes when
+`data/ph_provinces.geojson` exists). A fresh interpreter then measures:
+
+- snapshot build time (parse, province assignment, aggregation) and the
+  time to import the app from the built snapshot,
+- per-callback latency, serialized response size and peak Python memory
+  (the event tiles of the "all events" layer included),
+- p50/p99 latency of concurrent callback requests replayed against the
+  Flask `server` through its test client.
+
+Results are written as JSON so runs on different commits can be compared.
+
+Usage:
+    python benchmark.py run [--sizes 10000 100000 1000000 10000000] [--output FILE]
+    python benchmark.py compare OLD.json NEW.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_WORK_DIR = os.path.join(REPO_DIR, "benchmark-data")
+DEFAULT_RESULTS_DIR = os.path.join(REPO_DIR, "benchmark-results")
+
+CSV_NAME = "[POP] FINAL_merged_earthquake_data.csv"
+
+
+"""## Synthetic data"""
+
+def synthetic_provinces(n_side=9, seed=0):
+    """Irregular Voronoi provinces over the Philippine bounding box."""
+    rng = np.random.default_rng(seed)
+    extent = shapely.box(116.9, 4.6, 126.6, 21.1)
+    seeds = shapely.multipoints(shapely.points(rng.uniform(116.9, 126.6, n_side ** 2),
+                                               rng.uniform(4.6, 21.1, n_side ** 2)))
+    cells = shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=extent))
+    geometries = shapely.segmentize(shapely.intersection(cells, extent), 0.02)
+    return gpd.GeoDataFrame({"adm2_en": [f"Province {i:02d}" for i in range(len(geometries))]},
+                            geometry=geometries, crs="EPSG:4326")
+
+
+def synthetic_faults(n_faults=300, seed=0):
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(n_faults):
+        start = rng.uniform([117, 5], [126.5, 20.5])
+        lines.append(shapely.LineString(start + np.cumsum(rng.normal(0, 0.05, (20, 2)), axis=0)))
+    return gpd.GeoDataFrame({"catalog_name": "Philippines", "name": [f"Fault {i}" for i in range(n_faults)]},
+                            geometry=lines, crs="EPSG:4326")
+
+
+def synthetic_catalog(n_events, provinces, seed=0):
+    """Events inside the given provinces, in the merged CSV schema."""
+    from assignment import ProvinceAssigner
+
+    rng = np.random.default_rng(seed)
+    assigner = ProvinceAssigner.from_provinces(provinces)
+    minx, miny, maxx, maxy = provinces.total_bounds
+    lon, lat, names = [], [], []
+    remaining = n_events
+    while remaining > 0:
+        batch = max(remaining * 2, 1000)
+        x = rng.uniform(minx, maxx, batch)
+        y = rng.uniform(miny, maxy, batch)
+        assigned = assigner.assign_names(x, y)
+        inside = np.flatnonzero(pd.notna(assigned))[:remaining]
+        lon.append(x[inside])
+        lat.append(y[inside])
+        names.append(assigned[inside])
+        remaining -= len(inside)
+    lon, lat, names = np.concatenate(lon), np.concatenate(lat), np.concatenate(names)
+
+    # Regions and island groups are derived from the province order
+    province_names = sorted(provinces["adm2_en"].dropna().unique())
+    province_idx = pd.Categorical(names, categories=province_names).codes
+    region = np.array([f"Region {i // 6 + 1}" for i in range(len(province_names))], dtype=object)[province_idx]
+    island_group = np.array(["Luzon", "Visayas", "Mindanao"], dtype=object)[province_idx % 3]
+    population = rng.integers(50_000, 5_000_000, (len(province_names), 4))[province_idx]
+
+    start = np.datetime64("2016-01-01T00:00:00")
+    seconds = rng.integers(0, 9 * 365 * 86400, n_events)
+    # Gutenberg-Richter distributed magnitudes (b = 1) above M1.0
+    magnitude = np.minimum(1.0 + rng.exponential(np.log10(np.e), n_events), 8.9).round(1)
+    return pd.DataFrame({
+        "Date": pd.to_datetime(start + seconds.astype("timedelta64[s]")).strftime("%Y-%m-%d %H:%M:%S"),
+        "Latitude": lat.round(4),
+        "Longitude": lon.round(4),
+        "Depth_In_Km": rng.gamma(2.0, 15.0, n_events).round(1),
+        "Magnitude": magnitude,
+        "Location": [f"{d} km N of Town {t}" for d, t in zip(rng.integers(1, 60, n_events), rng.integers(1, 500, n_events))],
+        "Province": names,
+        "Region": region,
+        "Island Group": island_group,
+        "2020": population[:, 0],
+        "2015": population[:, 1],
+        "2010": population[:, 2],
+        "2000": [f"{p:,}" for p in population[:, 3]],
+    })
+
+
+def prepare_data_dir(n_events, work_dir, seed=0):
+    """Data directory with province/fault sources and a synthetic catalog of n_events."""
+    data_dir = os.path.join(work_dir, f"events-{n_events}")
+    csv_path = os.path.join(data_dir, CSV_NAME)
+    if os.path.exists(csv_path):
+        return data_dir
+    os.makedirs(data_dir, exist_ok=True)
+
+    source_dir = os.path.join(REPO_DIR, "data")
+    for name, fallback in [("ph_provinces.geojson", synthetic_provinces), ("gem_active_faults.geojson", synthetic_faults)]:
+        target = os.path.join(data_dir, name)
+        if os.path.exists(os.path.join(source_dir, name)):
+            shutil.copyfile(os.path.join(source_dir, name), target)
+        else:
+            fallback(seed=seed).to_file(target, driver="GeoJSON")
+
+    provinces = gpd.read_file(os.path.join(data_dir, "ph_provinces.geojson"))
+    catalog = synthetic_catalog(n_events, provinces, seed)
+    catalog.to_csv(csv_path + ".tmp", index=False)
+    os.replace(csv_path + ".tmp", csv_path)
+    return data_dir
+
+
+"""## Measurements (run inside a fresh interpreter per catalog size)"""
+
+def percentile_summary(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "count": int(len(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def max_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_callback(func, args_list, encoder, reset=None):
+    """Latency, response size and peak traced memory of a callback over several inputs.
+
+    `reset` clears any memoization before the traced call.
+    """
+    latencies, sizes = [], []
+    for args in args_list:
+        start = time.perf_counter()
+        result = func(*args)
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(json.dumps(result, cls=encoder)))
+
+    if reset is not None:
+        reset()
+    tracemalloc.start()
+    func(*args_list[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    summary = percentile_summary(latencies)
+    summary["response_bytes_mean"] = float(np.mean(sizes))
+    summary["response_bytes_max"] = int(np.max(sizes))
+    summary["peak_traced_mb"] = peak / 2 ** 20
+    return summary
+
+
+def callback_payload(output, inputs, state=()):
+    """Body of a /_dash-update-component request; `output` may list several outputs."""
+    outputs = [dict(zip(("id", "property"), o.split("."))) for o in output.split(",")]
+    return {
+        "output": output if len(outputs) == 1 else ".." + "...".join(output.split(",")) + "..",
+        "outputs": outputs[0] if len(outputs) == 1 else outputs,
+        "inputs": [{"id": i, "property": p, "value": v} for (i, p), v in inputs],
+        "changedPropIds": [f"{i}.{p}" for (i, p), _ in inputs[:1]],
+        "state": [{"id": i, "property": p, "value": v} for (i, p), v in state],
+    }
+
+
+def replay_concurrent(server, payloads, concurrency):
+    """Send callback requests from `concurrency` threads; latency summary per request."""
+    def worker(chunk):
+        client = server.test_client()
+        latencies, errors = [], 0
+        for payload in chunk:
+            start = time.perf_counter()
+            response = client.post("/_dash-update-component", json=payload)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+        return latencies, errors
+
+    chunks = [payloads[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, chunks))
+    elapsed = time.perf_counter() - start
+    latencies = [lat for lats, _ in results for lat in lats]
+    summary = percentile_summary(latencies)
+    summary["errors"] = int(sum(errors for _, errors in results))
+    summary["concurrency"] = concurrency
+    summary["throughput_rps"] = len(latencies) / elapsed
+    return summary
+
+
+def run_single(data_dir, requests, concurrency, seed=0):
+    """Measure one catalog; must run in a fresh interpreter (see `run`)."""
+    os.environ["SEISMIC_DATA_DIR"] = data_dir
+    sys.path.insert(0, REPO_DIR)
+    results = {}
+
+    import snapshot
+    start = time.perf_counter()
+    snapshot.build_snapshot(data_dir, os.path.join(data_dir, "snapshot"), force=True)
+    results["snapshot_build_s"] = time.perf_counter() - start
+    results["rss_after_build_mb"] = max_rss_mb()
+
+    start = time.perf_counter()
+    import app
+    results["app_import_s"] = time.perf_counter() - start
+    # Measurements start once the background warm-up no longer competes for the CPU
+    app.warmups.wait()
+    results["warmup_s"] = time.perf_counter() - start - results["app_import_s"]
+    data = app.current_data()
+    results["events"] = int(len(data.magnitude_df))
+    results["max_rss_after_import_mb"] = max_rss_mb()
+
+    from plotly.utils import PlotlyJSONEncoder
+    rng = np.random.default_rng(seed)
+    provinces = list(data.bubble_index.blocks) if data.bubble_index else []
+    years = (data.min_year, data.max_year)
+
+    def year_range():
+        a, b = sorted(rng.integers(years[0], years[1] + 1, 2))
+        return [int(a), int(b)]
+
+    def magnitude_range():
+        a, b = sorted(rng.uniform(*data.event_magnitude_bounds, 2).round(1))
+        return [float(a), float(b)]
+
+    def depth_range():
+        a, b = sorted(rng.uniform(*data.event_depth_bounds, 2).round(0))
+        return [float(a), float(b)]
+
+    n_calls = 20
+    choropleth_args = [(magnitude_range(), depth_range()) for _ in range(n_calls)]
+    bubble_args = [(provinces[rng.integers(len(provinces))], year_range()) for _ in range(n_calls)]
+    line_args = []
+    for i in range(n_calls):
+        filter_type = ["Province", "Region", "Island Group"][i % 3]
+        options = {"Province": data.provinces, "Region": data.regions, "Island Group": data.island_groups}[filter_type]
+        selected = list(rng.choice(options, size=min(3, len(options)), replace=False)) if options else []
+        toggles = [["overall"], ["overall", "overall_regions"], ["overall_provinces", "overall_island_groups"]][i % 3]
+        line_args.append((selected, filter_type, toggles, year_range()))
+
+    # Monthly and yearly playback, half of them over a rolling window
+    frames_args = [(["month", "year"][i % 2], [1, 12][i // 2 % 2], magnitude_range(), depth_range())
+                   for i in range(n_calls)]
+
+    # Each call uses fresh inputs so memoized results do not hide the work.
+    # The main choropleth figure itself is rendered client-side; its server
+    # work is the per-province statistics callback.
+    app.cached_choropleth_data.cache_clear()
+    app.cached_choropleth_frames.cache_clear()
+    app.cached_bubble_map_figure.cache_clear()
+    results["callbacks"] = {
+        "update_choropleth_data": measure_callback(app.update_choropleth_data, choropleth_args, PlotlyJSONEncoder,
+                                                   reset=app.cached_choropleth_data.cache_clear),
+        "update_bubble_map": measure_callback(app.update_bubble_map, bubble_args, PlotlyJSONEncoder,
+                                              reset=app.cached_bubble_map_figure.cache_clear),
+        "update_line_chart_explorer_graph": measure_callback(app.update_line_chart_explorer_graph, line_args,
+                                                             PlotlyJSONEncoder),
+        "update_choropleth_frames": measure_callback(app.update_choropleth_frames, frames_args, PlotlyJSONEncoder,
+                                                     reset=app.cached_choropleth_frames.cache_clear),
+    }
+
+    # Filtered event tiles around the main map zoom, computed without the tile cache
+    pyramid = data.tile_pyramid
+    tile_args = []
+    for i in range(n_calls):
+        zoom = int(app.MAIN_MAP_ZOOM) + i % 3
+        occupied = pyramid.occupied(zoom)
+        x, y = occupied[rng.integers(len(occupied))] if occupied else (0, 0)
+        filters = {"Magnitude": tuple(magnitude_range()), "Year_Earthquake": tuple(year_range())}
+        tile_args.append((zoom, x, y, pyramid._normalize(filters)))
+    results["callbacks"]["event_tile"] = measure_callback(pyramid.tile, tile_args, PlotlyJSONEncoder)
+
+    # Year slider ticks: the same province or series moved to a new year range,
+    # answered with a Patch of the figure the previous call drew
+    def tick(args):
+        start, end = args[-1]
+        moved = [start, end + 1] if end < years[1] else [start - 1, end] if start > years[0] else [start, end]
+        return list(args[:-1]) + [moved]
+
+    bubble_ticks = [(*tick(args), None, app.update_bubble_map(*args)[1]) for args in bubble_args]
+    line_ticks = [(*tick(args), [], app.update_line_chart_explorer_graph(*args)[1]) for args in line_args]
+    results["callbacks"]["update_bubble_map_tick"] = measure_callback(app.update_bubble_map, bubble_ticks,
+                                                                      PlotlyJSONEncoder)
+    results["callbacks"]["update_line_chart_explorer_graph_tick"] = measure_callback(
+        app.update_line_chart_explorer_graph, line_ticks, PlotlyJSONEncoder)
+
+    # Concurrent replay of a mixed request stream through the Flask server
+    payloads = []
+    for i in range(requests):
+        kind = i % 3
+        if kind == 0:
+            m, d = magnitude_range(), depth_range()
+            payloads.append(callback_payload("choropleth-data.data", [
+                (("event-magnitude-slider", "value"), m), (("event-depth-slider", "value"), d),
+                (("fault-distance", "value"), None), (("event-year-slider", "value"), None),
+                (("declustered-toggle", "value"), False)]))
+        elif kind == 1:
+            province, yr = bubble_args[i % n_calls][0], year_range()
+            payloads.append(callback_payload("bubble-map.figure,bubble-map-view.data", [
+                (("click-data", "children"), province), (("bubble-year-slider", "value"), yr),
+                (("fault-distance", "value"), None)], [(("bubble-map-view", "data"), None)]))
+        else:
+            selected, filter_type, toggles, _ = line_args[i % n_calls]
+            payloads.append(callback_payload("line-chart-graph.figure,line-chart-view.data", [
+                (("line-chart-filter-selector", "value"), selected), (("line-chart-filter-type", "value"), filter_type),
+                (("line-chart-overall-toggle", "value"), toggles), (("line-chart-year-slider", "value"), year_range()),
+                (("line-chart-declustered", "value"), [])],
+                [(("line-chart-view", "data"), None)]))
+    app.cached_choropleth_data.cache_clear()
+    results["concurrent"] = replay_concurrent(app.server, payloads, concurrency)
+    results["max_rss_mb"] = max_rss_mb()
+    return results
+
+
+"""## Driver"""
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, work_dir, output, requests, concurrency, seed):
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "sizes": {},
+    }
+    for n_events in sizes:
+        print(f"[{n_events:,} events] preparing data...", flush=True)
+        start = time.perf_counter()
+        data_dir = prepare_data_dir(n_events, work_dir, seed)
+        print(f"[{n_events:,} events] data ready in {time.perf_counter() - start:.1f} s; measuring...", flush=True)
+
+        result_path = os.path.join(data_dir, "result.json")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "_single", data_dir, result_path,
+                        "--requests", str(requests), "--concurrency", str(concurrency), "--seed", str(seed)],
+                       check=True)
+        with open(result_path) as f:
+            report["sizes"][str(n_events)] = json.load(f)
+        summarize(n_events, report["sizes"][str(n_events)])
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+def summarize(n_events, result):
+    print(f"  snapshot build {result['snapshot_build_s']:.2f} s, app import {result['app_import_s']:.2f} s, "
+          f"warm-up {result.get('warmup_s', 0):.2f} s, max RSS {result['max_rss_mb']:.0f} MB")
+    for name, stats in result["callbacks"].items():
+        print(f"  {name:<40} p50 {stats['p50_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms  "
+              f"{stats['response_bytes_mean'] / 1024:9.1f} KB  peak {stats['peak_traced_mb']:7.1f} MB")
+    c = result["concurrent"]
+    print(f"  concurrent x{c['concurrency']}: p50 {c['p50_ms']:.2f} ms  p99 {c['p99_ms']:.2f} ms  "
+          f"{c['throughput_rps']:.0f} req/s  errors {c['errors']}")
+
+
+def compare(old_path, new_path):
+    """Print new/old ratios for every metric present in both reports."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+
+    def flatten(d, prefix=""):
+        for key, value in d.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f"{prefix}{key}.")
+            elif isinstance(value, (int, float)):
+                yield f"{prefix}{key}", value
+
+    for size in sorted(set(old["sizes"]) & set(new["sizes"]), key=int):
+        print(f"\n{int(size):,} events")
+        old_metrics = dict(flatten(old["sizes"][size]))
+        for name, value in flatten(new["sizes"][size]):
+            if name in old_metrics and old_metrics[name]:
+                print(f"  {name:<60} {old_metrics[name]:12.2f} -> {value:12.2f}  ({value / old_metrics[name]:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the seismic map data pipeline and callbacks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run the benchmark for several catalog sizes")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    run_parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help="where synthetic catalogs are cached")
+    run_parser.add_argument("--output", help="result JSON (default: benchmark-results/<timestamp>-<commit>.json)")
+    run_parser.add_argument("--requests", type=int, default=300, help="requests replayed concurrently per size")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--seed", type=int, default=0)
+
+    compare_parser = sub.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+
+    single = sub.add_parser("_single", help=argparse.SUPPRESS)
+    single.add_argument("data_dir")
+    single.add_argument("result_path")
+    single.add_argument("--requests", type=int, default=300)
+    single.add_argument("--concurrency", type=int, default=8)
+    single.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        output = args.output or os.path.join(
+            DEFAULT_RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{git_commit() or 'nogit'}.json")
+        run(args.sizes, args.work_dir, output, args.requests, args.concurrency, args.seed)
+    elif args.command == "compare":
+        compare(args.old, args.new)
+    elif args.command == "_single":
+        result = run_single(args.data_dir, args.requests, args.concurrency, args.seed)
+        with open(args.result_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
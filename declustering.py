@@ -0,0 +1,144 @@
+"""Gardner-Knopoff declustering of the event catalog.
+
+Events are taken from the largest magnitude down; an event not already
+claimed by a larger one is a mainshock, and claims every smaller event
+within its space-time window: L(M) km and T(M) days before or after it
+(Gardner & Knopoff, 1974, with the usual fitted windows below).
+
+Comparing every pair is O(N^2). Instead the events are split into
+magnitude classes, and for each class a KD-tree is built over the events'
+position on the sphere (3-D coordinates in km) plus their time scaled so
+the class's largest time window spans the same length as its largest
+distance window. One ball query per event of the class then returns the
+candidates in its window, which are checked exactly against the event's
+own L(M) and T(M). Tree builds and queries are O(N log N) per class. The
+classes of the few largest events, too small to pay for a tree, scan the
+events within their time windows instead when those are few enough. The claiming pass visits only
+events with candidates.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0
+CLASS_WIDTH = 0.5 # Magnitude units per KD-tree
+# A class scans its time windows instead of building a tree when it has at
+# most SCAN_MAX_EVENTS events and the windows hold at most SCAN_MAX_RATIO
+# times the events a tree would index
+SCAN_MAX_EVENTS = 10_000
+SCAN_MAX_RATIO = 8.0
+
+
+def window_distance_km(magnitude):
+    return np.power(10.0, 0.1238 * magnitude + 0.983)
+
+
+def window_days(magnitude):
+    return np.where(magnitude >= 6.5, np.power(10.0, 0.032 * magnitude + 2.7389),
+                    np.power(10.0, 0.5409 * magnitude - 0.547))
+
+
+def _chord(distance_km):
+    """Straight-line length between two surface points `distance_km` apart."""
+    return 2 * EARTH_RADIUS_KM * np.sin(np.minimum(distance_km / (2 * EARTH_RADIUS_KM), np.pi / 2))
+
+
+def _tree_candidates(xyz, days, members, pool, reach, span):
+    """Candidates of `members` among `pool` from KD-trees over space and scaled time."""
+    scale = reach / span
+
+    def tree(rows):
+        return cKDTree(np.column_stack((xyz[rows], days[rows] * scale)), balanced_tree=False, compact_nodes=False)
+
+    # Once time is scaled, a window is a cylinder of radius and half-height
+    # at most `reach`, which the ball of radius reach * sqrt(2) covers
+    ball = reach * np.sqrt(2)
+    pool_tree = tree(pool)
+    if len(members) == len(pool):
+        # The smallest class is its own pool: one self-join, both directions
+        pairs = pool_tree.query_pairs(ball, output_type="ndarray")
+        first, second = pool[pairs[:, 0]], pool[pairs[:, 1]]
+        return np.concatenate((first, second)), np.concatenate((second, first))
+    pairs = tree(members).sparse_distance_matrix(pool_tree, ball, output_type="ndarray")
+    return members[pairs["i"]], pool[pairs["j"]]
+
+
+def _time_slice_candidates(xyz, days, members, pool, reach, span):
+    """Candidates of `members` among `pool` (sorted by time) from the events within each time window.
+
+    Returns None when the windows hold too many events for a scan to beat
+    the trees.
+    """
+    pool_days = days[pool]
+    lo = np.searchsorted(pool_days, days[members] - span, side="left")
+    hi = np.searchsorted(pool_days, days[members] + span, side="right")
+    if len(members) > SCAN_MAX_EVENTS or (hi - lo).sum() > SCAN_MAX_RATIO * len(pool):
+        return None
+    # Gathered once so every window is a contiguous slice
+    pool_xyz = xyz[pool]
+    sources, targets = [], []
+    for member, start, stop in zip(members, lo, hi):
+        near = np.flatnonzero((np.abs(pool_xyz[start:stop] - xyz[member]) <= reach).all(axis=1))
+        sources.append(np.full(len(near), member))
+        targets.append(pool[start + near])
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def _window_candidates(xyz, days, magnitude, radius, duration):
+    """(event, candidate) pairs with the candidate inside the event's window.
+
+    Only candidates no larger than the event are kept, possibly including
+    the event itself, which the claiming pass ignores.
+    """
+    sources, targets = [], []
+    classes = np.floor(magnitude / CLASS_WIDTH)
+    by_time = np.argsort(days, kind="stable")
+    for cls in np.unique(classes):
+        members = np.flatnonzero(classes == cls)
+        # Only events no larger than the class can be claimed by its members
+        pool = by_time[magnitude[by_time] < (cls + 1) * CLASS_WIDTH]
+        reach, span = radius[members].max(), duration[members].max()
+        candidates = _time_slice_candidates(xyz, days, members, pool, reach, span)
+        source, target = candidates or _tree_candidates(xyz, days, members, pool, reach, span)
+        keep = ((np.linalg.norm(xyz[target] - xyz[source], axis=1) <= radius[source])
+                & (np.abs(days[target] - days[source]) <= duration[source])
+                & (magnitude[target] <= magnitude[source]))
+        sources.append(source[keep])
+        targets.append(target[keep])
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def mainshocks(latitude, longitude, magnitude, time):
+    """Boolean mask of the events that are mainshocks (not claimed by a larger event).
+
+    `time` is datetime64 or anything pandas converts to it. Events with a
+    missing position, magnitude or time are kept as mainshocks.
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    magnitude = np.asarray(magnitude, dtype=np.float64)
+    time = np.asarray(time, dtype="datetime64[s]")
+    result = np.ones(len(magnitude), dtype=bool)
+
+    valid = np.flatnonzero(np.isfinite(latitude) & np.isfinite(longitude) & np.isfinite(magnitude) & ~np.isnat(time))
+    if len(valid) < 2:
+        return result
+    lat, lon = np.radians(latitude[valid]), np.radians(longitude[valid])
+    xyz = EARTH_RADIUS_KM * np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+    days = (time[valid] - time[valid].min()).astype(np.float64) / 86400
+    mag = magnitude[valid]
+    source, target = _window_candidates(xyz, days, mag, _chord(window_distance_km(mag)), window_days(mag))
+
+    # Candidates grouped by event, events visited from the largest down
+    # (earliest first among equal magnitudes)
+    by_source = np.argsort(source, kind="stable")
+    target = target[by_source]
+    starts = np.searchsorted(source[by_source], np.arange(len(valid) + 1))
+    claimed = np.zeros(len(valid), dtype=bool)
+    order = np.lexsort((days, -mag))
+    for event in order[starts[order + 1] > starts[order]]:
+        if not claimed[event]:
+            window = target[starts[event]:starts[event + 1]]
+            claimed[window[window != event]] = True
+    result[valid] = ~claimed
+    return result
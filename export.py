@@ -0,0 +1,164 @@
+"""Streaming export of filtered catalog events.
+
+`install(server, get_catalog)` adds `/api/events` to the Flask server. It accepts
+the filters the UI offers and streams the matching rows as CSV, NDJSON or an
+Arrow IPC stream:
+
+    /api/events?format=csv&province=Cebu&province=Bohol&start_year=2010&end_year=2020
+        &min_magnitude=4&max_magnitude=9&min_depth=0&max_depth=70&max_fault_distance=10
+
+`province`, `region` and `island_group` may be repeated (or comma-separated)
+to select several values. The catalog is scanned in fixed-size row chunks
+and each chunk is filtered and serialized on its own, so memory stays flat
+however many rows match. Responses are gzip-compressed on the fly when the
+client's `Accept-Encoding` accepts gzip with a nonzero quality.
+"""
+
+import io
+import zlib
+
+import numpy as np
+import pyarrow as pa
+from flask import Response, request
+
+from indexes import widen_float32
+
+CHUNK_ROWS = 50_000
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+# Query parameter -> catalog column for the categorical filters
+CATEGORY_FILTERS = {"province": "Province", "region": "Region", "island_group": "Island Group"}
+RANGE_FILTERS = {
+    "year": ("start_year", "end_year", "Year_Earthquake", int),
+    "magnitude": ("min_magnitude", "max_magnitude", "Magnitude", float),
+    "depth": ("min_depth", "max_depth", "Depth_In_Km", float),
+    "fault_distance": ("min_fault_distance", "max_fault_distance", "Fault_Distance_Km", float),
+}
+# Bounds are compared in the column's dtype, so they must fit in it (years are int16)
+BOUND_LIMITS = {"Year_Earthquake": (int(np.iinfo(np.int16).min), int(np.iinfo(np.int16).max))}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_filters(args):
+    """Filters from request query arguments; raises ExportError on bad values."""
+    filters = {}
+    for param, column in CATEGORY_FILTERS.items():
+        values = [v.strip() for raw in args.getlist(param) for v in raw.split(",") if v.strip()]
+        if values:
+            filters[column] = values
+    for lo_param, hi_param, column, cast in RANGE_FILTERS.values():
+        bounds = []
+        for param in (lo_param, hi_param):
+            value = args.get(param)
+            try:
+                bound = cast(value) if value not in (None, "") else None
+            except ValueError:
+                raise ExportError(f"Invalid value for {param}: {value!r}")
+            lo, hi = BOUND_LIMITS.get(column, (-np.inf, np.inf))
+            if bound is not None and not lo <= bound <= hi:
+                raise ExportError(f"Out of range value for {param}: {value!r}")
+            bounds.append(bound)
+        if bounds != [None, None]:
+            filters[column] = tuple(bounds)
+    return filters
+
+
+def chunk_mask(chunk, filters):
+    keep = np.ones(len(chunk), dtype=bool)
+    for column, condition in filters.items():
+        values = chunk[column]
+        if isinstance(condition, list):
+            keep &= values.isin(condition).to_numpy()
+            continue
+        values = values.to_numpy()
+        lo, hi = condition
+        # Same dtype as the column so float32 values compare equal to themselves
+        if lo is not None:
+            keep &= values >= values.dtype.type(lo)
+        if hi is not None:
+            keep &= values <= values.dtype.type(hi)
+    return keep
+
+
+def filtered_chunks(catalog, filters, chunk_rows=CHUNK_ROWS):
+    """Matching rows of `catalog`, one frame per scanned chunk with matches."""
+    for start in range(0, len(catalog), chunk_rows):
+        chunk = catalog.iloc[start:start + chunk_rows]
+        keep = chunk_mask(chunk, filters)
+        if keep.any():
+            yield chunk[keep]
+
+
+def csv_stream(catalog, chunks):
+    yield catalog.iloc[0:0].to_csv(index=False)
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False, date_format="%Y-%m-%d %H:%M:%S")
+
+
+def ndjson_stream(catalog, chunks):
+    for chunk in chunks:
+        yield widen_float32(chunk).to_json(orient="records", lines=True, date_format="iso", date_unit="s") + "\n"
+
+
+def arrow_stream(catalog, chunks):
+    schema = pa.Schema.from_pandas(catalog.iloc[0:0], preserve_index=False)
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, schema) as writer:
+        for chunk in chunks:
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+            # Hand over what this batch produced and reuse the buffer
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+STREAMS = {"csv": csv_stream, "ndjson": ndjson_stream, "arrow": arrow_stream}
+
+
+def gzip_stream(parts):
+    compressor = zlib.compressobj(wbits=31) # gzip container
+    for part in parts:
+        data = compressor.compress(part.encode() if isinstance(part, str) else part)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(catalog, args, accept_gzip=False):
+    export_format = args.get("format", "csv").lower()
+    if export_format not in FORMATS:
+        raise ExportError(f"Unknown format {export_format!r}; expected one of {sorted(FORMATS)}")
+    filters = parse_filters(args)
+    mimetype, extension = FORMATS[export_format]
+
+    body = STREAMS[export_format](catalog, filtered_chunks(catalog, filters))
+    headers = {"Content-Disposition": f"attachment; filename=earthquakes.{extension}"}
+    if accept_gzip:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
+def install(server, get_catalog):
+    """Serve the event dataframe returned by `get_catalog()` on /api/events of `server`.
+
+    The catalog is looked up once per request, so an export keeps streaming
+    the version it started with when a new snapshot is swapped in.
+    """
+    def export_events():
+        try:
+            return export_response(get_catalog(), request.args, request.accept_encodings["gzip"] > 0)
+        except ExportError as e:
+            return Response(f"{e}\n", status=400, mimetype="text/plain")
+
+    server.add_url_rule("/api/events", "export_events", export_events)
@@ -0,0 +1,99 @@
+"""Distance from events to the nearest active fault.
+
+Fault traces are projected once to UTM zone 51N (scale error below 1% over
+the Philippines) and densified so consecutive vertices are at most
+VERTEX_SPACING metres apart. A KD-tree over those vertices finds the few
+nearest ones for a whole batch of events in one call, and the exact
+point-to-segment distance is then taken over the segments touching them,
+vectorized across the batch. The nearest segment always has a vertex within
+half a spacing of the closest point, so the result is exact in practice and
+never off by more than VERTEX_SPACING / 2.
+"""
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+METRIC_CRS = "EPSG:32651" # UTM zone 51N
+VERTEX_SPACING = 1000.0 # metres
+NEAREST_VERTICES = 4
+DEFAULT_BATCH_SIZE = 1_000_000
+
+
+class FaultLocator:
+    """Nearest fault (index and distance in km) for (lon, lat) points."""
+
+    def __init__(self, names, geometries, crs="EPSG:4326"):
+        self.names = np.asarray(names, dtype=object)
+        self.transformer = Transformer.from_crs(crs, METRIC_CRS, always_xy=True)
+
+        parts, part_owner = shapely.get_parts(np.asarray(geometries, dtype=object), return_index=True)
+        parts = shapely.transform(parts, lambda c: np.column_stack(self.transformer.transform(c[:, 0], c[:, 1])))
+        parts = shapely.segmentize(parts, VERTEX_SPACING)
+        self.vertices, vertex_part = shapely.get_coordinates(parts, return_index=True)
+        self.vertex_fault = part_owner[vertex_part].astype(np.int32)
+
+        # Neighbouring vertex along the same trace (itself at either end)
+        n = len(self.vertices)
+        index = np.arange(n)
+        part_start = np.r_[True, vertex_part[1:] != vertex_part[:-1]]
+        part_end = np.r_[vertex_part[1:] != vertex_part[:-1], True]
+        self.next_vertex = np.where(part_end, index, index + 1)
+        self.prev_vertex = np.where(part_start, index, index - 1)
+        self.tree = cKDTree(self.vertices) if n else None
+
+    @classmethod
+    def from_faults(cls, ph_faults):
+        valid = ph_faults[ph_faults.geometry.notna() & ~ph_faults.geometry.is_empty]
+        return cls(valid["name"].fillna("Unnamed Fault").astype(str).to_numpy(), valid.geometry.to_numpy(),
+                   valid.crs or "EPSG:4326")
+
+    def _nearest_batch(self, lon, lat):
+        x, y = self.transformer.transform(lon, lat)
+        points = np.column_stack((x, y))
+        distance = np.full(len(lon), np.nan)
+        fault = np.full(len(lon), -1, dtype=np.int32)
+        valid = np.flatnonzero(np.isfinite(points).all(axis=1))
+        if len(valid) == 0:
+            return distance, fault
+        points = points[valid]
+
+        k = min(NEAREST_VERTICES, len(self.vertices))
+        _, nearest = self.tree.query(points, k=k)
+        nearest = nearest.reshape(len(points), k)
+        # Segments on both sides of each candidate vertex: (len, 2k) endpoints
+        start = np.concatenate((nearest, self.prev_vertex[nearest]), axis=1)
+        end = np.concatenate((self.next_vertex[nearest], nearest), axis=1)
+        a = self.vertices[start]
+        ab = self.vertices[end] - a
+        ap = points[:, None, :] - a
+        length2 = (ab ** 2).sum(axis=2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length2 > 0, (ap * ab).sum(axis=2) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        segment_distance = np.hypot(*(ap - t[..., None] * ab).transpose(2, 0, 1))
+
+        best = segment_distance.argmin(axis=1)
+        rows = np.arange(len(points))
+        distance[valid] = segment_distance[rows, best] / 1000
+        fault[valid] = self.vertex_fault[start[rows, best]]
+        return distance, fault
+
+    def nearest(self, lon, lat, batch_size=DEFAULT_BATCH_SIZE):
+        """(distance in km, fault index) per point; NaN and -1 for invalid points or no faults."""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        distance = np.full(len(lon), np.nan, dtype=np.float32)
+        fault = np.full(len(lon), -1, dtype=np.int32)
+        if self.tree is None:
+            return distance, fault
+        for start in range(0, len(lon), batch_size):
+            stop = start + batch_size
+            distance[start:stop], fault[start:stop] = self._nearest_batch(lon[start:stop], lat[start:stop])
+        return distance, fault
+
+    def nearest_names(self, lon, lat, batch_size=DEFAULT_BATCH_SIZE):
+        """(distance in km, fault name or None) per point."""
+        distance, fault = self.nearest(lon, lat, batch_size)
+        return distance, np.append(self.names, None)[fault]
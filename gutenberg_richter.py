@@ -0,0 +1,206 @@
+"""Gutenberg-Richter b-value and magnitude of completeness per area.
+
+Magnitudes are binned once into a [entity, year, magnitude bin] histogram
+cube. A year range is a sum over a slice of that cube, and every estimate is
+a few array operations over the [entity, bin] histograms, so all provinces
+(or regions) are estimated in one vectorized pass:
+
+- Mc by maximum curvature (the most populated bin) plus MC_CORRECTION, as
+  recommended by Woessner & Wiemer (2005) to offset its known underestimate.
+- b by the Aki-Utsu maximum likelihood estimate with the correction for
+  binned magnitudes: b = log10(e) / (mean(M >= Mc) - (Mc - dM / 2)).
+
+Uncertainties come from a bootstrap of the histograms (multinomial
+resampling of the events, re-estimating both Mc and b), which is too slow
+for the request path. `BootstrapCache` runs it in background threads and
+keeps the results, so callbacks only ever read finished ones. Each web
+worker runs SEISMIC_GR_WORKERS bootstrap threads (default 2, leaving CPU
+for requests when several workers share a machine).
+"""
+
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+MAGNITUDE_BIN = 0.1
+MC_CORRECTION = 0.2
+MIN_EVENTS = int(os.environ.get("SEISMIC_GR_MIN_EVENTS", 50)) # Events at or above Mc for an estimate
+BOOTSTRAP_REPLICATES = int(os.environ.get("SEISMIC_GR_BOOTSTRAP", 200))
+BOOTSTRAP_WORKERS = int(os.environ.get("SEISMIC_GR_WORKERS", 2))
+BOOTSTRAP_CACHE_SIZE = int(os.environ.get("SEISMIC_GR_CACHE_SIZE", 64))
+# Scheduled computations kept; older ones are cancelled (e.g. year ranges dragged past)
+BOOTSTRAP_MAX_PENDING = int(os.environ.get("SEISMIC_GR_MAX_PENDING", 8))
+
+
+def estimate(histograms, magnitudes, min_events=MIN_EVENTS):
+    """Mc, b-value and events at or above Mc for every row of `histograms`.
+
+    `histograms` is [..., bin] event counts over the bin centers `magnitudes`.
+    Rows with fewer than `min_events` events at or above Mc get NaN.
+    """
+    histograms = np.asarray(histograms)
+    n_bins = len(magnitudes)
+    # Maximum curvature: the bin with the most events, shifted up by the correction
+    mc_bin = np.minimum(histograms.argmax(axis=-1) + int(round(MC_CORRECTION / MAGNITUDE_BIN)), n_bins - 1)
+    above = np.arange(n_bins) >= mc_bin[..., None]
+    counts = np.where(above, histograms, 0)
+    events = counts.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (counts * magnitudes).sum(axis=-1) / events
+        b_value = np.log10(np.e) / (mean - (magnitudes[mc_bin] - MAGNITUDE_BIN / 2))
+    mc = magnitudes[mc_bin]
+    too_few = events < max(min_events, 2)
+    return {
+        "mc": np.where(too_few, np.nan, mc),
+        "b_value": np.where(too_few, np.nan, b_value),
+        "events": events,
+    }
+
+
+def bootstrap(histograms, magnitudes, replicates, seed=None, min_events=MIN_EVENTS):
+    """Mc and b-value of `replicates` multinomial resamples of every histogram row.
+
+    Returns ([replicate, row] Mc, [replicate, row] b-value).
+    """
+    rng = np.random.default_rng(seed)
+    totals = histograms.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        probabilities = histograms / totals[..., None]
+    # Rows without events draw nothing from a uniform placeholder
+    probabilities[totals == 0] = 1.0 / histograms.shape[-1]
+    samples = rng.multinomial(totals, probabilities, size=(replicates, len(histograms)))
+    result = estimate(samples, magnitudes, min_events)
+    return result["mc"], result["b_value"]
+
+
+class HistogramCube:
+    """Event counts per [entity, year, magnitude bin]."""
+
+    def __init__(self, counts, magnitudes, first_year):
+        self.counts = counts
+        self.magnitudes = magnitudes
+        self.first_year = first_year
+
+    @classmethod
+    def from_events(cls, codes, n_entities, years, magnitude):
+        """Cube of the events with entity code >= 0; `years` are calendar years."""
+        keep = codes >= 0
+        years = np.asarray(years)[keep].astype(np.int64)
+        magnitude = np.asarray(magnitude, dtype=np.float64)[keep]
+        first_year = int(years.min()) if len(years) else 0
+        n_years = int(years.max()) - first_year + 1 if len(years) else 1
+        # Bins centered on multiples of MAGNITUDE_BIN
+        bins = np.rint(magnitude / MAGNITUDE_BIN).astype(np.int64)
+        first_bin = int(bins.min()) if len(bins) else 0
+        n_bins = int(bins.max()) - first_bin + 1 if len(bins) else 1
+        cells = (np.asarray(codes)[keep].astype(np.int64) * n_years + years - first_year) * n_bins + bins - first_bin
+        counts = np.bincount(cells, minlength=n_entities * n_years * n_bins).reshape(n_entities, n_years, n_bins)
+        magnitudes = (first_bin + np.arange(n_bins)) * MAGNITUDE_BIN
+        return cls(counts, magnitudes.round(1), first_year)
+
+    def group(self, groups, n_groups):
+        """Cube of entity groups (e.g. provinces into regions); `groups[i]` is -1 for none."""
+        groups = np.asarray(groups)
+        counts = np.zeros((n_groups,) + self.counts.shape[1:], dtype=self.counts.dtype)
+        valid = groups >= 0
+        np.add.at(counts, groups[valid], self.counts[valid])
+        return HistogramCube(counts, self.magnitudes, self.first_year)
+
+    def histograms(self, year_range=None):
+        """[entity, bin] counts over the years start <= year <= end (every year with None)."""
+        if year_range is None:
+            return self.counts.sum(axis=1)
+        lo = max(int(year_range[0]) - self.first_year, 0)
+        hi = max(int(year_range[1]) - self.first_year + 1, lo)
+        return self.counts[:, lo:hi].sum(axis=1)
+
+    def estimate(self, year_range=None):
+        return estimate(self.histograms(year_range), self.magnitudes)
+
+
+class BootstrapCache:
+    """Bootstrap uncertainties computed in background threads and kept per key.
+
+    `get(key, histograms, magnitudes)` returns the standard deviations of Mc
+    and b per histogram row once they are ready, and otherwise schedules the
+    computation and returns None. The replicates are split across the thread
+    pool; numpy's sampling and reductions release the GIL, so the chunks run
+    in parallel. A finished computation moves into the LRU result cache as
+    soon as its last chunk completes. At most `max_pending` computations are
+    scheduled at once: scheduling another cancels the oldest.
+    """
+
+    def __init__(self, replicates=BOOTSTRAP_REPLICATES, workers=BOOTSTRAP_WORKERS, maxsize=BOOTSTRAP_CACHE_SIZE,
+                 max_pending=BOOTSTRAP_MAX_PENDING):
+        self.replicates = replicates
+        self.workers = workers
+        self.maxsize = maxsize
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gr-bootstrap")
+        # Reentrant: a done callback runs in the scheduling thread if its future is already done
+        self._lock = threading.RLock()
+        self._pending = OrderedDict() # key -> chunk futures, oldest first
+        self._results = OrderedDict() # key -> {"mc": std, "b_value": std}
+
+    def get(self, key, histograms, magnitudes):
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+            if key not in self._pending:
+                self._schedule(key, histograms, magnitudes)
+            return None
+
+    def _schedule(self, key, histograms, magnitudes):
+        while len(self._pending) >= self.max_pending:
+            for future in self._pending.popitem(last=False)[1]:
+                future.cancel()
+        chunks = np.array_split(np.arange(self.replicates), self.workers)
+        futures = [self._pool.submit(bootstrap, histograms, magnitudes, len(chunk), seed)
+                   for seed, chunk in enumerate(chunks) if len(chunk)]
+        self._pending[key] = futures
+        for future in futures:
+            future.add_done_callback(lambda _: self._finish(key, futures))
+
+    def _finish(self, key, futures):
+        """Move a computation whose chunks are all done into the results."""
+        with self._lock:
+            if self._pending.get(key) is not futures or not all(future.done() for future in futures):
+                return
+            del self._pending[key]
+            try:
+                mc, b_value = (np.concatenate(parts) for parts in zip(*(future.result() for future in futures)))
+            except Exception:
+                return # Dropped; the next request schedules it again
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning) # All-NaN rows (too few events)
+                self._results[key] = {"mc": np.nanstd(mc, axis=0), "b_value": np.nanstd(b_value, axis=0)}
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def result(self, key, histograms, magnitudes, timeout=None):
+        """Like `get`, but waits for a scheduled computation to finish."""
+        if self.get(key, histograms, magnitudes) is None:
+            with self._lock:
+                futures = self._pending.get(key, [])
+            wait(futures, timeout)
+            # wait() can return before the done callbacks have run
+            self._finish(key, futures)
+        with self._lock:
+            return self._results.get(key)
+
+    def clear(self):
+        """Cancel the scheduled computations and drop the results (e.g. after a snapshot swap)."""
+        with self._lock:
+            for futures in self._pending.values():
+                for future in futures:
+                    future.cancel()
+            self._pending.clear()
+            self._results.clear()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
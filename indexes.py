@@ -0,0 +1,335 @@
+"""Lookup structures built once at startup so callbacks avoid full-catalog scans,
+and helpers shared by the code that serves catalog rows."""
+
+import numpy as np
+import pandas as pd
+
+
+class ProvinceEventIndex:
+    """Events grouped by normalized province name and sorted by date.
+
+    Only the sort permutation, the event years in that order and the block
+    of each province are kept; the catalog itself is the shared
+    (memory-mapped) one. A (province, year range) query is two binary
+    searches inside the province's block and gathers just those rows, so
+    callbacks never re-normalize strings or copy the catalog. Map centers per province are
+    precomputed from the province bounds.
+    """
+
+    def __init__(self, magnitude_df, gdf_ph_provinces=None, columns=None):
+        keys = magnitude_df["Province"].astype(str).str.strip()
+        self.catalog = magnitude_df
+        self.columns = list(magnitude_df.columns) if columns is None else list(columns)
+        order = np.lexsort((magnitude_df["Date"].to_numpy(), keys.to_numpy()))
+        self.order = order.astype(np.int32 if len(order) < 2 ** 31 else np.int64)
+        # Years in sort order (2 bytes per event) so queries search them in place
+        self.years = magnitude_df["Year_Earthquake"].to_numpy()[order].astype(np.int16)
+
+        # Start/stop row of each province block in the sorted frame
+        sorted_keys = keys.to_numpy()[order]
+        boundaries = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+        starts = np.concatenate(([0], boundaries)) if len(sorted_keys) else np.array([], dtype=int)
+        stops = np.concatenate((boundaries, [len(sorted_keys)])) if len(sorted_keys) else np.array([], dtype=int)
+        self.blocks = {sorted_keys[a]: (int(a), int(b)) for a, b in zip(starts, stops)}
+
+        # Bounding-box centers for zooming the bubble map
+        self.centers = {}
+        if gdf_ph_provinces is not None and 'adm2_en' in gdf_ph_provinces.columns:
+            valid = gdf_ph_provinces[gdf_ph_provinces.geometry.notna() & ~gdf_ph_provinces.geometry.is_empty]
+            bounds = valid.geometry.bounds
+            center_lon = (bounds["minx"] + bounds["maxx"]) / 2
+            center_lat = (bounds["miny"] + bounds["maxy"]) / 2
+            for name, lat, lon in zip(valid["adm2_en"], center_lat, center_lon):
+                self.centers.setdefault(name, (float(lat), float(lon)))
+
+    def _rows(self, province, start_year, end_year):
+        """(lo, hi) positions in `order` of the events in the year range."""
+        block = self.blocks.get(str(province).strip())
+        if block is None:
+            return 0, 0
+        start, stop = block
+        years = self.years[start:stop]
+        return (start + int(np.searchsorted(years, start_year, side="left")),
+                start + int(np.searchsorted(years, end_year, side="right")))
+
+    def count(self, province, start_year, end_year):
+        """Number of events `query` returns, without gathering them."""
+        lo, hi = self._rows(province, start_year, end_year)
+        return hi - lo
+
+    def query(self, province, start_year, end_year):
+        """Events of `province` with start_year <= year <= end_year, ordered by date."""
+        lo, hi = self._rows(province, start_year, end_year)
+        rows = self.order[lo:hi]
+        return pd.DataFrame({column: self.catalog[column].array.take(rows) for column in self.columns})
+
+    def center(self, province):
+        """(lat, lon) of the province bounding-box center, or None."""
+        return self.centers.get(province)
+
+
+class CountCube:
+    """Dense earthquake counts indexed [entity, year] for one grouping level.
+
+    Built from a long table of (Year, entity, count) rows. A year range is a
+    column slice and every requested series comes out of one array
+    operation. With `column=None` the table is treated as a single series.
+    """
+
+    def __init__(self, counts_df, column=None, count_col="Number of Earthquakes", name="Overall"):
+        if column is None:
+            entity_values = np.full(len(counts_df), name, dtype=object)
+        else:
+            entity_values = counts_df[column].to_numpy()
+        valid = pd.notna(entity_values)
+        self.entities = sorted(set(entity_values[valid]))
+        self.rows = {entity: i for i, entity in enumerate(self.entities)}
+        self.years = np.array(sorted(counts_df["Year"].dropna().unique()), dtype=int)
+
+        entity_idx = pd.Categorical(entity_values, categories=self.entities).codes
+        year_idx = np.searchsorted(self.years, counts_df["Year"].to_numpy())
+        keep = entity_idx >= 0
+        self.counts = np.zeros((len(self.entities), len(self.years)), dtype=np.int64)
+        np.add.at(self.counts, (entity_idx[keep], year_idx[keep]), counts_df[count_col].to_numpy()[keep])
+
+    def series(self, entities, start_year, end_year):
+        """(entity, years, counts) for each requested entity with events in the range.
+
+        Years without events are left out, matching a groupby over the long table.
+        """
+        lo = np.searchsorted(self.years, start_year, side="left")
+        hi = np.searchsorted(self.years, end_year, side="right")
+        names = [e for e in entities if e in self.rows]
+        if not names or lo >= hi:
+            return []
+        block = self.counts[[self.rows[e] for e in names], lo:hi]
+        years = self.years[lo:hi]
+        present = block > 0
+        return [(name, years[present[i]], block[i, present[i]])
+                for i, name in enumerate(names) if present[i].any()]
+
+
+def energy_joules(magnitude):
+    """Radiated seismic energy, Gutenberg-Richter: log10 E = 1.5 M + 4.8 (joules)."""
+    return np.power(10.0, 1.5 * np.asarray(magnitude, dtype=np.float64) + 4.8)
+
+
+class ProvinceReducer:
+    """Per-province statistics over event-level magnitude and depth filters.
+
+    Events carry an integer province code (-1 when outside every province).
+    A query masks the events once and reduces with np.bincount, so the cost
+    is a few linear passes over contiguous arrays regardless of how many
+    provinces there are. Magnitude and depth are float32 to halve the memory
+    traffic of the mask; range bounds are cast to float32 as well so values
+    such as 4.9 compare equal to themselves.
+
+    An optional year range narrows the events the same way, and
+    `declustered=True` keeps only the events flagged as mainshocks.
+
+    The distance-to-fault filter is a range query on events presorted by
+    distance: a binary search gives the events within the distance, and the
+    other filters are then applied to those rows only.
+    """
+
+    def __init__(self, province_names, event_provinces, magnitude, depth, fault_distance=None, year=None,
+                 mainshock=None):
+        self.names = list(province_names)
+        self.codes = pd.Categorical(event_provinces, categories=self.names).codes.astype(np.int32)
+        self.magnitude = np.asarray(magnitude, dtype=np.float32)
+        self.depth = np.asarray(depth, dtype=np.float32)
+        self.energy = energy_joules(magnitude)
+        self.assigned = self.codes >= 0
+        self.magnitude_bounds = self._bounds(self.magnitude)
+        self.depth_bounds = self._bounds(self.depth)
+        self.year = None if year is None else np.asarray(year, dtype=np.int16)
+        self.year_bounds = None if year is None else self._bounds(self.year)
+        self.mainshock = None if mainshock is None else np.asarray(mainshock, dtype=bool)
+        self.by_fault_distance = None
+        if fault_distance is not None:
+            fault_distance = np.asarray(fault_distance, dtype=np.float32)
+            # NaN (no fault) sorts last and is never within a distance
+            self.by_fault_distance = np.argsort(fault_distance, kind="stable").astype(np.int64)
+            self.sorted_fault_distance = fault_distance[self.by_fault_distance]
+        self._unfiltered = None
+
+    @staticmethod
+    def _bounds(values):
+        if len(values) == 0 or np.isnan(values).all():
+            return None
+        return np.nanmin(values), np.nanmax(values)
+
+    @staticmethod
+    def _apply_range(keep, values, value_range, bounds):
+        """Narrow `keep`, a boolean mask or an array of row indices."""
+        if value_range is None:
+            return keep
+        lo, hi = np.float32(value_range[0]), np.float32(value_range[1])
+        # A range covering every value filters nothing; skip the pass
+        if bounds is not None and lo <= bounds[0] and hi >= bounds[1]:
+            return keep
+        if keep.dtype != bool:
+            selected = values[keep]
+            return keep[(selected >= lo) & (selected <= hi)]
+        keep = keep & (values >= lo)
+        keep &= values <= hi
+        return keep
+
+    def within_fault_distance(self, max_distance):
+        """Row indices of the events at most `max_distance` km from a fault."""
+        stop = np.searchsorted(self.sorted_fault_distance, np.float32(max_distance), side="right")
+        rows = self.by_fault_distance[:stop]
+        return rows[self.assigned[rows]]
+
+    def mask(self, magnitude_range=None, depth_range=None, max_fault_distance=None, year_range=None,
+             declustered=False):
+        keep = self.assigned
+        if max_fault_distance is not None and self.by_fault_distance is not None:
+            keep = self.within_fault_distance(max_fault_distance)
+        keep = self._apply_range(keep, self.magnitude, magnitude_range, self.magnitude_bounds)
+        keep = self._apply_range(keep, self.depth, depth_range, self.depth_bounds)
+        if self.year is not None:
+            keep = self._apply_range(keep, self.year, year_range, self.year_bounds)
+        if declustered and self.mainshock is not None:
+            keep = keep[self.mainshock[keep]] if keep.dtype != bool else keep & self.mainshock
+        return keep
+
+    def reduce(self, magnitude_range=None, depth_range=None, max_fault_distance=None, keep=None, year_range=None,
+               declustered=False):
+        """Count, mean/max magnitude and summed energy per province.
+
+        Returns a dict of arrays aligned with `names`; provinces without
+        matching events have count 0 and NaN for the other statistics.
+        """
+        if keep is None:
+            keep = self.mask(magnitude_range, depth_range, max_fault_distance, year_range, declustered)
+        # Nothing filtered: the full reduction is computed once and reused
+        if keep is self.assigned:
+            if self._unfiltered is None:
+                self._unfiltered = self._reduce(keep)
+            return {key: values.copy() for key, values in self._unfiltered.items()}
+        return self._reduce(keep)
+
+    def _reduce(self, keep):
+        codes = self.codes[keep]
+        magnitude = self.magnitude[keep].astype(np.float64)
+        n = len(self.names)
+
+        count = np.bincount(codes, minlength=n)
+        # bincount returns integers for empty input even with weights
+        magnitude_sum = np.bincount(codes, weights=magnitude, minlength=n).astype(np.float64)
+        energy_sum = np.bincount(codes, weights=self.energy[keep], minlength=n).astype(np.float64)
+        magnitude_max = np.full(n, -np.inf)
+        np.maximum.at(magnitude_max, codes, magnitude)
+
+        empty = count == 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = magnitude_sum / count
+        mean[empty] = np.nan
+        magnitude_max[empty] = np.nan
+        energy_sum[empty] = np.nan
+        return {"count": count, "mean": mean, "max": magnitude_max, "energy": energy_sum}
+
+
+class ProvinceTimeCube:
+    """Per-province statistics per time bucket, as [province, bucket] arrays.
+
+    Holds the additive sums (count, magnitude sum, energy) and the maximum
+    magnitude, so coarser buckets and trailing rolling windows are derived
+    from the cube without going back to the events.
+    """
+
+    def __init__(self, count, magnitude_sum, magnitude_max, energy):
+        self.count = count
+        self.magnitude_sum = magnitude_sum
+        self.magnitude_max = magnitude_max
+        self.energy = energy
+
+    @classmethod
+    def from_events(cls, reducer, buckets, n_buckets, keep=None):
+        """Cube of the events selected by `keep` (a ProvinceReducer mask or row indices).
+
+        `buckets` holds the time bucket (0 <= b < n_buckets) of every event.
+        """
+        keep = reducer.assigned if keep is None else keep
+        n = len(reducer.names)
+        cells = reducer.codes[keep].astype(np.int64) * n_buckets + buckets[keep]
+        magnitude = reducer.magnitude[keep].astype(np.float64)
+        count = np.bincount(cells, minlength=n * n_buckets)
+        magnitude_sum = np.bincount(cells, weights=magnitude, minlength=n * n_buckets).astype(np.float64)
+        energy = np.bincount(cells, weights=reducer.energy[keep], minlength=n * n_buckets).astype(np.float64)
+        magnitude_max = np.full(n * n_buckets, -np.inf)
+        np.maximum.at(magnitude_max, cells, magnitude)
+        shape = (n, n_buckets)
+        return cls(count.reshape(shape), magnitude_sum.reshape(shape), magnitude_max.reshape(shape), energy.reshape(shape))
+
+    def coarsen(self, factor):
+        """Cube of consecutive groups of `factor` buckets (e.g. months to years)."""
+        n, n_buckets = self.count.shape
+        shape = (n, n_buckets // factor, factor)
+        return ProvinceTimeCube(self.count.reshape(shape).sum(axis=2), self.magnitude_sum.reshape(shape).sum(axis=2),
+                                self.magnitude_max.reshape(shape).max(axis=2), self.energy.reshape(shape).sum(axis=2))
+
+    def rolling(self, window):
+        """Cube whose bucket t covers buckets t - window + 1 to t (fewer at the start)."""
+        if window <= 1:
+            return self
+
+        def rolling_sum(values):
+            total = np.cumsum(values, axis=1)
+            total[:, window:] = total[:, window:] - total[:, :-window]
+            return total
+
+        padded = np.pad(self.magnitude_max, ((0, 0), (window - 1, 0)), constant_values=-np.inf)
+        magnitude_max = np.lib.stride_tricks.sliding_window_view(padded, window, axis=1).max(axis=2)
+        return ProvinceTimeCube(rolling_sum(self.count), rolling_sum(self.magnitude_sum), magnitude_max,
+                                rolling_sum(self.energy))
+
+    def statistics(self):
+        """Count, mean/max magnitude and summed energy, as [bucket, province] arrays.
+
+        Cells without events have count 0 and NaN for the other statistics.
+        """
+        empty = self.count == 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(empty, np.nan, self.magnitude_sum / self.count)
+        return {
+            "count": self.count.T,
+            "mean": mean.T,
+            "max": np.where(empty, np.nan, self.magnitude_max).T,
+            "energy": np.where(empty, np.nan, self.energy).T,
+        }
+
+
+def grid_bins(latitude, longitude, magnitude, cell_size):
+    """Events aggregated on a regular lat/lon grid, one row per non-empty cell.
+
+    Returns the cell centers with the event count and maximum magnitude of
+    each cell.
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    row = np.floor(latitude / cell_size).astype(np.int64)
+    col = np.floor(longitude / cell_size).astype(np.int64)
+    # Longitude cells fit comfortably in the low 32 bits of a combined key
+    keys, inverse, count = np.unique((row << 32) + (col + (1 << 31)), return_inverse=True, return_counts=True)
+    max_magnitude = np.full(len(keys), -np.inf)
+    np.maximum.at(max_magnitude, inverse.ravel(), np.asarray(magnitude, dtype=np.float64))
+    return pd.DataFrame({
+        "Latitude": ((keys >> 32) + 0.5) * cell_size,
+        "Longitude": ((keys & 0xFFFFFFFF) - (1 << 31) + 0.5) * cell_size,
+        "Count": count,
+        "Max Magnitude": max_magnitude,
+    })
+
+
+def widen_float32(chunk):
+    """float32 columns as the float64 nearest their shortest decimal form.
+
+    JSON encoders print the exact float64 value of a float32 (2.2 becomes
+    2.2000000477); going through the shortest repr keeps 2.2.
+    """
+    columns = [col for col, dtype in chunk.dtypes.items() if dtype == np.float32]
+    if not columns:
+        return chunk
+    return chunk.assign(**{col: chunk[col].to_numpy().astype(str).astype(np.float64) for col in columns})
@@ -0,0 +1,302 @@
+"""Per-callback instrumentation exposed in Prometheus text format.
+
+`install(app)` wraps `app.callback` so every callback registered afterwards
+records its wall time, call and error counts. Inside a callback,
+`phase("data")` / `phase("figure")` blocks split that time between data
+preparation and figure construction, and `report_exception()` replaces
+`traceback.print_exc()` so handled errors are counted too. Serialized
+response sizes are taken from the Flask responses of
+`/_dash-update-component`. Startup phases are recorded with
+`startup_phase(name)`; they are re-run for every snapshot swap, so each
+reports its latest run. The phase timings of the snapshot build (read,
+partitioning, per-year processing, merge, declustering, write) come from
+its manifest.
+
+Resident memory of the worker process and the in-memory size of the main
+tables are reported as well, to size the number of workers per machine.
+
+Everything is served on `/metrics` of the Flask server. Metrics are per
+process; with several gunicorn workers each worker reports its own.
+
+Setting SEISMIC_PROFILE_SAMPLE_RATE (0-1) runs that fraction of callback
+calls under cProfile; the aggregated profile is served on `/metrics/profile`.
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import resource
+import threading
+import time
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import Response, request
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("SEISMIC_PROFILE_SAMPLE_RATE", 0))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))       # callback
+_phases = defaultdict(lambda: Histogram(DURATION_BUCKETS))          # (callback, phase)
+_response_bytes = defaultdict(lambda: Histogram(BYTES_BUCKETS))     # callback
+_calls = defaultdict(int)                                           # callback
+_errors = defaultdict(int)                                          # callback
+_startup = {}                                                       # phase -> seconds
+_snapshot_build = {}                                                # phase -> seconds
+_table_bytes = {}                                                   # table -> bytes
+_profile = None
+
+
+def _current():
+    return getattr(_local, "callback", None)
+
+
+def _observe(store, key, value):
+    with _lock:
+        store[key].observe(value)
+
+
+@contextmanager
+def phase(name):
+    """Time a phase (e.g. "data", "figure") of the running callback."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        callback = _current()
+        if callback is not None:
+            _observe(_phases, (callback, name), time.perf_counter() - start)
+
+
+@contextmanager
+def startup_phase(name):
+    """Time a startup phase; a snapshot swap re-runs the phases and replaces their times."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _startup[name] = time.perf_counter() - start
+
+
+def record_startup(name, seconds):
+    with _lock:
+        _startup[name] = seconds
+
+
+def record_snapshot_build(timings):
+    """Phase timings (read, partition, process, merge, write) of the loaded snapshot's build."""
+    with _lock:
+        _snapshot_build.update(timings)
+
+
+def record_table_memory(name, df):
+    """Deep in-memory size of a dataframe (string and categorical payloads included)."""
+    with _lock:
+        _table_bytes[name] = int(df.memory_usage(deep=True).sum())
+
+
+def resident_memory():
+    """(current, peak) resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kilobytes on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        current = peak
+    return current, peak
+
+
+def report_exception():
+    """Print the active exception and count it against the running callback."""
+    traceback.print_exc()
+    with _lock:
+        _errors[_current() or "unknown"] += 1
+
+
+def _profiled(func, *args, **kwargs):
+    global _profile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        stats = pstats.Stats(profiler)
+        with _lock:
+            if _profile is None:
+                _profile = stats
+            else:
+                _profile.add(stats)
+
+
+def timed_callback(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = _current()
+        _local.callback = name
+        _local.last_callback = name
+        start = time.perf_counter()
+        try:
+            if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+                return _profiled(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        except Exception:
+            with _lock:
+                _errors[name] += 1
+            raise
+        finally:
+            _observe(_durations, name, time.perf_counter() - start)
+            with _lock:
+                _calls[name] += 1
+            _local.callback = previous
+
+    return wrapper
+
+
+def _record_response(response):
+    if request.path.endswith("/_dash-update-component"):
+        callback = getattr(_local, "last_callback", None)
+        _local.last_callback = None
+        if callback is not None and not response.direct_passthrough:
+            _observe(_response_bytes, callback, len(response.get_data()))
+    return response
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _histogram_lines(metric, histogram, labels):
+    lines = []
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append(f"{metric}_bucket{_format_labels({**labels, 'le': f'{bound:g}'})} {count}")
+    lines.append(f"{metric}_bucket{_format_labels({**labels, 'le': '+Inf'})} {histogram.total}")
+    lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+    lines.append(f"{metric}_count{_format_labels(labels)} {histogram.total}")
+    return lines
+
+
+def render():
+    """All metrics in Prometheus text exposition format."""
+    with _lock:
+        lines = [
+            "# HELP seismic_callback_duration_seconds Wall time of Dash callbacks.",
+            "# TYPE seismic_callback_duration_seconds histogram",
+        ]
+        for callback, histogram in sorted(_durations.items()):
+            lines += _histogram_lines("seismic_callback_duration_seconds", histogram, {"callback": callback})
+
+        lines += [
+            "# HELP seismic_callback_phase_seconds Time spent per callback phase (data preparation, figure construction).",
+            "# TYPE seismic_callback_phase_seconds histogram",
+        ]
+        for (callback, name), histogram in sorted(_phases.items()):
+            lines += _histogram_lines("seismic_callback_phase_seconds", histogram, {"callback": callback, "phase": name})
+
+        lines += [
+            "# HELP seismic_callback_response_bytes Serialized size of callback responses.",
+            "# TYPE seismic_callback_response_bytes histogram",
+        ]
+        for callback, histogram in sorted(_response_bytes.items()):
+            lines += _histogram_lines("seismic_callback_response_bytes", histogram, {"callback": callback})
+
+        lines += [
+            "# HELP seismic_callback_calls_total Dash callback invocations.",
+            "# TYPE seismic_callback_calls_total counter",
+        ]
+        lines += [f"seismic_callback_calls_total{_format_labels({'callback': c})} {n}" for c, n in sorted(_calls.items())]
+
+        lines += [
+            "# HELP seismic_callback_errors_total Exceptions raised or handled inside Dash callbacks.",
+            "# TYPE seismic_callback_errors_total counter",
+        ]
+        lines += [f"seismic_callback_errors_total{_format_labels({'callback': c})} {n}" for c, n in sorted(_errors.items())]
+
+        lines += [
+            "# HELP seismic_startup_phase_seconds Time spent in each startup phase of this worker, for the latest snapshot load.",
+            "# TYPE seismic_startup_phase_seconds gauge",
+        ]
+        lines += [f"seismic_startup_phase_seconds{_format_labels({'phase': p})} {s:.6f}" for p, s in _startup.items()]
+
+        lines += [
+            "# HELP seismic_snapshot_build_phase_seconds Build time per phase of the loaded data snapshot.",
+            "# TYPE seismic_snapshot_build_phase_seconds gauge",
+        ]
+        lines += [f"seismic_snapshot_build_phase_seconds{_format_labels({'phase': p})} {s:.6f}"
+                  for p, s in _snapshot_build.items()]
+
+        lines += [
+            "# HELP seismic_table_memory_bytes In-memory size of the loaded data tables.",
+            "# TYPE seismic_table_memory_bytes gauge",
+        ]
+        lines += [f"seismic_table_memory_bytes{_format_labels({'table': t})} {n}" for t, n in _table_bytes.items()]
+
+    current, peak = resident_memory()
+    lines += [
+        "# HELP seismic_process_resident_memory_bytes Resident set size of this worker process.",
+        "# TYPE seismic_process_resident_memory_bytes gauge",
+        f"seismic_process_resident_memory_bytes {current}",
+        "# HELP seismic_process_peak_resident_memory_bytes Peak resident set size of this worker process.",
+        "# TYPE seismic_process_peak_resident_memory_bytes gauge",
+        f"seismic_process_peak_resident_memory_bytes {peak}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def render_profile(limit=40):
+    with _lock:
+        if _profile is None:
+            return "No profile samples collected (set SEISMIC_PROFILE_SAMPLE_RATE to enable)\n"
+        out = io.StringIO()
+        _profile.stream = out
+        _profile.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+def install(app):
+    """Instrument every callback registered on `app` from now on and add the routes."""
+    register = app.callback
+
+    @functools.wraps(register)
+    def callback(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+
+        def wrap(func):
+            return decorator(timed_callback(func))
+
+        return wrap
+
+    app.callback = callback
+    server = app.server
+    server.after_request(_record_response)
+    server.add_url_rule("/metrics", "metrics", lambda: Response(render(), mimetype="text/plain; version=0.0.4"))
+    server.add_url_rule("/metrics/profile", "metrics_profile", lambda: Response(render_profile(), mimetype="text/plain"))
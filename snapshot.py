@@ -0,0 +1,1012 @@
+"""Precompiled data snapshot for the seismic map.
+
+Parsing the source CSV/GeoJSON files, the spatial join and the groupbys are
+done once here and written as uncompressed Arrow (Feather) files. The app
+memory-maps those files at startup, so gunicorn workers share the pages
+instead of each repeating the whole preprocessing.
+
+The snapshot is only rebuilt when the content hash of a source file changes.
+Events are then split by year and each year is cleaned, assigned to provinces
+and aggregated in a process pool (SEISMIC_BUILD_WORKERS, default one per
+CPU). Processed years are kept in data/partitions and reused by the next
+build unless their rows changed, so an interrupted build resumes and a
+corrected year only reprocesses that year. Partial tables are merged into
+the ones the app reads, and the merged catalog is declustered to flag its
+mainshocks.
+
+New event batches are added with `ingest`, which assigns provinces to the
+new events only, merges the additive tables and publishes a new version
+that running apps pick up without a restart.
+
+Province geometry is stored at several levels of detail, simplified with a
+topology-preserving coverage simplification (shared borders stay shared) and
+quantized to a grid matching each tolerance.
+
+Usage:
+    python snapshot.py build [--force]
+    python snapshot.py info
+    python snapshot.py lod-report
+    python snapshot.py mismatches
+    python snapshot.py ingest [FILE ...] [--drop-dir [DIR]]
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    import fcntl
+except ImportError: # Windows: builds are not serialized
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow.feather as feather
+import shapely
+
+from assignment import ProvinceAssigner, province_mismatches
+from declustering import mainshocks
+from faults import FaultLocator
+
+DATA_DIR = os.environ.get("SEISMIC_DATA_DIR", "data")
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshot")
+
+SOURCE_FILES = {
+    "provinces": "ph_provinces.geojson",
+    "faults": "gem_active_faults.geojson",
+    "earthquakes": "[POP] FINAL_merged_earthquake_data.csv",
+}
+
+# Event batches added with `ingest` are kept here (named <time>-<content hash>.csv)
+# and count as sources, so a full rebuild includes them too
+INGESTED_DIR = "ingested"
+# Files dropped here are picked up by `python snapshot.py ingest --drop-dir`
+DROP_DIR = os.environ.get("SEISMIC_DROP_DIR", os.path.join(DATA_DIR, "incoming"))
+# Processed per-year partitions of the event catalog, reused by later builds
+PARTITION_DIR = "partitions"
+BUILD_WORKERS = int(os.environ.get("SEISMIC_BUILD_WORKERS", 0)) or os.cpu_count() or 1
+BATCH_COLUMNS = ["Date", "Latitude", "Longitude", "Depth_In_Km", "Magnitude", "Location",
+                 "Province", "Region", "Island Group"]
+
+# Bump whenever the layout or contents of the snapshot change
+FORMAT_VERSION = 9
+
+# Simplification tolerances (degrees) for the province levels of detail,
+# finest first. A tolerance of 0 keeps full resolution and only quantizes.
+LOD_TOLERANCES = [float(t) for t in os.environ.get("SEISMIC_LOD_TOLERANCES", "0,0.001,0.005,0.02").split(",")]
+
+# Compact event catalog: repeated text as categoricals, measurements as
+# float32 and per-province population moved to population_df
+CATEGORICAL_COLUMNS = ["Province", "Region", "Island Group", "Location", "adm2_en", "Nearest_Fault"]
+FLOAT32_COLUMNS = ["Latitude", "Longitude", "Depth_In_Km", "Magnitude", "Fault_Distance_Km"]
+POPULATION_COLUMNS = ["2020", "2015", "2010", "2000"]
+
+TABLES = ["magnitude_df", "province_ave_magnitudes", "population_df",
+          "earthquake_counts", "overall_counts"]
+
+
+class Snapshot:
+    """Loaded snapshot: dataframes, geometries and pre-serialized GeoJSON."""
+
+    def __init__(self, path, manifest, tables, fault_overlay):
+        self.path = path
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self.fault_overlay = fault_overlay
+        self.province_lods = manifest["province_lods"]
+        self._geojson_cache = {}
+        for name in TABLES:
+            setattr(self, name, tables[name])
+
+    # Geometries are read on access and not kept, so the GeoDataFrames can
+    # be freed once the app has built what it needs from them
+    @property
+    def provinces(self):
+        return gpd.read_feather(os.path.join(self.path, "provinces.arrow"))
+
+    @property
+    def faults(self):
+        return gpd.read_feather(os.path.join(self.path, "faults.arrow"))
+
+    def pick_lod(self, max_tolerance):
+        """Coarsest level whose tolerance does not exceed `max_tolerance`."""
+        level = 0
+        for i, lod in enumerate(self.province_lods):
+            if lod["tolerance"] <= max_tolerance:
+                level = i
+        return level
+
+    def province_assigner(self):
+        """Point-in-province assigner backed by the saved lookup grid."""
+        grid_info = self.manifest["province_grid"]
+        grid = np.load(os.path.join(self.path, "province_grid.npy"), mmap_mode="r")
+        return ProvinceAssigner.from_provinces(self.provinces, grid_info["cell_size"], grid,
+                                               tuple(grid_info["origin"]))
+
+    def province_mismatches(self):
+        return read_table(os.path.join(self.path, "province_mismatches.arrow"))
+
+    def province_geojson(self, level=0):
+        if level not in self._geojson_cache:
+            with open(os.path.join(self.path, f"provinces_lod{level}.geojson")) as f:
+                self._geojson_cache[level] = json.load(f)
+        return self._geojson_cache[level]
+
+
+class SnapshotWatcher:
+    """State derived from the current snapshot, swapped when a new one is published.
+
+    `prepare(snapshot)` builds the state. `check()` is cheap enough to call
+    on every request: at most every `interval` seconds it re-reads the
+    `current` pointer and, when it moved, loads the new snapshot and
+    prepares its state in a background thread. `current` is then replaced
+    by a single assignment, so a reader that takes `watcher.current` once
+    sees one consistent version while the old one keeps serving requests
+    already in flight.
+    """
+
+    def __init__(self, prepare, snap, snapshot_dir=SNAPSHOT_DIR, interval=30, on_swap=None):
+        self.prepare = prepare
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self.on_swap = on_swap
+        self.current = prepare(snap)
+        self.version = snap.version
+        self._lock = threading.Lock()
+        self._next_check = time.monotonic() + interval
+        self._loading = False
+
+    def check(self):
+        now = time.monotonic()
+        if now < self._next_check or self._loading:
+            return
+        with self._lock:
+            if now < self._next_check or self._loading:
+                return
+            self._next_check = now + self.interval
+            version = current_version(self.snapshot_dir)
+            if version is None or version == self.version:
+                return
+            self._loading = True
+        threading.Thread(target=self._reload, daemon=True).start()
+
+    def _reload(self):
+        try:
+            snap = load_snapshot(snapshot_dir=self.snapshot_dir, build_if_stale=False)
+            state = self.prepare(snap)
+            self.current, self.version = state, snap.version
+            if self.on_swap is not None:
+                self.on_swap(state)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._loading = False
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ingested_batches(data_dir=DATA_DIR):
+    """File names of the ingested event batches, oldest first."""
+    path = os.path.join(data_dir, INGESTED_DIR)
+    if not os.path.isdir(path):
+        return []
+    return sorted(f for f in os.listdir(path) if f.endswith(".csv"))
+
+
+def source_hashes(data_dir=DATA_DIR):
+    """Content hash of every source file, or None if any of them is missing."""
+    paths = {name: os.path.join(data_dir, fname) for name, fname in SOURCE_FILES.items()}
+    if not all(os.path.exists(p) for p in paths.values()):
+        return None
+    hashes = {name: hash_file(p) for name, p in paths.items()}
+    for name in ingested_batches(data_dir):
+        hashes[f"batch:{name}"] = batch_hash(name)
+    return hashes
+
+
+def batch_hash(name):
+    # Batch names already carry their content hash
+    return os.path.splitext(name)[0].rsplit("-", 1)[1]
+
+
+def read_events(data_dir=DATA_DIR):
+    """The source catalog followed by every ingested batch, and a hash of each row.
+
+    Rows are hashed per file, before concatenation can change their dtypes
+    (a batch without the population columns turns them into floats), so a
+    row's hash only depends on its own file.
+    """
+    frames = [pd.read_csv(os.path.join(data_dir, SOURCE_FILES["earthquakes"]))]
+    frames += [pd.read_csv(os.path.join(data_dir, INGESTED_DIR, name)) for name in ingested_batches(data_dir)]
+    row_hashes = np.concatenate([hash_rows(frame) for frame in frames])
+    return (frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)), row_hashes
+
+
+def hash_rows(frame):
+    columns = hashlib.sha256(json.dumps(list(map(str, frame.columns))).encode()).digest()
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy() ^ np.frombuffer(columns[:8], dtype=np.uint64)
+
+
+def snapshot_version(hashes):
+    digest = hashlib.sha256(f"{FORMAT_VERSION}:{LOD_TOLERANCES}".encode())
+    for name in sorted(hashes):
+        digest.update(f"{name}:{hashes[name]}".encode())
+    return digest.hexdigest()[:16]
+
+
+def current_version(snapshot_dir=SNAPSHOT_DIR):
+    pointer = os.path.join(snapshot_dir, "current")
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer) as f:
+        version = f.read().strip()
+    if not os.path.exists(os.path.join(snapshot_dir, version, "manifest.json")):
+        return None
+    return version
+
+
+def clean_events(magnitude_df):
+    # Added columns to simplify bubble map charting
+    magnitude_df["Date"] = pd.to_datetime(magnitude_df["Date"])
+    magnitude_df["Year_Earthquake"] = magnitude_df["Date"].dt.year
+    magnitude_df["Year"] = magnitude_df["Date"].dt.year
+    return magnitude_df
+
+
+def add_fault_distances(magnitude_df, locator):
+    """Distance (km) to and name of the nearest active fault for every event."""
+    distance, name = locator.nearest_names(magnitude_df["Longitude"], magnitude_df["Latitude"])
+    magnitude_df["Fault_Distance_Km"] = distance
+    magnitude_df["Nearest_Fault"] = name
+    return magnitude_df
+
+
+def aggregate_events(magnitude_df):
+    """Per-province and per-year tables of a set of cleaned, assigned events.
+
+    Every table is additive (sums and counts), so the tables of a new batch
+    can be merged into existing ones with `merge_aggregates`.
+    """
+    # Magnitude sum and count per province; the average is derived from them
+    province_ave_magnitudes = (magnitude_df.groupby("adm2_en")["Magnitude"].agg(["sum", "count"])
+                               .rename(columns={"sum": "Magnitude Sum", "count": "Count"}).reset_index())
+    province_ave_magnitudes.insert(1, "Magnitude", province_ave_magnitudes["Magnitude Sum"] / province_ave_magnitudes["Count"])
+
+    # Population data, one row per province instead of repeated on every event.
+    # Batches without census columns contribute no rows.
+    if all(col in magnitude_df.columns for col in POPULATION_COLUMNS):
+        population_df = magnitude_df[["Province"] + POPULATION_COLUMNS].dropna().drop_duplicates("Province")
+        population_df["2000"] = population_df["2000"].astype(str).str.replace(",", "")
+        population_df = population_df.astype({col: np.int64 for col in POPULATION_COLUMNS}).reset_index(drop=True)
+    else:
+        population_df = pd.DataFrame({col: pd.Series(dtype=object if col == "Province" else np.int64)
+                                      for col in ["Province"] + POPULATION_COLUMNS})
+
+    # Line chart counts
+    grouping_cols = ["Year", "Province", "Region", "Island Group"]
+    missing_cols = [col for col in grouping_cols if col not in magnitude_df.columns]
+    if missing_cols:
+        raise ValueError(f"Missing required columns for line chart aggregation: {missing_cols}")
+    earthquake_counts = magnitude_df.groupby(grouping_cols).size().reset_index(name="Number of Earthquakes")
+    overall_counts = magnitude_df.groupby("Year").size().reset_index(name="Number of Earthquakes")
+
+    return {
+        "province_ave_magnitudes": province_ave_magnitudes,
+        "population_df": population_df,
+        "earthquake_counts": earthquake_counts,
+        "overall_counts": overall_counts,
+    }
+
+
+def merge_aggregates(*parts):
+    """Tables of `aggregate_events` for the union of several sets of events."""
+    def concat(name):
+        return pd.concat([part[name] for part in parts])
+
+    magnitudes = concat("province_ave_magnitudes").groupby("adm2_en")[["Magnitude Sum", "Count"]].sum().reset_index()
+    magnitudes.insert(1, "Magnitude", magnitudes["Magnitude Sum"] / magnitudes["Count"])
+
+    # The first population seen for a province is kept
+    population = concat("population_df").drop_duplicates("Province").reset_index(drop=True)
+
+    grouping_cols = ["Year", "Province", "Region", "Island Group"]
+    counts = concat("earthquake_counts").groupby(grouping_cols)["Number of Earthquakes"].sum().reset_index()
+    overall = concat("overall_counts").groupby("Year")["Number of Earthquakes"].sum().reset_index()
+    return {
+        "province_ave_magnitudes": magnitudes,
+        "population_df": population,
+        "earthquake_counts": counts,
+        "overall_counts": overall,
+    }
+
+
+def add_mainshocks(datasets):
+    """Flag the mainshocks of the merged catalog and count them per year.
+
+    Clusters cross year partitions and ingested batches, so declustering
+    runs on the whole catalog once it is merged (see declustering.py). The
+    counts are added to the line chart tables as "Number of Mainshocks".
+    """
+    catalog = datasets["magnitude_df"]
+    catalog["Mainshock"] = mainshocks(catalog["Latitude"], catalog["Longitude"], catalog["Magnitude"], catalog["Date"])
+    events = catalog.loc[catalog["Mainshock"], ["Year_Earthquake", "Province", "Region", "Island Group"]]
+    events = events.rename(columns={"Year_Earthquake": "Year"}).astype({"Year": np.int32})
+
+    grouping_cols = ["Year", "Province", "Region", "Island Group"]
+    for name, keys in [("earthquake_counts", grouping_cols), ("overall_counts", ["Year"])]:
+        table = datasets[name].drop(columns="Number of Mainshocks", errors="ignore")
+        counts = events.groupby(keys, observed=True).size().rename("Number of Mainshocks").reset_index()
+        counts = counts.astype({col: object for col in keys if col != "Year"})
+        table = table.merge(counts, on=keys, how="left")
+        table["Number of Mainshocks"] = table["Number of Mainshocks"].fillna(0).astype(np.int64)
+        datasets[name] = table
+    return datasets
+
+
+def process_events(magnitude_df, assigner, locator, timings=None):
+    """Clean, assign and aggregate one set of raw events.
+
+    Returns the compact catalog, the additive tables of `aggregate_events`
+    and the province mismatches (event positions within `magnitude_df`).
+    Phase durations are added to `timings` when a dict is given.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    magnitude_df = clean_events(magnitude_df)
+    timings["clean"] = time.perf_counter() - start
+
+    # Assign each event to a province (grid lookup with exact test near
+    # borders)
+    start = time.perf_counter()
+    magnitude_df["adm2_en"] = assigner.assign_names(magnitude_df["Longitude"], magnitude_df["Latitude"])
+    timings["assign"] = time.perf_counter() - start
+    start = time.perf_counter()
+    add_fault_distances(magnitude_df, locator)
+    timings["faults"] = time.perf_counter() - start
+    start = time.perf_counter()
+
+    # Events whose catalog Province text disagrees with the geometry
+    mismatches = province_mismatches(magnitude_df["Province"], magnitude_df["adm2_en"])
+
+    aggregates = aggregate_events(magnitude_df)
+    timings["aggregate"] = time.perf_counter() - start
+    return {"magnitude_df": compact_catalog(magnitude_df), **aggregates, "province_mismatches": mismatches}
+
+
+def philippine_faults(active_faults):
+    return active_faults[active_faults["catalog_name"].str.contains("Philippines", case=False)].reset_index(drop=True)
+
+
+def partition_events(magnitude_df, row_hashes, hashes):
+    """Split the raw events by year.
+
+    Returns {year: (row positions, key)}. The key covers the raw rows of the
+    year (`row_hashes` from `read_events`), the geometry sources and the
+    format version, so it only changes when something that affects the
+    year's results does. Dates are parsed in place; events without a date
+    belong to no year and are left out, as the per-year grouping always did.
+    """
+    magnitude_df["Date"] = pd.to_datetime(magnitude_df["Date"])
+    dated = magnitude_df["Date"].notna().to_numpy()
+    years = magnitude_df["Date"].dt.year.to_numpy()
+    base = f"{FORMAT_VERSION}:{hashes['provinces']}:{hashes['faults']}".encode()
+
+    # Stable sort keeps each year's rows in source order
+    order = np.flatnonzero(dated)
+    order = order[np.argsort(years[order], kind="stable")]
+    boundaries = np.flatnonzero(years[order][1:] != years[order][:-1]) + 1
+    partitions = {}
+    for rows in np.split(order, boundaries):
+        if len(rows) == 0:
+            continue
+        digest = hashlib.sha256(base)
+        digest.update(row_hashes[rows].tobytes())
+        partitions[int(years[rows[0]])] = (rows, digest.hexdigest()[:16])
+    return partitions
+
+
+def partition_path(partition_dir, year, key):
+    return os.path.join(partition_dir, f"{year}-{key}")
+
+
+# Per-process state of the partition workers, set by init_partition_worker
+_partition_worker = {}
+
+
+def init_partition_worker(gdf_ph_provinces, ph_faults, grid, origin, cell_size):
+    # The lookup grid is rasterized once by the parent and shared
+    _partition_worker["assigner"] = ProvinceAssigner.from_provinces(gdf_ph_provinces, cell_size, grid, origin)
+    _partition_worker["locator"] = FaultLocator.from_faults(ph_faults)
+
+
+def build_partition(year, key, events, partition_dir):
+    """Process one year of raw events into its own directory; returns the phase timings."""
+    timings = {}
+    datasets = process_events(events.reset_index(drop=True), _partition_worker["assigner"],
+                              _partition_worker["locator"], timings)
+    manifest = {"year": year, "key": key, "timings": {phase: round(s, 4) for phase, s in timings.items()}}
+    staging_path = os.path.join(partition_dir, f".{year}-{key}-{os.getpid()}")
+    shutil.rmtree(staging_path, ignore_errors=True)
+    os.makedirs(staging_path)
+    write_tables(datasets, staging_path, manifest)
+    # Written last: a partition without a manifest is incomplete
+    with open(os.path.join(staging_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    final_path = partition_path(partition_dir, year, key)
+    shutil.rmtree(final_path, ignore_errors=True)
+    try:
+        os.rename(staging_path, final_path)
+    except OSError:
+        # Another build wrote the same partition first
+        shutil.rmtree(staging_path, ignore_errors=True)
+    return timings
+
+
+def process_partitions(magnitude_df, partitions, gdf_ph_provinces, ph_faults, assigner, partition_dir,
+                       rebuild=False, workers=BUILD_WORKERS):
+    """Build every partition that is not already processed, in a process pool.
+
+    Finished partitions stay in `partition_dir`, so an interrupted or repeated
+    build only processes the years still missing. With `rebuild` every
+    partition is processed again. Returns the years processed and their
+    summed phase timings.
+    """
+    os.makedirs(partition_dir, exist_ok=True)
+    todo = [year for year, (rows, key) in partitions.items()
+            if rebuild or not os.path.exists(os.path.join(partition_path(partition_dir, year, key), "manifest.json"))]
+    # Largest years first so a big one does not finish last
+    todo.sort(key=lambda year: -len(partitions[year][0]))
+    init_args = (gdf_ph_provinces, ph_faults, assigner.grid, assigner.origin, assigner.cell_size)
+
+    def task(year):
+        rows, key = partitions[year]
+        return year, key, magnitude_df.iloc[rows], partition_dir
+
+    totals = {}
+
+    def add(timings):
+        for phase, seconds in timings.items():
+            totals[phase] = totals.get(phase, 0.0) + seconds
+
+    if workers > 1 and len(todo) > 1:
+        # fork avoids re-importing __main__ (app.py builds on import) in the workers
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(min(workers, len(todo)), mp_context=context,
+                                 initializer=init_partition_worker, initargs=init_args) as pool:
+            # Few partitions in flight, so the copies sent to the workers do
+            # not double the catalog in memory
+            pending = set()
+            for year in todo:
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        add(future.result())
+                pending.add(pool.submit(build_partition, *task(year)))
+            for future in pending:
+                add(future.result())
+    else:
+        init_partition_worker(*init_args)
+        for year in todo:
+            add(build_partition(*task(year)))
+    return sorted(todo), totals
+
+
+def merge_partitions(partitions, partition_dir):
+    """Combine the processed partitions into the snapshot tables.
+
+    Catalog rows are put back in source order, so the result matches
+    processing all events at once. Rows in no partition (undated events)
+    are skipped, and mismatch event positions refer to the merged catalog.
+    """
+    parts = []
+    for year in sorted(partitions):
+        rows, key = partitions[year]
+        path = partition_path(partition_dir, year, key)
+        tables = {name: read_table(os.path.join(path, f"{name}.arrow")) for name in TABLES + ["province_mismatches"]}
+        tables["province_mismatches"]["event"] = rows[tables["province_mismatches"]["event"].to_numpy()]
+        parts.append((rows, tables))
+
+    positions = np.concatenate([rows for rows, _ in parts])
+    order = np.argsort(positions, kind="stable")
+    for _, tables in parts:
+        tables["province_mismatches"]["event"] = np.searchsorted(positions[order],
+                                                                 tables["province_mismatches"]["event"].to_numpy())
+    catalog = concat_catalogs([tables["magnitude_df"] for _, tables in parts])
+    datasets = merge_aggregates(*(tables for _, tables in parts))
+    datasets["magnitude_df"] = catalog.take(order).reset_index(drop=True)
+    datasets["province_mismatches"] = (pd.concat([tables["province_mismatches"] for _, tables in parts])
+                                       .sort_values("event").reset_index(drop=True))
+    return datasets
+
+
+def prune_partitions(partitions, partition_dir):
+    """Remove partitions (and leftover staging directories) not in `partitions`."""
+    keep = {f"{year}-{key}" for year, (rows, key) in partitions.items()}
+    for name in os.listdir(partition_dir):
+        if name not in keep:
+            shutil.rmtree(os.path.join(partition_dir, name), ignore_errors=True)
+
+
+def compact_catalog(magnitude_df):
+    """Event table in its memory-optimized form.
+
+    Population columns and the duplicate `Year` column are dropped (see
+    population_df and Year_Earthquake), text columns become categoricals,
+    coordinates, depth and magnitude float32, and dates second-resolution
+    datetime64.
+    """
+    dropped = [col for col in POPULATION_COLUMNS + ["Year"] if col in magnitude_df.columns]
+    catalog = magnitude_df.drop(columns=dropped)
+    for col in CATEGORICAL_COLUMNS:
+        if col in catalog.columns:
+            catalog[col] = catalog[col].astype("category")
+    for col in FLOAT32_COLUMNS:
+        if col in catalog.columns:
+            catalog[col] = catalog[col].astype(np.float32)
+    catalog["Year_Earthquake"] = catalog["Year_Earthquake"].astype(np.int16)
+    catalog["Date"] = catalog["Date"].astype("datetime64[s]")
+    return catalog
+
+
+def append_events(catalog, new_events):
+    """Concatenate two compact catalogs, merging the categorical vocabularies.
+
+    Existing category codes are unchanged; categories first seen in
+    `new_events` are appended.
+    """
+    new_events = new_events.copy()
+    catalog = catalog.copy(deep=False)
+    for col in CATEGORICAL_COLUMNS:
+        if col in catalog.columns and col in new_events.columns:
+            categories = catalog[col].cat.categories.union(new_events[col].cat.categories, sort=False)
+            catalog[col] = catalog[col].cat.set_categories(categories)
+            new_events[col] = new_events[col].cat.set_categories(categories)
+    return pd.concat([catalog, new_events], ignore_index=True)
+
+
+def concat_catalogs(catalogs):
+    """Concatenate compact catalogs with sorted categorical vocabularies, as
+    `compact_catalog` of all their events would give."""
+    catalogs = [catalog.copy(deep=False) for catalog in catalogs]
+    for col in CATEGORICAL_COLUMNS:
+        if all(col in catalog.columns for catalog in catalogs):
+            categories = sorted(set().union(*(catalog[col].cat.categories for catalog in catalogs)))
+            for catalog in catalogs:
+                catalog[col] = catalog[col].cat.set_categories(categories)
+    return pd.concat(catalogs, ignore_index=True)
+
+
+def build_fault_overlay(ph_faults, decimals=5):
+    """Flatten every fault segment into one set of line arrays.
+
+    Segments are concatenated with a None break between them so the whole
+    network can be drawn as a single Scattermapbox trace. `text` holds the
+    fault name for each vertex (the "Fault:" prefix lives in the hovertemplate).
+    """
+    parts = ph_faults[["name", "geometry"]].explode(index_parts=False)
+    parts = parts[parts.geometry.notna() & ~parts.geometry.is_empty]
+    if parts.empty:
+        return {"lat": [], "lon": [], "text": []}
+
+    coords, part_idx = shapely.get_coordinates(parts.geometry.values, return_index=True)
+    labels = parts["name"].fillna("Unnamed Fault").astype(str).to_numpy()
+
+    # Vertex i of part k lands at i + k, leaving one slot after each part for the break
+    n_out = len(coords) + len(parts)
+    positions = np.arange(len(coords)) + part_idx
+    lon = np.full(n_out, np.nan)
+    lat = np.full(n_out, np.nan)
+    text = np.full(n_out, "", dtype=object)
+    lon[positions] = coords[:, 0].round(decimals)
+    lat[positions] = coords[:, 1].round(decimals)
+    text[positions] = labels[part_idx]
+
+    # Drop the trailing break; NaN becomes None (null in JSON)
+    lon, lat, text = lon[:-1], lat[:-1], text[:-1]
+    to_list = lambda a: [None if np.isnan(v) else float(v) for v in a]
+    return {"lat": to_list(lat), "lon": to_list(lon), "text": text.tolist()}
+
+
+def quantize_decimals(tolerance):
+    # Grid of about a tenth of the tolerance; 5 decimals (~1 m) at full resolution
+    if tolerance <= 0:
+        return 5
+    return int(min(5, max(2, np.ceil(-np.log10(tolerance / 10)))))
+
+
+def build_province_lods(gdf_ph_provinces, tolerances=LOD_TOLERANCES):
+    """Serialize the provinces once per level of detail.
+
+    Returns a list of (stats, geojson_text). coverage_simplify treats the
+    provinces as one polygonal coverage, so an edge shared by two provinces
+    is simplified identically on both sides and no gaps open between them.
+    Quantizing afterwards rounds shared vertices to the same grid point.
+    """
+    geoms = gdf_ph_provinces.geometry.to_numpy()
+    names = gdf_ph_provinces["adm2_en"].to_numpy()
+    levels = []
+    for tolerance in tolerances:
+        simplified = shapely.coverage_simplify(geoms, tolerance) if tolerance > 0 else geoms
+        decimals = quantize_decimals(tolerance)
+        quantized = shapely.transform(simplified, lambda c: np.round(c, decimals))
+        quantized = shapely.remove_repeated_points(quantized)
+        # Only the key used by the choropleth is kept in the properties
+        frame = gpd.GeoDataFrame({"adm2_en": names}, geometry=quantized, crs=gdf_ph_provinces.crs)
+        geojson = frame.to_json(drop_id=True)
+        stats = {
+            "tolerance": tolerance,
+            "decimals": decimals,
+            "vertices": int(shapely.get_num_coordinates(quantized).sum()),
+            "bytes": len(geojson),
+        }
+        levels.append((stats, geojson))
+    return levels
+
+
+def write_tables(datasets, path, manifest):
+    """Write the event tables, which are all that changes when events are ingested."""
+    for name in TABLES:
+        # Uncompressed so the files can be memory-mapped without a decode step
+        feather.write_feather(datasets[name].reset_index(drop=True), os.path.join(path, f"{name}.arrow"),
+                              compression="uncompressed")
+    feather.write_feather(datasets["province_mismatches"], os.path.join(path, "province_mismatches.arrow"),
+                          compression="uncompressed")
+    manifest["province_mismatches"] = int(len(datasets["province_mismatches"]))
+    manifest["rows"] = {name: int(len(datasets[name])) for name in TABLES}
+
+
+def write_snapshot(datasets, path, manifest):
+    os.makedirs(path)
+    write_tables(datasets, path, manifest)
+    datasets["provinces"].to_feather(os.path.join(path, "provinces.arrow"))
+    datasets["faults"].to_feather(os.path.join(path, "faults.arrow"))
+    manifest["province_lods"] = []
+    for level, (stats, geojson) in enumerate(build_province_lods(datasets["provinces"])):
+        with open(os.path.join(path, f"provinces_lod{level}.geojson"), "w") as f:
+            f.write(geojson)
+        manifest["province_lods"].append(stats)
+    with open(os.path.join(path, "fault_overlay.json"), "w") as f:
+        json.dump(build_fault_overlay(datasets["faults"]), f, separators=(",", ":"))
+    # Province lookup grid, reused to assign newly ingested events
+    assigner = datasets["assigner"]
+    np.save(os.path.join(path, "province_grid.npy"), assigner.grid)
+    manifest["province_grid"] = {"cell_size": assigner.cell_size, "origin": list(assigner.origin)}
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def publish(snapshot_dir, version, staging_path):
+    """Move a staged build into place and atomically repoint `current`."""
+    final_path = os.path.join(snapshot_dir, version)
+    try:
+        os.rename(staging_path, final_path)
+    except OSError:
+        # Another worker published the same version first
+        shutil.rmtree(staging_path, ignore_errors=True)
+    pointer_tmp = os.path.join(snapshot_dir, f".current-{os.getpid()}")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(snapshot_dir, "current"))
+
+
+@contextmanager
+def build_lock(snapshot_dir=SNAPSHOT_DIR):
+    """Exclusive lock for writing the snapshot and the partitions.
+
+    Gunicorn workers that all find the snapshot stale at import wait for the
+    first one's build instead of building into the same partitions at once.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    with open(os.path.join(snapshot_dir, ".build.lock"), "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def build_snapshot(data_dir=DATA_DIR, snapshot_dir=SNAPSHOT_DIR, force=False):
+    """Rebuild the snapshot if the sources changed; returns the current version."""
+    hashes = source_hashes(data_dir)
+    if hashes is not None and not force and current_version(snapshot_dir) == snapshot_version(hashes):
+        return snapshot_version(hashes)
+    with build_lock(snapshot_dir):
+        return _build_snapshot(data_dir, snapshot_dir, force)
+
+
+def _build_snapshot(data_dir, snapshot_dir, force):
+    # Sources are hashed again under the lock: a build that waited may find its work done
+    hashes = source_hashes(data_dir)
+    if hashes is None:
+        raise FileNotFoundError(f"Source files missing in {data_dir}: {list(SOURCE_FILES.values())}")
+    version = snapshot_version(hashes)
+    if not force and current_version(snapshot_dir) == version:
+        return version
+
+    timings = {}
+    start = time.perf_counter()
+    gdf_ph_provinces = gpd.read_file(os.path.join(data_dir, SOURCE_FILES["provinces"]))
+    ph_faults = philippine_faults(gpd.read_file(os.path.join(data_dir, SOURCE_FILES["faults"])))
+    magnitude_df, row_hashes = read_events(data_dir)
+    timings["read"] = time.perf_counter() - start
+    start = time.perf_counter()
+    partitions = partition_events(magnitude_df, row_hashes, hashes)
+    undated = int(magnitude_df["Date"].isna().sum())
+    timings["partition"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assigner = ProvinceAssigner.from_provinces(gdf_ph_provinces)
+    partition_dir = os.path.join(data_dir, PARTITION_DIR)
+    processed, partition_timings = process_partitions(magnitude_df, partitions, gdf_ph_provinces, ph_faults,
+                                                      assigner, partition_dir, rebuild=force)
+    del magnitude_df
+    timings["process"] = time.perf_counter() - start
+    start = time.perf_counter()
+    datasets = merge_partitions(partitions, partition_dir)
+    datasets.update(provinces=gdf_ph_provinces, faults=ph_faults, assigner=assigner)
+    timings["merge"] = time.perf_counter() - start
+    start = time.perf_counter()
+    add_mainshocks(datasets)
+    timings["decluster"] = time.perf_counter() - start
+
+    manifest = {
+        "version": version,
+        "format_version": FORMAT_VERSION,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+        "sources": hashes,
+        "undated_events": undated,
+        "partitions": {
+            "years": sorted(partitions),
+            "processed": processed,
+            "timings": {phase: round(seconds, 4) for phase, seconds in partition_timings.items()},
+        },
+    }
+    os.makedirs(snapshot_dir, exist_ok=True)
+    staging_path = os.path.join(snapshot_dir, f".build-{version}-{os.getpid()}")
+    shutil.rmtree(staging_path, ignore_errors=True)
+    start = time.perf_counter()
+    write_snapshot(datasets, staging_path, manifest)
+    timings["write"] = time.perf_counter() - start
+    # Rewritten so the manifest includes the write phase
+    manifest["build_timings"] = {phase: round(seconds, 4) for phase, seconds in timings.items()}
+    with open(os.path.join(staging_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    publish(snapshot_dir, version, staging_path)
+    prune_partitions(partitions, partition_dir)
+    return version
+
+
+def read_batch(path, data_dir=DATA_DIR):
+    """Validate an event batch; returns (name to store it under, events).
+
+    Returns (None, None) when the batch is empty or a batch with the same
+    content was ingested before. Raises ValueError when a column is missing
+    or holds values the build cannot process. Dates are parsed; undated
+    events are kept (see `ingest`).
+    """
+    events = pd.read_csv(path)
+    missing = [col for col in BATCH_COLUMNS if col not in events.columns]
+    if missing:
+        raise ValueError(f"{path}: missing columns {missing}")
+    try:
+        events["Date"] = pd.to_datetime(events["Date"])
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"{path}: unreadable Date values ({e})") from e
+    invalid = [col for col in ["Latitude", "Longitude", "Depth_In_Km", "Magnitude"]
+               if not pd.api.types.is_numeric_dtype(events[col])]
+    if invalid:
+        raise ValueError(f"{path}: non-numeric values in {invalid}")
+    if events.empty:
+        return None, None
+    digest = hash_file(path)[:16]
+    if any(name.endswith(f"-{digest}.csv") for name in ingested_batches(data_dir)):
+        return None, None
+    return f"{datetime.now():%Y%m%dT%H%M%S%f}-{digest}.csv", events
+
+
+def store_batch(path, name, data_dir=DATA_DIR):
+    """Keep a batch in the ingested directory, where it counts as a source."""
+    batch_dir = os.path.join(data_dir, INGESTED_DIR)
+    os.makedirs(batch_dir, exist_ok=True)
+    tmp_path = os.path.join(batch_dir, f".{name}.tmp")
+    shutil.copyfile(path, tmp_path)
+    os.replace(tmp_path, os.path.join(batch_dir, name))
+
+
+def ingest(paths, data_dir=DATA_DIR, snapshot_dir=SNAPSHOT_DIR):
+    """Add event batches to the current snapshot without a full rebuild.
+
+    Only the new events are cleaned, assigned to provinces (with the
+    saved lookup grid) and matched to their nearest fault; the per-province
+    and per-year tables are merged with the batch's own, and the catalog is
+    appended to and declustered again. Geometry files are
+    hard-linked from the previous version. The result is published like a
+    full build, so running apps switch to it on their next check and a
+    later full rebuild of the same sources yields the same version.
+    Undated events are counted and left out, as in a full build. Batches
+    are stored in the ingested directory only once the new snapshot is
+    written, so a batch that fails to process is not half-ingested.
+
+    Returns the published version.
+    """
+    with build_lock(snapshot_dir):
+        return _ingest(paths, data_dir, snapshot_dir)
+
+
+def _ingest(paths, data_dir, snapshot_dir):
+    # Start from a snapshot that matches the sources stored so far
+    _build_snapshot(data_dir, snapshot_dir, force=False)
+    snap = load_snapshot(data_dir, snapshot_dir, build_if_stale=False)
+
+    timings = {}
+    start = time.perf_counter()
+    batches, frames = {}, []
+    for path in paths:
+        name, events = read_batch(path, data_dir)
+        # The same content passed twice is ingested once
+        if name is not None and batch_hash(name) not in map(batch_hash, batches):
+            batches[name] = path
+            frames.append(events)
+    if not frames:
+        return snap.version
+    events = pd.concat(frames, ignore_index=True)
+    undated = events["Date"].isna()
+    events = events[~undated].reset_index(drop=True)
+    timings["read"] = time.perf_counter() - start
+
+    batch = process_events(events, snap.province_assigner(), FaultLocator.from_faults(snap.faults), timings)
+    start = time.perf_counter()
+    mismatches = batch["province_mismatches"]
+    mismatches["event"] += len(snap.magnitude_df)
+    datasets = merge_aggregates({name: getattr(snap, name) for name in TABLES}, batch)
+    datasets["magnitude_df"] = append_events(snap.magnitude_df, batch["magnitude_df"])
+    datasets["province_mismatches"] = pd.concat([snap.province_mismatches(), mismatches], ignore_index=True)
+    timings["merge"] = time.perf_counter() - start
+    # New events can join clusters of earlier ones, so the whole catalog is declustered again
+    start = time.perf_counter()
+    add_mainshocks(datasets)
+    timings["decluster"] = time.perf_counter() - start
+
+    hashes = source_hashes(data_dir)
+    hashes.update({f"batch:{name}": batch_hash(name) for name in batches})
+    version = snapshot_version(hashes)
+    manifest = dict(snap.manifest, version=version, built_at=datetime.now().isoformat(timespec="seconds"),
+                    sources=hashes, ingested_from=snap.version,
+                    undated_events=snap.manifest.get("undated_events", 0) + int(undated.sum()))
+    # Describes the partitions of the last full build, which no longer cover every event
+    manifest.pop("partitions", None)
+    staging_path = os.path.join(snapshot_dir, f".build-{version}-{os.getpid()}")
+    shutil.rmtree(staging_path, ignore_errors=True)
+    start = time.perf_counter()
+    os.makedirs(staging_path)
+    replaced = {f"{name}.arrow" for name in TABLES} | {"province_mismatches.arrow", "manifest.json"}
+    for fname in os.listdir(snap.path):
+        if fname not in replaced:
+            try:
+                os.link(os.path.join(snap.path, fname), os.path.join(staging_path, fname))
+            except OSError:
+                shutil.copy2(os.path.join(snap.path, fname), os.path.join(staging_path, fname))
+    write_tables(datasets, staging_path, manifest)
+    timings["write"] = time.perf_counter() - start
+    manifest["build_timings"] = {phase: round(seconds, 4) for phase, seconds in timings.items()}
+    with open(os.path.join(staging_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    for name, path in batches.items():
+        store_batch(path, name, data_dir)
+    publish(snapshot_dir, version, staging_path)
+    return version
+
+
+def read_table(path):
+    # split_blocks lets numeric columns stay zero-copy views of the mapped file
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def load_snapshot(data_dir=DATA_DIR, snapshot_dir=SNAPSHOT_DIR, build_if_stale=True):
+    """Load the current snapshot, rebuilding it first if the sources changed.
+
+    When the source files are absent (e.g. a deployment that only ships the
+    snapshot) the existing snapshot is used as-is.
+    """
+    if build_if_stale and source_hashes(data_dir) is not None:
+        version = build_snapshot(data_dir, snapshot_dir)
+    else:
+        version = current_version(snapshot_dir)
+    if version is None:
+        raise FileNotFoundError(f"No data snapshot found in {snapshot_dir}; run `python snapshot.py build`")
+
+    path = os.path.join(snapshot_dir, version)
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    tables = {name: read_table(os.path.join(path, f"{name}.arrow")) for name in TABLES}
+    with open(os.path.join(path, "fault_overlay.json")) as f:
+        fault_overlay = json.load(f)
+    return Snapshot(path, manifest, tables, fault_overlay)
+
+
+def lod_report(snap):
+    """Payload size and figure build/serialize time for every level of detail."""
+    import plotly.graph_objects as go
+
+    names = snap.provinces["adm2_en"].tolist()
+    z = np.linspace(1, 5, len(names))
+    go.Figure(go.Choroplethmapbox()).to_json() # Warm up plotly's validators
+    rows = []
+    for level, lod in enumerate(snap.province_lods):
+        geojson = snap.province_geojson(level)
+        start = time.perf_counter()
+        fig = go.Figure(go.Choroplethmapbox(geojson=geojson, locations=names, z=z,
+                                            featureidkey="properties.adm2_en"))
+        payload = fig.to_json()
+        elapsed = time.perf_counter() - start
+        rows.append((level, lod["tolerance"], lod["vertices"], len(payload), elapsed * 1000))
+
+    print(f"{'level':>5} {'tolerance':>10} {'vertices':>10} {'figure bytes':>13} {'build+json ms':>14}")
+    for level, tolerance, vertices, size, ms in rows:
+        print(f"{level:>5} {tolerance:>10g} {vertices:>10,} {size:>13,} {ms:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the seismic map data snapshot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="rebuild the snapshot if the source files changed")
+    build.add_argument("--force", action="store_true",
+                       help="rebuild even if the sources are unchanged, reprocessing every year")
+    sub.add_parser("info", help="print the manifest of the current snapshot")
+    sub.add_parser("lod-report", help="compare payload size and build time of the province levels of detail")
+    sub.add_parser("mismatches", help="list events whose catalog Province disagrees with the geometric assignment")
+    ingest_cmd = sub.add_parser("ingest", help="add CSV batches of new events to the current snapshot")
+    ingest_cmd.add_argument("files", nargs="*", help="batch files in the catalog CSV schema")
+    ingest_cmd.add_argument("--drop-dir", nargs="?", const=DROP_DIR,
+                            help=f"also ingest (and then remove) every CSV in this directory (default {DROP_DIR})")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(f"Snapshot version: {build_snapshot(force=args.force)}")
+    elif args.command == "info":
+        version = current_version()
+        if version is None:
+            print("No snapshot built yet")
+            return
+        with open(os.path.join(SNAPSHOT_DIR, version, "manifest.json")) as f:
+            print(f.read())
+    elif args.command == "lod-report":
+        lod_report(load_snapshot())
+    elif args.command == "mismatches":
+        mismatches = load_snapshot().province_mismatches()
+        print(f"{len(mismatches):,} events where the catalog Province disagrees with the geometry")
+        if not mismatches.empty:
+            summary = (mismatches.fillna({"adm2_en": "(outside all provinces)"})
+                       .groupby(["Province", "adm2_en"]).size().sort_values(ascending=False))
+            print(summary.head(50).to_string())
+    elif args.command == "ingest":
+        files = list(args.files)
+        if args.drop_dir and os.path.isdir(args.drop_dir):
+            dropped = sorted(os.path.join(args.drop_dir, f) for f in os.listdir(args.drop_dir) if f.endswith(".csv"))
+            files += dropped
+        else:
+            dropped = []
+        if not files:
+            print("Nothing to ingest")
+            return
+        print(f"Snapshot version: {ingest(files)}")
+        # Batches are stored in the data directory once ingested
+        for path in dropped:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
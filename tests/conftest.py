@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py loads its snapshot at import, from a small synthetic data set here
+APP_DATA_DIR = os.environ.setdefault("SEISMIC_DATA_DIR", tempfile.mkdtemp(prefix="seismic-tests-"))
+os.environ.setdefault("SEISMIC_WARMUP", "0")
+os.environ.setdefault("SEISMIC_BUILD_WORKERS", "2")
+
+
+def write_sources(data_dir, n_events=3000, seed=0):
+    """Province, fault and catalog source files of a synthetic data set (see benchmark.py)."""
+    import benchmark
+
+    provinces = benchmark.synthetic_provinces(n_side=4, seed=seed)
+    provinces.to_file(os.path.join(data_dir, "ph_provinces.geojson"), driver="GeoJSON")
+    benchmark.synthetic_faults(n_faults=40, seed=seed).to_file(os.path.join(data_dir, "gem_active_faults.geojson"),
+                                                               driver="GeoJSON")
+    catalog = benchmark.synthetic_catalog(n_events, provinces, seed)
+    catalog.to_csv(os.path.join(data_dir, benchmark.CSV_NAME), index=False)
+    return catalog
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    write_sources(str(tmp_path))
+    return str(tmp_path)
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    if not os.listdir(APP_DATA_DIR):
+        write_sources(APP_DATA_DIR)
+    import app
+    return app
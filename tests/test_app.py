@@ -0,0 +1,123 @@
+import json
+
+import pytest
+from plotly.utils import PlotlyJSONEncoder
+
+
+def to_json(value):
+    return json.loads(json.dumps(value, cls=PlotlyJSONEncoder))
+
+
+def apply_patch(figure, patch):
+    """The client-side result of a dash.Patch made only of assignments."""
+    for operation in to_json(patch)["operations"]:
+        assert operation["operation"] == "Assign"
+        target = figure
+        for key in operation["location"][:-1]:
+            target = target[key]
+        target[operation["location"][-1]] = operation["params"]["value"]
+    return figure
+
+
+@pytest.fixture(scope="module")
+def app(app_module):
+    return app_module
+
+
+@pytest.fixture(scope="module")
+def province(app):
+    data = app.current_data()
+    return data.magnitude_df["adm2_en"].value_counts().index[0]
+
+
+@pytest.mark.parametrize("shown_range, new_range", [
+    ((2017, 2020), (2017, 2022)), # grow at the end
+    ((2019, 2022), (2016, 2022)), # grow at the start
+    ((2016, 2024), (2018, 2021)), # shrink
+    ((2018, 2020), (2018, 2020)), # unchanged
+])
+def test_bubble_map_patch_gives_the_full_figure(app, province, shown_range, new_range):
+    shown, view = app.update_bubble_map(province, list(shown_range), None, None)
+    patch, new_view = app.update_bubble_map(province, list(new_range), None, to_json(view))
+    assert isinstance(patch, app.Patch) and new_view is app.dash.no_update
+    full, _ = app.bubble_map_figure(app.current_data(), province, list(new_range))
+    assert (to_json(shown) == to_json(full)) == (shown_range == new_range)
+    assert apply_patch(to_json(shown), patch) == to_json(full)
+
+
+def test_bubble_map_sends_a_full_figure_for_other_traces(app, province):
+    _, view = app.update_bubble_map(province, [2016, 2024], None, None)
+    other = next(name for name in app.current_data().province_names if name != province)
+    figure, new_view = app.update_bubble_map(other, [2016, 2024], None, to_json(view))
+    assert not isinstance(figure, app.Patch) and new_view["province"] == other
+
+
+def test_cached_bubble_bins_skip_the_event_gather(app, province, monkeypatch):
+    data = app.current_data()
+    monkeypatch.setattr(app, "BUBBLE_MAX_POINTS", 10)
+    app.cached_bubble_bins.cache_clear()
+    first, view = app.bubble_map_figure(data, province, [2016, 2024])
+    assert view["binned"]
+
+    def gather(*args, **kwargs):
+        raise AssertionError("events gathered on a cache hit")
+
+    monkeypatch.setattr(app, "bubble_events", gather)
+    again, _ = app.bubble_map_figure(data, province, [2016, 2024])
+    assert to_json(again) == to_json(first)
+    app.cached_bubble_bins.cache_clear()
+
+
+@pytest.mark.parametrize("max_fault_distance", [None, 5.0, 1000.0])
+@pytest.mark.parametrize("slack", [-1, 0])
+def test_bubble_map_bins_only_above_the_point_limit(app, province, monkeypatch, max_fault_distance, slack):
+    data = app.current_data()
+    events = app.bubble_events(data, province, 2016, 2024, max_fault_distance)
+    monkeypatch.setattr(app, "BUBBLE_MAX_POINTS", max(len(events) + slack, 1))
+    _, view = app.bubble_map_figure(data, province, [2016, 2024], max_fault_distance)
+    assert view is None if events.empty else view["binned"] == (len(events) > app.BUBBLE_MAX_POINTS)
+    app.cached_bubble_bins.cache_clear()
+
+
+def test_warmup_fills_the_callback_caches(app):
+    data = app.current_data()
+    app.cached_bubble_map_figure.cache_clear()
+    warmups = app.warmup.Warmup(workers=2, enabled=True)
+    warmups.start(data.version, app.warmup_tasks(data))
+    assert warmups.wait(timeout=300)
+    assert warmups.status()["failed"] == 0
+    misses = app.cached_bubble_map_figure.cache_info().misses
+    app.cached_bubble_map_figure(data, data.province_names[0], (data.min_year, data.max_year), None)
+    assert app.cached_bubble_map_figure.cache_info().misses == misses
+
+
+@pytest.mark.parametrize("magnitude_range", [None, (4.0, 10.0)])
+def test_choropleth_data_matches_a_groupby(app, magnitude_range):
+    data = app.current_data()
+    payload = to_json(app.choropleth_data(data, magnitude_range))
+    events = data.magnitude_df[data.magnitude_df["adm2_en"].notna()]
+    if magnitude_range is not None:
+        events = events[events["Magnitude"].between(*magnitude_range)]
+    expected = events.groupby("adm2_en", observed=True)["Magnitude"].agg(["count", "mean", "max"])
+    expected = expected[expected["count"] > 0].reindex(payload["locations"])
+    assert sorted(payload["locations"]) == sorted(expected.index)
+    assert payload["count"] == expected["count"].tolist()
+    assert payload["mean"] == pytest.approx(expected["mean"].tolist(), abs=1e-4)
+    assert payload["max"] == pytest.approx(expected["max"].tolist(), abs=1e-2)
+    # Every location has a shape in the geometry store the browser draws it with
+    names = {feature["properties"]["adm2_en"] for feature in data.province_geojson["features"]}
+    assert set(payload["locations"]) <= names
+
+
+@pytest.mark.parametrize("window", [1, 3])
+def test_yearly_playback_frames_match_the_choropleth(app, window):
+    data = app.current_data()
+    frames = to_json(app.build_choropleth_frames(data, "year", window, year_range=(2018, 2022)))
+    assert frames["labels"] == [str(year) for year in range(2018, 2023)]
+    for label, counts, maxima in zip(frames["labels"], frames["count"], frames["max"]):
+        year = int(label)
+        # Windows at the start of the range only reach back to its first year
+        expected = to_json(app.build_choropleth_data(data, year_range=(max(year - window + 1, 2018), year)))
+        by_location = dict(zip(expected["locations"], zip(expected["count"], expected["max"])))
+        for location, count, maximum in zip(frames["locations"], counts, maxima):
+            assert (count, maximum) == by_location.get(location, (0, None))
@@ -0,0 +1,30 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from assignment import OUTSIDE, ProvinceAssigner
+
+
+def test_matches_sjoin():
+    rng = np.random.default_rng(0)
+    # Irregular Voronoi provinces, as in the assignment benchmark
+    extent = shapely.box(116, 4.5, 127, 21)
+    seeds = shapely.multipoints(shapely.points(rng.uniform(116, 127, 64), rng.uniform(4.5, 21, 64)))
+    cells = shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=extent))
+    geometries = shapely.segmentize(shapely.intersection(cells, extent), 0.01)
+    # A hole, so some points inside the extent fall outside every province
+    geometries[0] = shapely.difference(geometries[0], shapely.buffer(shapely.centroid(geometries[0]), 0.1))
+    provinces = gpd.GeoDataFrame({"adm2_en": [f"Province {i}" for i in range(len(geometries))]},
+                                 geometry=geometries, crs="EPSG:4326")
+    lon, lat = rng.uniform(115.5, 127.5, 50_000), rng.uniform(4, 21.5, 50_000)
+    centroid = shapely.get_coordinates(shapely.centroid(geometries[0]))[0]
+    lon[:500] = centroid[0] + rng.uniform(-0.05, 0.05, 500)
+    lat[:500] = centroid[1] + rng.uniform(-0.05, 0.05, 500)
+
+    points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+    joined = gpd.sjoin(points, provinces, how="left", predicate="within")
+    expected = joined.groupby(level=0)["index_right"].min().reindex(range(len(lon))).fillna(OUTSIDE).to_numpy()
+
+    codes = ProvinceAssigner.from_provinces(provinces).assign(lon, lat)
+    assert (codes == OUTSIDE).any()
+    assert np.array_equal(codes, expected)
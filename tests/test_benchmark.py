@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+from assignment import ProvinceAssigner
+
+
+def test_synthetic_catalog_lies_in_its_provinces():
+    provinces = benchmark.synthetic_provinces(n_side=3)
+    catalog = benchmark.synthetic_catalog(500, provinces, seed=1)
+    assert len(catalog) == 500
+    assert {"Date", "Latitude", "Longitude", "Depth_In_Km", "Magnitude", "Location", "Province", "Region",
+            "Island Group", "2020", "2015", "2010", "2000"} <= set(catalog.columns)
+    assigned = ProvinceAssigner.from_provinces(provinces).assign_names(catalog["Longitude"].to_numpy(),
+                                                                       catalog["Latitude"].to_numpy())
+    # Coordinates are rounded to 4 decimals, which can move an event across a border
+    assert (assigned == catalog["Province"].to_numpy()).mean() > 0.99
+    years = pd.to_datetime(catalog["Date"]).dt.year
+    assert years.min() >= 2016 and years.max() <= 2024
+    assert catalog["Magnitude"].between(1.0, 8.9).all()
+
+
+def test_percentile_summary_in_milliseconds():
+    summary = benchmark.percentile_summary(np.arange(1, 101) / 1000)
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == pytest.approx(50.5)
+    assert summary["p99_ms"] == pytest.approx(99.01)
+    assert summary["mean_ms"] == pytest.approx(50.5) and summary["max_ms"] == pytest.approx(100)
+
+
+def test_replayed_callbacks_succeed(app_module):
+    province = app_module.current_data().province_names[0]
+    payloads = [
+        benchmark.callback_payload("choropleth-data.data", [
+            (("event-magnitude-slider", "value"), [3, 6]), (("event-depth-slider", "value"), [0, 100]),
+            (("fault-distance", "value"), None), (("event-year-slider", "value"), None),
+            (("declustered-toggle", "value"), False)]),
+        benchmark.callback_payload("bubble-map.figure,bubble-map-view.data", [
+            (("click-data", "children"), province), (("bubble-year-slider", "value"), [2016, 2024]),
+            (("fault-distance", "value"), None)], [(("bubble-map-view", "data"), None)]),
+    ] * 3
+    summary = benchmark.replay_concurrent(app_module.server, payloads, concurrency=2)
+    assert summary["errors"] == 0 and summary["count"] == len(payloads)
+
+
+def test_compare_prints_ratios(tmp_path, capsys):
+    reports = []
+    for commit, p50 in [("old", 10.0), ("new", 5.0)]:
+        path = tmp_path / f"{commit}.json"
+        path.write_text(json.dumps({"commit": commit, "sizes": {"1000": {"callbacks": {"f": {"p50_ms": p50}}}}}))
+        reports.append(path)
+    benchmark.compare(*reports)
+    out = capsys.readouterr().out
+    assert "old -> new" in out and "callbacks.f.p50_ms" in out and "(0.50x)" in out
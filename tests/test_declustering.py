@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import declustering
+
+
+def brute_force_mainshocks(latitude, longitude, magnitude, time):
+    """All-pairs Gardner-Knopoff: largest (then earliest) unclaimed events claim their windows."""
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    days = (time - time.min()).astype(np.float64) / 86400
+    claimed = np.zeros(len(magnitude), dtype=bool)
+    for event in np.lexsort((days, -magnitude)):
+        if claimed[event]:
+            continue
+        a = (np.sin((lat - lat[event]) / 2) ** 2
+             + np.cos(lat) * np.cos(lat[event]) * np.sin((lon - lon[event]) / 2) ** 2)
+        distance = 2 * declustering.EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        window = ((distance <= declustering.window_distance_km(magnitude[event]))
+                  & (np.abs(days - days[event]) <= declustering.window_days(magnitude[event]))
+                  & (magnitude <= magnitude[event]))
+        window[event] = False
+        claimed |= window
+    return ~claimed
+
+
+def synthetic_catalog(n_sequences, seed):
+    """Background events plus aftershock sequences around a few larger mainshocks."""
+    rng = np.random.default_rng(seed)
+    n_background = 4 * n_sequences
+    lat = [rng.uniform(5, 20, n_background)]
+    lon = [rng.uniform(117, 127, n_background)]
+    magnitude = [rng.uniform(2.0, 5.0, n_background)]
+    days = [rng.uniform(0, 3650, n_background)]
+    for _ in range(n_sequences):
+        n = rng.integers(5, 40)
+        main_lat, main_lon, main_day = rng.uniform(5, 20), rng.uniform(117, 127), rng.uniform(0, 3650)
+        lat.append(main_lat + rng.normal(0, 0.2, n))
+        lon.append(main_lon + rng.normal(0, 0.2, n))
+        magnitude.append(np.concatenate(([rng.uniform(5.0, 7.5)], rng.uniform(2.0, 5.0, n - 1))))
+        days.append(main_day + np.abs(rng.exponential(60, n)) * rng.choice([-0.1, 1.0], n))
+    # Catalog magnitudes are rounded, which also exercises ties
+    magnitude = np.round(np.concatenate(magnitude), 1)
+    time = np.datetime64("2010-01-01T00:00:00") + (np.concatenate(days) * 86400).astype("timedelta64[s]")
+    return np.concatenate(lat), np.concatenate(lon), magnitude, time
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_brute_force(seed):
+    catalog = synthetic_catalog(60, seed)
+    expected = brute_force_mainshocks(*catalog)
+    assert 0 < expected.sum() < len(expected)
+    assert np.array_equal(declustering.mainshocks(*catalog), expected)
+
+
+def test_trees_match_brute_force(monkeypatch):
+    # Force every class through the KD-trees instead of the time-window scan
+    monkeypatch.setattr(declustering, "SCAN_MAX_EVENTS", 0)
+    catalog = synthetic_catalog(60, 3)
+    assert np.array_equal(declustering.mainshocks(*catalog), brute_force_mainshocks(*catalog))
+
+
+def test_invalid_events_are_mainshocks():
+    lat = np.array([10.0, 10.0, np.nan, 10.0])
+    lon = np.array([120.0, 120.01, 120.0, 120.0])
+    magnitude = np.array([6.0, 3.0, 3.0, np.nan])
+    time = np.array(["2020-01-01", "2020-01-02", "2020-01-02", "2020-01-02"], dtype="datetime64[s]")
+    assert declustering.mainshocks(lat, lon, magnitude, time).tolist() == [True, False, True, True]
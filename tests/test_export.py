@@ -0,0 +1,60 @@
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+from werkzeug.datastructures import MultiDict
+
+import export
+
+
+@pytest.fixture
+def catalog():
+    return pd.DataFrame({
+        "Province": pd.Categorical(["Cebu", "Bohol", "Cebu"]),
+        "Region": pd.Categorical(["VII", "VII", "VII"]),
+        "Island Group": pd.Categorical(["Visayas"] * 3),
+        "Year_Earthquake": np.array([2010, 2015, 2020], dtype=np.int16),
+        "Magnitude": np.array([2.2, 4.9, 5.1], dtype=np.float32),
+        "Depth_In_Km": np.array([10, 20, 30], dtype=np.float32),
+        "Fault_Distance_Km": np.array([1, 5, np.nan], dtype=np.float32),
+    })
+
+
+@pytest.mark.parametrize("param", ["start_year", "end_year"])
+@pytest.mark.parametrize("value", ["99999", "-40000"])
+def test_out_of_range_year_is_rejected(param, value):
+    with pytest.raises(export.ExportError):
+        export.parse_filters(MultiDict({param: value}))
+
+
+def test_out_of_range_year_returns_400(catalog):
+    server = Flask(__name__)
+    export.install(server, lambda: catalog)
+    response = server.test_client().get("/api/events?start_year=99999")
+    assert response.status_code == 400
+
+
+def test_bounds_compare_in_column_dtype(catalog):
+    filters = export.parse_filters(MultiDict({"min_magnitude": "4.9", "start_year": "2015"}))
+    assert export.chunk_mask(catalog, filters).tolist() == [False, True, True]
+
+
+@pytest.mark.parametrize("accept, compressed", [
+    ("gzip", True),
+    ("deflate, gzip;q=0.5", True),
+    ("*", True),
+    ("gzip;q=0", False),
+    ("identity", False),
+    (None, False),
+])
+def test_gzip_follows_accept_encoding(catalog, accept, compressed):
+    server = Flask(__name__)
+    export.install(server, lambda: catalog)
+    headers = {"Accept-Encoding": accept} if accept is not None else {}
+    response = server.test_client().get("/api/events?format=csv", headers=headers)
+    assert response.status_code == 200
+    assert (response.headers.get("Content-Encoding") == "gzip") == compressed
+    body = zlib.decompress(response.data, wbits=31) if compressed else response.data
+    assert body.decode().count("\n") == len(catalog) + 1
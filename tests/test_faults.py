@@ -0,0 +1,48 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+
+import benchmark
+from faults import METRIC_CRS, VERTEX_SPACING, FaultLocator
+
+
+@pytest.fixture(scope="module")
+def faults():
+    return benchmark.synthetic_faults(n_faults=40, seed=3)
+
+
+@pytest.fixture(scope="module")
+def points():
+    rng = np.random.default_rng(0)
+    return rng.uniform(117, 126.5, 300), rng.uniform(5, 20.5, 300)
+
+
+def test_nearest_matches_brute_force(faults, points):
+    lon, lat = points
+    distance, fault = FaultLocator.from_faults(faults).nearest(lon, lat)
+
+    traces = faults.to_crs(METRIC_CRS).geometry.to_numpy()
+    projected = gpd.points_from_xy(lon, lat, crs="EPSG:4326").to_crs(METRIC_CRS)
+    exact = np.array([[point.distance(trace) for trace in traces] for point in projected]) / 1000
+    assert np.all(distance >= exact.min(axis=1) - 1e-3)
+    assert np.all(distance <= exact.min(axis=1) + VERTEX_SPACING / 2000)
+    # The reported fault is at the reported distance
+    assert exact[np.arange(len(lon)), fault] == pytest.approx(distance, abs=VERTEX_SPACING / 2000)
+    assert np.mean(np.isclose(distance, exact.min(axis=1), atol=1e-3)) > 0.95
+
+
+def test_batches_do_not_change_the_result(faults, points):
+    locator = FaultLocator.from_faults(faults)
+    whole = locator.nearest(*points)
+    batched = locator.nearest(*points, batch_size=7)
+    for a, b in zip(whole, batched):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_invalid_points_and_missing_faults(faults):
+    distance, names = FaultLocator.from_faults(faults).nearest_names([np.nan, 121.0], [14.0, np.inf])
+    assert np.isnan(distance).all() and names.tolist() == [None, None]
+
+    empty = FaultLocator.from_faults(faults.iloc[:0])
+    distance, fault = empty.nearest([121.0], [14.0])
+    assert np.isnan(distance).all() and fault.tolist() == [-1]
@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+import pytest
+
+from gutenberg_richter import BootstrapCache, HistogramCube, estimate
+
+
+def gutenberg_richter_magnitudes(n, b_value, min_magnitude, seed=0):
+    """Magnitudes following Gutenberg-Richter above `min_magnitude`, binned to 0.1."""
+    rng = np.random.default_rng(seed)
+    # Starting half a bin below the first center fills every bin completely
+    magnitudes = min_magnitude - 0.05 + rng.exponential(np.log10(np.e) / b_value, n)
+    return np.round(magnitudes, 1)
+
+
+def cube(magnitudes, codes=None, years=None):
+    codes = np.zeros(len(magnitudes), dtype=int) if codes is None else codes
+    years = np.full(len(magnitudes), 2020) if years is None else years
+    return HistogramCube.from_events(codes, int(codes.max()) + 1, years, magnitudes)
+
+
+@pytest.mark.parametrize("b_value", [0.8, 1.0, 1.3])
+def test_estimate_recovers_b_value_and_mc(b_value):
+    result = cube(gutenberg_richter_magnitudes(50_000, b_value, 1.5)).estimate()
+    # Maximum curvature finds the first bin, plus the 0.2 correction
+    assert result["mc"][0] == pytest.approx(1.7)
+    assert result["b_value"][0] == pytest.approx(b_value, rel=0.05)
+
+
+def test_estimate_needs_enough_events():
+    result = estimate(np.array([[5, 3, 1, 0]]), np.array([1.0, 1.1, 1.2, 1.3]), min_events=50)
+    assert np.isnan(result["mc"][0]) and np.isnan(result["b_value"][0])
+
+
+def test_histograms_sum_the_year_range_and_groups():
+    magnitudes = np.array([1.0, 1.1, 1.1, 2.0, 1.0])
+    histograms = cube(magnitudes, codes=np.array([0, 0, 1, 1, 2]), years=np.array([2010, 2011, 2011, 2012, 2012]))
+    assert histograms.histograms((2011, 2012)).sum(axis=1).tolist() == [1, 2, 1]
+    assert histograms.histograms().sum(axis=1).tolist() == [2, 2, 1]
+    grouped = histograms.group(np.array([0, 0, -1]), 1)
+    assert grouped.histograms().sum(axis=1).tolist() == [4]
+
+
+def test_bootstrap_results_move_to_the_cache_when_done():
+    source = cube(gutenberg_richter_magnitudes(5_000, 1.0, 1.5))
+    cache = BootstrapCache(replicates=20, workers=2)
+    assert cache.get("key", source.histograms(), source.magnitudes) is None
+    deadline = time.monotonic() + 10
+    while "key" in cache._pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert "key" not in cache._pending
+    std = cache.get("key", source.histograms(), source.magnitudes)
+    assert std["b_value"].shape == (1,) and 0 < std["b_value"][0] < 0.2
+
+
+def test_bootstrap_pending_work_is_bounded_and_cleared():
+    source = cube(gutenberg_richter_magnitudes(5_000, 1.0, 1.5))
+    cache = BootstrapCache(replicates=2_000, workers=1, max_pending=2)
+    for year in range(6):
+        cache.get(year, source.histograms(), source.magnitudes)
+        assert len(cache._pending) <= 2
+    assert cache.result(5, source.histograms(), source.magnitudes) is not None
+    cache.clear()
+    assert not cache._pending and not cache._results
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indexes import CountCube, ProvinceEventIndex, ProvinceReducer, ProvinceTimeCube, widen_float32
+
+
+@pytest.fixture
+def reducer():
+    return ProvinceReducer(["A", "B", "C"], ["A", "B", "A", None], [2.0, 3.0, 4.0, 5.0], [10.0, 20.0, 30.0, 40.0],
+                           fault_distance=[1.0, 5.0, np.nan, 2.0], year=[2010, 2011, 2012, 2013])
+
+
+def test_province_query_matches_a_filter():
+    rng = np.random.default_rng(0)
+    dates = pd.to_datetime("2000-01-01") + pd.to_timedelta(rng.integers(0, 20 * 365, 500), unit="D")
+    catalog = pd.DataFrame({"Province": rng.choice(["A", " B", "C "], 500), "Date": dates,
+                            "Magnitude": rng.uniform(2, 6, 500)})
+    catalog["Year_Earthquake"] = catalog["Date"].dt.year.astype(np.int16)
+    index = ProvinceEventIndex(catalog)
+    assert index.years.dtype == np.int16
+    for province, start, end in [("A", 2005, 2010), ("B", 2000, 2000), ("C", 2019, 2030), ("D", 2000, 2020)]:
+        got = index.query(province, start, end)
+        expected = catalog[(catalog["Province"].str.strip() == province)
+                           & catalog["Year_Earthquake"].between(start, end)].sort_values("Date", kind="stable")
+        assert got["Date"].tolist() == expected["Date"].tolist()
+        assert got["Magnitude"].tolist() == expected["Magnitude"].tolist()
+
+
+def test_reduce_per_province(reducer):
+    stats = reducer.reduce()
+    assert stats["count"].tolist() == [2, 1, 0]
+    assert stats["mean"][:2].tolist() == [3.0, 3.0]
+    assert stats["max"][:2].tolist() == [4.0, 3.0]
+    assert np.isnan(stats["mean"][2]) and np.isnan(stats["max"][2]) and np.isnan(stats["energy"][2])
+
+
+@pytest.mark.parametrize("filters", [
+    {"magnitude_range": (8.0, 9.0)},
+    {"depth_range": (500.0, 600.0)},
+    {"max_fault_distance": 0.5},
+    {"year_range": (1990, 2000)},
+])
+def test_reduce_without_matching_events(reducer, filters):
+    stats = reducer.reduce(**filters)
+    assert stats["count"].tolist() == [0, 0, 0]
+    for key in ("mean", "max", "energy"):
+        assert np.isnan(stats[key]).all()
+
+
+def test_widen_float32_keeps_the_shortest_decimal():
+    frame = pd.DataFrame({"Magnitude": np.array([2.2, 4.7], dtype=np.float32), "Count": [1, 2]})
+    widened = widen_float32(frame)
+    assert widened["Magnitude"].tolist() == [2.2, 4.7]
+    assert widened["Count"].dtype == frame["Count"].dtype
+
+
+@pytest.fixture
+def counts():
+    return pd.DataFrame({
+        "Year": [2010, 2010, 2011, 2013, 2013, 2013, 2014],
+        "Province": ["A", "B", "A", "A", None, "B", "B"],
+        "Number of Earthquakes": [3, 1, 2, 4, 9, 0, 5],
+    })
+
+
+@pytest.mark.parametrize("entities, start, end", [
+    (["A", "B"], 2010, 2014),
+    (["B", "A", "Z"], 2011, 2013),
+    (["A"], 2012, 2012),
+    (["B"], 2015, 2020),
+])
+def test_count_cube_matches_a_groupby(counts, entities, start, end):
+    cube = CountCube(counts, "Province")
+    in_range = counts[counts["Year"].between(start, end) & counts["Province"].isin(entities)]
+    grouped = in_range.groupby(["Province", "Year"])["Number of Earthquakes"].sum()
+    grouped = grouped[grouped > 0]
+    expected = [(name, grouped[name].index.tolist(), grouped[name].tolist())
+                for name in entities if name in grouped.index.get_level_values(0)]
+    got = [(name, years.tolist(), values.tolist()) for name, years, values in cube.series(entities, start, end)]
+    assert got == expected
+
+
+def test_count_cube_single_series(counts):
+    cube = CountCube(counts, name="Overall")
+    [(name, years, values)] = cube.series(["Overall"], 2010, 2014)
+    assert name == "Overall"
+    assert years.tolist() == [2010, 2011, 2013, 2014]
+    assert values.tolist() == [4, 2, 13, 5]
+
+
+@pytest.fixture
+def monthly():
+    rng = np.random.default_rng(2)
+    n = 400
+    provinces = rng.choice(["A", "B", "C", None], n)
+    reducer = ProvinceReducer(["A", "B", "C"], provinces, rng.uniform(2, 7, n).round(1), rng.uniform(0, 100, n))
+    months = rng.integers(0, 36, n)
+    # Province C has no events in the second year
+    months[(provinces == "C") & (months >= 12) & (months < 24)] = 0
+    return reducer, months
+
+
+def brute_force(reducer, months, first, last):
+    """Statistics per province of the events in buckets first..last."""
+    keep = reducer.assigned & (months >= first) & (months <= last)
+    return {
+        "count": np.bincount(reducer.codes[keep], minlength=3),
+        "max": np.array([reducer.magnitude[keep & (reducer.codes == c)].max(initial=-np.inf) for c in range(3)]),
+        "energy": np.bincount(reducer.codes[keep], weights=reducer.energy[keep], minlength=3),
+    }
+
+
+@pytest.mark.parametrize("window", [1, 3, 12, 40])
+def test_time_cube_rolling_window_matches_the_events(monthly, window):
+    reducer, months = monthly
+    stats = ProvinceTimeCube.from_events(reducer, months, 36).rolling(window).statistics()
+    for t in range(36):
+        expected = brute_force(reducer, months, t - window + 1, t)
+        assert stats["count"][t].tolist() == expected["count"].tolist()
+        present = expected["count"] > 0
+        assert np.allclose(stats["max"][t][present], expected["max"][present])
+        assert np.allclose(stats["energy"][t][present], expected["energy"][present])
+        assert np.isnan(stats["mean"][t][~present]).all() and np.isnan(stats["max"][t][~present]).all()
+
+
+def test_time_cube_coarsens_months_to_years(monthly):
+    reducer, months = monthly
+    yearly = ProvinceTimeCube.from_events(reducer, months, 36).coarsen(12).statistics()
+    direct = ProvinceTimeCube.from_events(reducer, months // 12, 3).statistics()
+    for key in ("count", "mean", "max", "energy"):
+        np.testing.assert_allclose(yearly[key], direct[key])
+    assert yearly["count"][1, 2] == 0 and np.isnan(yearly["mean"][1, 2])
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+import benchmark
+import metrics
+
+
+def test_startup_phase_keeps_latest_run():
+    with metrics.startup_phase("test_phase"):
+        time.sleep(0.05)
+    with metrics.startup_phase("test_phase"):
+        pass
+    assert metrics._startup["test_phase"] < 0.05
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram((1, 10, 100))
+    for value in (0.5, 5, 50, 500):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 3]
+    assert (histogram.total, histogram.sum) == (4, 555.5)
+
+
+def test_timed_callback_records_calls_phases_and_errors():
+    @metrics.timed_callback
+    def metrics_test_callback(fail):
+        with metrics.phase("data"):
+            pass
+        if fail:
+            raise ValueError("boom")
+        return "ok"
+
+    assert metrics_test_callback(False) == "ok"
+    with pytest.raises(ValueError):
+        metrics_test_callback(True)
+    text = metrics.render()
+    labels = '{callback="metrics_test_callback"}'
+    assert f"seismic_callback_calls_total{labels} 2" in text
+    assert f"seismic_callback_errors_total{labels} 1" in text
+    assert f"seismic_callback_duration_seconds_count{labels} 2" in text
+    assert 'seismic_callback_phase_seconds_count{callback="metrics_test_callback",phase="data"} 2' in text
+    # The running callback is reset, so later phases are not attributed to it
+    assert metrics._current() is None
+
+
+def test_label_values_are_escaped():
+    assert metrics._format_labels({"table": 'a"b\\c'}) == '{table="a\\"b\\\\c"}'
+
+
+def test_metrics_route_reports_callback_responses(app_module):
+    client = app_module.server.test_client()
+    response = client.post("/_dash-update-component", json=benchmark.callback_payload("choropleth-data.data", [
+        (("event-magnitude-slider", "value"), [2, 7]), (("event-depth-slider", "value"), [0, 50]),
+        (("fault-distance", "value"), None), (("event-year-slider", "value"), None),
+        (("declustered-toggle", "value"), False)]))
+    assert response.status_code == 200
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'seismic_callback_response_bytes_count{callback="update_choropleth_data"}' in text
+    assert 'seismic_callback_phase_seconds_count{callback="update_choropleth_data",phase="data"}' in text
+    assert "seismic_process_resident_memory_bytes" in text
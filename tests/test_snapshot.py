@@ -0,0 +1,120 @@
+import os
+import threading
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import LineString, MultiLineString
+
+import snapshot
+from assignment import ProvinceAssigner
+from faults import FaultLocator
+from snapshot import partition_events
+
+HASHES = {"provinces": "p", "faults": "f"}
+
+
+def test_partition_events_leaves_out_undated_events():
+    events = pd.DataFrame({"Date": ["2020-01-05", None, "2019-05-01", "2020-03-01", ""]})
+    row_hashes = np.arange(len(events), dtype=np.uint64)
+    partitions = partition_events(events, row_hashes, HASHES)
+    assert sorted(partitions) == [2019, 2020]
+    assert partitions[2019][0].tolist() == [2]
+    assert partitions[2020][0].tolist() == [0, 3]
+
+
+def test_partition_keys_follow_the_rows_of_the_year():
+    events = pd.DataFrame({"Date": ["2020-01-05", "2019-05-01", "2020-03-01"]})
+    before = partition_events(events.copy(), np.array([1, 2, 3], dtype=np.uint64), HASHES)
+    after = partition_events(events.copy(), np.array([1, 9, 3], dtype=np.uint64), HASHES)
+    assert before[2020][1] == after[2020][1]
+    assert before[2019][1] != after[2019][1]
+
+
+def test_partition_merge_matches_single_pass(source_dir):
+    provinces = gpd.read_file(os.path.join(source_dir, snapshot.SOURCE_FILES["provinces"]))
+    faults = snapshot.philippine_faults(gpd.read_file(os.path.join(source_dir, snapshot.SOURCE_FILES["faults"])))
+    events, row_hashes = snapshot.read_events(source_dir)
+    assigner = ProvinceAssigner.from_provinces(provinces)
+    partitions = partition_events(events, row_hashes, HASHES)
+    partition_dir = os.path.join(source_dir, snapshot.PARTITION_DIR)
+    snapshot.process_partitions(events, partitions, provinces, faults, assigner, partition_dir, workers=2)
+    merged = snapshot.merge_partitions(partitions, partition_dir)
+
+    single = snapshot.process_events(snapshot.read_events(source_dir)[0], assigner, FaultLocator.from_faults(faults))
+    pd.testing.assert_frame_equal(merged["magnitude_df"], single["magnitude_df"])
+    pd.testing.assert_frame_equal(merged["province_mismatches"], single["province_mismatches"])
+    for name in ["province_ave_magnitudes", "earthquake_counts", "overall_counts"]:
+        pd.testing.assert_frame_equal(merged[name], single[name].reset_index(drop=True), check_dtype=False)
+
+
+def test_build_waits_for_the_lock(source_dir):
+    snapshot_dir = os.path.join(source_dir, "snapshot")
+    result = []
+    with snapshot.build_lock(snapshot_dir):
+        builder = threading.Thread(target=lambda: result.append(snapshot.build_snapshot(source_dir, snapshot_dir)))
+        builder.start()
+        builder.join(0.5)
+        assert builder.is_alive() and snapshot.current_version(snapshot_dir) is None
+    builder.join()
+    assert result == [snapshot.current_version(snapshot_dir)]
+    # Up to date: returns without taking the lock
+    with snapshot.build_lock(snapshot_dir):
+        assert snapshot.build_snapshot(source_dir, snapshot_dir) == result[0]
+
+
+def write_batch(path, events):
+    events.to_csv(path, index=False)
+    return str(path)
+
+
+def test_ingest_leaves_out_undated_events(source_dir, tmp_path):
+    snapshot_dir = os.path.join(source_dir, "snapshot")
+    snapshot.build_snapshot(source_dir, snapshot_dir)
+    events = pd.read_csv(os.path.join(source_dir, snapshot.SOURCE_FILES["earthquakes"])).head(20)
+    events.loc[[3, 7], "Date"] = None
+    version = snapshot.ingest([write_batch(tmp_path / "batch.csv", events)], source_dir, snapshot_dir)
+
+    ingested = snapshot.load_snapshot(source_dir, snapshot_dir, build_if_stale=False)
+    assert ingested.version == version
+    assert ingested.manifest["undated_events"] == 2
+    assert len(snapshot.ingested_batches(source_dir)) == 1
+    # A full build of the same sources gives the same catalog
+    rebuilt = snapshot.load_snapshot(source_dir, os.path.join(source_dir, "rebuilt"))
+    assert rebuilt.version == version and rebuilt.manifest["undated_events"] == 2
+    pd.testing.assert_frame_equal(ingested.magnitude_df, rebuilt.magnitude_df)
+
+
+@pytest.mark.parametrize("column, value", [("Date", "not a date"), ("Magnitude", "strong"), ("Region", None)])
+def test_malformed_batch_is_not_stored(source_dir, tmp_path, column, value):
+    snapshot_dir = os.path.join(source_dir, "snapshot")
+    version = snapshot.build_snapshot(source_dir, snapshot_dir)
+    events = pd.read_csv(os.path.join(source_dir, snapshot.SOURCE_FILES["earthquakes"])).head(20)
+    if value is None:
+        events = events.drop(columns=column)
+    else:
+        events[column] = events[column].astype(object)
+        events.loc[5, column] = value
+    with pytest.raises(ValueError):
+        snapshot.ingest([write_batch(tmp_path / "batch.csv", events)], source_dir, snapshot_dir)
+    assert snapshot.ingested_batches(source_dir) == []
+    assert snapshot.current_version(snapshot_dir) == version
+
+
+def test_fault_overlay_breaks_between_segments():
+    faults = gpd.GeoDataFrame({"name": ["Philippine Fault", None, "Empty", "Valley"]}, geometry=[
+        LineString([(121.0, 14.0), (121.123456, 14.5)]),
+        MultiLineString([[(122.0, 10.0), (122.5, 10.5)], [(123.0, 11.0), (123.5, 11.5), (124.0, 12.0)]]),
+        LineString(),
+        None,
+    ], crs="EPSG:4326")
+    overlay = snapshot.build_fault_overlay(faults)
+    assert overlay["lon"] == [121.0, 121.12346, None, 122.0, 122.5, None, 123.0, 123.5, 124.0]
+    assert overlay["lat"] == [14.0, 14.5, None, 10.0, 10.5, None, 11.0, 11.5, 12.0]
+    assert overlay["text"] == ["Philippine Fault"] * 2 + [""] + ["Unnamed Fault"] * 2 + [""] + ["Unnamed Fault"] * 3
+
+
+def test_fault_overlay_without_segments():
+    faults = gpd.GeoDataFrame({"name": ["Empty"]}, geometry=[LineString()], crs="EPSG:4326")
+    assert snapshot.build_fault_overlay(faults) == {"lat": [], "lon": [], "text": []}
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+
+import tiles
+
+
+@pytest.fixture
+def catalog():
+    rng = np.random.default_rng(0)
+    n = 5000
+    return pd.DataFrame({
+        "Date": pd.to_datetime("2010-01-01") + pd.to_timedelta(rng.integers(0, 5000, n), unit="D"),
+        "Latitude": rng.uniform(5, 20, n).astype(np.float32),
+        "Longitude": rng.uniform(117, 127, n).astype(np.float32),
+        "Depth_In_Km": rng.uniform(0, 100, n).astype(np.float32),
+        "Magnitude": rng.uniform(1, 7, n).round(1).astype(np.float32),
+        "Location": pd.Categorical(rng.choice(["A", "B"], n)),
+        "Province": pd.Categorical(rng.choice(["Cebu", "Bohol"], n)),
+        "Year_Earthquake": np.full(n, 2010, dtype=np.int16) + rng.integers(0, 14, n).astype(np.int16),
+        "Mainshock": rng.random(n) < 0.5,
+    })
+
+
+def test_tiles_partition_the_catalog(catalog):
+    pyramid = tiles.TilePyramid(catalog)
+    for zoom in (3, 6):
+        counts = [pyramid.tile(zoom, x, y)["count"] for x, y in pyramid.occupied(zoom)]
+        assert sum(counts) == len(catalog)
+
+
+def test_filtered_tile_matches_brute_force(catalog):
+    pyramid = tiles.TilePyramid(catalog)
+    filters = pyramid._normalize({"Magnitude": (4.0, None), "Year_Earthquake": (2012, 2018), "Mainshock": [True]})
+    tx, ty = tiles.tile_coordinates(catalog["Latitude"], catalog["Longitude"], 6)
+    for x, y in pyramid.occupied(6):
+        expected = ((tx == x) & (ty == y) & (catalog["Magnitude"] >= np.float32(4.0)).to_numpy()
+                    & catalog["Year_Earthquake"].between(2012, 2018).to_numpy() & catalog["Mainshock"].to_numpy())
+        tile = pyramid.tile(6, x, y, filters)
+        assert tile["count"] == expected.sum()
+        shown = tile["events"]["lat"] if tile["events"] else tile["bins"]["count"]
+        assert (len(shown) if tile["events"] else sum(shown)) == expected.sum()
+
+
+@pytest.mark.parametrize("query", ["start_year=99999", "end_year=-40000", "min_depth=abc"])
+def test_bad_filters_return_400(catalog, query):
+    server = Flask(__name__)
+    tiles.install(server, lambda: tiles.TilePyramid(catalog))
+    assert server.test_client().get(f"/api/tiles/5/26/14?{query}").status_code == 400
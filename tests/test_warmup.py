@@ -0,0 +1,61 @@
+import threading
+
+from flask import Flask
+
+import warmup
+
+
+def serve(warmups):
+    server = Flask(__name__)
+    warmup.install(server, warmups)
+    return server.test_client()
+
+
+def test_ready_once_the_first_run_finishes():
+    warmups = warmup.Warmup(workers=1, enabled=True)
+    client = serve(warmups)
+    release = threading.Event()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    warmups.start("v1", [release.wait, lambda: None, fail])
+    response = client.get("/ready")
+    assert response.status_code == 503 and response.get_json()["total"] == 3
+    release.set()
+    assert warmups.wait(timeout=10)
+    response = client.get("/ready")
+    status = response.get_json()
+    assert response.status_code == 200
+    assert (status["ready"], status["version"], status["completed"], status["failed"]) == (True, "v1", 2, 1)
+    assert status["seconds"] is not None
+
+
+def test_later_runs_keep_the_worker_ready():
+    warmups = warmup.Warmup(workers=1, enabled=True)
+    warmups.start("v1", [])
+    release = threading.Event()
+    warmups.start("v2", [release.wait])
+    response = serve(warmups).get("/ready")
+    assert response.status_code == 200 and response.get_json()["version"] == "v2"
+    assert not warmups.wait(timeout=0)
+    release.set()
+    assert warmups.wait(timeout=10) and warmups.status()["completed"] == 1
+
+
+def test_superseded_run_skips_its_pending_tasks():
+    warmups = warmup.Warmup(workers=1, enabled=True)
+    release = threading.Event()
+    calls = []
+    warmups.start("v1", [release.wait, lambda: calls.append("v1")])
+    warmups.start("v2", [lambda: calls.append("v2")])
+    release.set()
+    assert warmups.wait(timeout=10)
+    assert warmups.status()["version"] == "v2" and calls.count("v1") == 0
+
+
+def test_disabled_warmup_is_ready_at_once():
+    warmups = warmup.Warmup(enabled=False)
+    warmups.start("v1", [lambda: 1 / 0])
+    assert warmups.wait(timeout=0)
+    assert serve(warmups).get("/ready").status_code == 200
@@ -0,0 +1,303 @@
+"""Viewport tiles of the event catalog for the "all events" map layer.
+
+`install(server, get_pyramid)` adds `/api/tiles/<z>/<x>/<y>` to the Flask
+server. Tiles follow the web map (XYZ) scheme, and a tile takes the filters
+of `/api/events` (see export.py) plus `declustered=1`:
+
+    /api/tiles/6/53/29?min_magnitude=4&start_year=2010&end_year=2020&declustered=1
+
+A tile holding at most SEISMIC_TILE_MAX_EVENTS matching events returns them
+one by one. A denser tile returns bins instead: it is cut into 64 x 64
+cells, and each cell gives its event count, its largest magnitude and the
+centroid of its events:
+
+    {"z": 6, "x": 53, "y": 29, "count": 81234, "events": null,
+     "bins": {"lat": [...], "lon": [...], "count": [...], "max_magnitude": [...]}}
+
+The pyramid is a single sort. Every event gets the Morton code of its
+web-mercator position at LEAF_ZOOM, and the events are ordered by that code.
+The events of any tile are then one contiguous run, found with two binary
+searches. The bins of a tile are runs of a shorter code prefix within it.
+For the unfiltered catalog, the bins of the tile zooms up to
+SEISMIC_TILE_PYRAMID_ZOOM are aggregated once at startup, level by level,
+keeping the levels with far fewer cells than events.
+Filtered tiles mask the events of the run and aggregate what remains.
+
+Finished responses are kept in an LRU cache per pyramid, so per snapshot
+version. A request whose `v` parameter names the current version is also
+cacheable by the browser.
+"""
+
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from flask import Response, request
+
+from export import RANGE_FILTERS, ExportError, chunk_mask, parse_filters
+
+LEAF_ZOOM = 22 # Resolution of the Morton codes
+BIN_BITS = 6   # Tiles aggregate into 2**BIN_BITS x 2**BIN_BITS cells
+MAX_ZOOM = LEAF_ZOOM - BIN_BITS
+MAX_LATITUDE = 85.05112878 # Edge of the web-mercator square
+
+MAX_TILE_EVENTS = int(os.environ.get("SEISMIC_TILE_MAX_EVENTS", 2000))
+PYRAMID_ZOOM = min(int(os.environ.get("SEISMIC_TILE_PYRAMID_ZOOM", 7)), MAX_ZOOM)
+TILE_CACHE_SIZE = int(os.environ.get("SEISMIC_TILE_CACHE_SIZE", 1024))
+TILE_MAX_AGE = int(os.environ.get("SEISMIC_TILE_MAX_AGE", 3600)) # seconds
+LEVEL_MAX_CELLS_RATIO = 4 # Events per precomputed cell, at least
+
+# Columns returned for single events: catalog column -> (response key, decimals)
+EVENT_FIELDS = {
+    "Latitude": ("lat", 4),
+    "Longitude": ("lon", 4),
+    "Magnitude": ("magnitude", 2),
+    "Depth_In_Km": ("depth", 1),
+}
+
+
+class TileError(ValueError):
+    pass
+
+
+def _spread(values):
+    """The bits of `values` (below 2**32) moved to the even bit positions."""
+    values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def _compact(codes):
+    """Inverse of `_spread`: the even bits of `codes`."""
+    codes = codes.astype(np.uint64) & np.uint64(0x5555555555555555)
+    for shift, mask in ((1, 0x3333333333333333), (2, 0x0F0F0F0F0F0F0F0F), (4, 0x00FF00FF00FF00FF),
+                        (8, 0x0000FFFF0000FFFF), (16, 0x00000000FFFFFFFF)):
+        codes = (codes | (codes >> np.uint64(shift))) & np.uint64(mask)
+    return codes
+
+
+def morton(x, y):
+    return _spread(np.asarray(x)) | (_spread(np.asarray(y)) << np.uint64(1))
+
+
+def tile_coordinates(latitude, longitude, zoom):
+    """Integer web-mercator tile (x, y) of each position at `zoom`."""
+    n = 2 ** zoom
+    lat = np.radians(np.clip(np.asarray(latitude, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitude, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return (np.clip(np.floor(x * n), 0, n - 1).astype(np.int64),
+            np.clip(np.floor(y * n), 0, n - 1).astype(np.int64))
+
+
+def _runs(keys):
+    """Start of every run of equal values in the sorted `keys`."""
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype=np.int64)
+
+
+def _merge(level):
+    """The bins of the zoom above: every 2 x 2 block of cells combined."""
+    codes, count, max_magnitude, lat_sum, lon_sum = level
+    parents = codes >> np.uint64(2)
+    starts = _runs(parents)
+    if len(starts) == 0:
+        return level
+    return (parents[starts], np.add.reduceat(count, starts), np.maximum.reduceat(max_magnitude, starts),
+            np.add.reduceat(lat_sum, starts), np.add.reduceat(lon_sum, starts))
+
+
+def _nullable(values, decimals):
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.round(decimals).astype(object)
+    rounded[np.isnan(values)] = None
+    return rounded.tolist()
+
+
+class TilePyramid:
+    """Events sorted by Morton code, with the unfiltered bins of the low zooms.
+
+    Only the sorted codes and the permutation into `magnitude_df` are kept;
+    the catalog itself stays the memory-mapped one every worker shares, and
+    the rows of a tile are gathered from it on request.
+    """
+
+    def __init__(self, magnitude_df, version=None, cache_size=TILE_CACHE_SIZE):
+        self.version = version
+        latitude = magnitude_df["Latitude"].to_numpy(dtype=np.float64)
+        longitude = magnitude_df["Longitude"].to_numpy(dtype=np.float64)
+        located = np.flatnonzero(np.isfinite(latitude) & np.isfinite(longitude))
+        x, y = tile_coordinates(latitude[located], longitude[located], LEAF_ZOOM)
+        codes = morton(x, y)
+        by_code = np.argsort(codes, kind="stable")
+        self.codes = codes[by_code]
+        self.catalog = magnitude_df
+        # Catalog row of every event in code order
+        self.order = located[by_code].astype(np.int32 if len(magnitude_df) < 2 ** 31 else np.int64)
+        self.bounds = {column: (np.nanmin(values), np.nanmax(values)) if len(values) and not np.isnan(values).all()
+                       else None
+                       for _, _, column, _ in RANGE_FILTERS.values() if column in magnitude_df.columns
+                       for values in [magnitude_df[column].to_numpy(dtype=np.float64)]}
+
+        # Bins of the unfiltered catalog: level -> (codes, count, max magnitude, mean latitude, mean longitude).
+        # A level is kept only when it has far fewer cells than there are
+        # events; otherwise aggregating the events of a tile is as cheap.
+        self.levels = {}
+        top = PYRAMID_ZOOM + BIN_BITS
+        level = self._aggregate(np.arange(len(self.codes)), top)
+        for zoom in range(top, BIN_BITS - 1, -1):
+            codes, count, max_magnitude, lat_sum, lon_sum = level
+            if len(codes) * LEVEL_MAX_CELLS_RATIO <= len(self.codes):
+                # Level codes (and the end of the last tile's span) need 2 * zoom bits
+                self.levels[zoom] = (codes.astype(np.uint32 if zoom < 16 else np.uint64), count.astype(np.int32), max_magnitude.astype(np.float32),
+                                     (lat_sum / count).astype(np.float32), (lon_sum / count).astype(np.float32))
+            level = _merge(level)
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict() # (z, x, y, filters) -> (json bytes, gzip bytes)
+        self.cache_size = cache_size
+
+    def _aggregate(self, rows, zoom):
+        """Bins at `zoom` of the events at the (code-ordered) `rows`."""
+        codes = self.codes[rows] >> np.uint64(2 * (LEAF_ZOOM - zoom))
+        starts = _runs(codes)
+        if len(starts) == 0:
+            empty = np.array([], dtype=np.float64)
+            return codes, np.array([], dtype=np.int64), empty, empty, empty
+        catalog_rows = self.order[rows]
+        column = lambda name: self.catalog[name].to_numpy()[catalog_rows].astype(np.float64)
+        # Events without a magnitude never win the maximum
+        magnitude = np.nan_to_num(column("Magnitude"), nan=-np.inf)
+        return (codes[starts], np.diff(np.r_[starts, len(rows)]),
+                np.maximum.reduceat(magnitude, starts),
+                np.add.reduceat(column("Latitude"), starts),
+                np.add.reduceat(column("Longitude"), starts))
+
+    def _gather(self, rows, columns):
+        """`columns` of the events at the (code-ordered) `rows`, gathered from the catalog."""
+        catalog_rows = self.order[rows]
+        return pd.DataFrame({column: self.catalog[column].array.take(catalog_rows) for column in columns})
+
+    def _normalize(self, filters):
+        """`filters` without ranges that cover every value, as a hashable key."""
+        key = []
+        for column, condition in sorted(filters.items()):
+            if column not in self.catalog.columns:
+                raise TileError(f"Tiles cannot be filtered by {column}")
+            if not isinstance(condition, list):
+                bounds = self.bounds.get(column)
+                lo, hi = condition
+                if bounds is not None:
+                    lo = None if lo is not None and lo <= bounds[0] else lo
+                    hi = None if hi is not None and hi >= bounds[1] else hi
+                if lo is None and hi is None:
+                    continue
+                condition = (lo, hi)
+            else:
+                condition = frozenset(condition)
+            key.append((column, condition))
+        return tuple(key)
+
+    def occupied(self, zoom):
+        """(x, y) of every tile at `zoom` holding at least one event."""
+        prefixes = np.unique(self.codes >> np.uint64(2 * (LEAF_ZOOM - zoom)))
+        return list(zip(_compact(prefixes).astype(int).tolist(), _compact(prefixes >> np.uint64(1)).astype(int).tolist()))
+
+    def tile(self, z, x, y, filters=()):
+        """Events or bins of tile (z, x, y) matching `filters`, as normalized by `_normalize`."""
+        if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise TileError(f"No tile {z}/{x}/{y}; zoom goes up to {MAX_ZOOM}")
+        shift = np.uint64(2 * (LEAF_ZOOM - z))
+        prefix = morton(x, y)
+        lo, hi = np.searchsorted(self.codes, [prefix << shift, (prefix + np.uint64(1)) << shift])
+        if filters:
+            chunk = self._gather(np.arange(lo, hi), [column for column, _ in filters])
+            # chunk_mask takes value lists for the categorical filters
+            rows = lo + np.flatnonzero(chunk_mask(chunk, {column: list(condition) if isinstance(condition, frozenset)
+                                                          else condition for column, condition in filters}))
+        else:
+            rows = np.arange(lo, hi)
+
+        result = {"z": z, "x": x, "y": y, "count": int(len(rows)), "events": None, "bins": None}
+        if len(rows) <= MAX_TILE_EVENTS:
+            events = self._gather(rows, [column for column in list(EVENT_FIELDS) + ["Date", "Location"]
+                                         if column in self.catalog.columns])
+            result["events"] = {key: _nullable(events[column].to_numpy(dtype=np.float64), decimals)
+                                for column, (key, decimals) in EVENT_FIELDS.items()}
+            if "Date" in events.columns:
+                result["events"]["date"] = events["Date"].dt.strftime("%Y-%m-%d").fillna("").tolist()
+            if "Location" in events.columns:
+                result["events"]["location"] = events["Location"].astype(object).fillna("").astype(str).tolist()
+            return result
+
+        level = z + BIN_BITS
+        if not filters and level in self.levels:
+            codes, count, max_magnitude, lat, lon = self.levels[level]
+            span = np.array([prefix << np.uint64(2 * BIN_BITS), (prefix + np.uint64(1)) << np.uint64(2 * BIN_BITS)])
+            first, last = np.searchsorted(codes, span.astype(codes.dtype))
+            count, max_magnitude = count[first:last], max_magnitude[first:last]
+            lat, lon = lat[first:last].astype(np.float64), lon[first:last].astype(np.float64)
+        else:
+            _, count, max_magnitude, lat_sum, lon_sum = self._aggregate(rows, level)
+            lat, lon = lat_sum / count, lon_sum / count
+        result["bins"] = {
+            "lat": lat.round(4).tolist(),
+            "lon": lon.round(4).tolist(),
+            "count": count.tolist(),
+            "max_magnitude": _nullable(np.where(np.isinf(max_magnitude), np.nan, max_magnitude), 2),
+        }
+        return result
+
+    def response(self, z, x, y, filters=None):
+        """(JSON, gzip-compressed JSON) of a tile, from the cache when possible."""
+        key = (z, x, y, self._normalize(filters or {}))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        body = json.dumps(self.tile(z, x, y, key[3]), separators=(",", ":")).encode()
+        compressed = zlib.compressobj(wbits=31) # gzip container
+        entry = (body, compressed.compress(body) + compressed.flush())
+        with self._lock:
+            self._cache[key] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+
+def parse_tile_filters(args):
+    """The /api/events filters of the query arguments, plus `declustered`; raises TileError on bad values."""
+    try:
+        filters = parse_filters(args)
+    except ExportError as e:
+        raise TileError(str(e))
+    if args.get("declustered", "").lower() in ("1", "true", "yes"):
+        filters["Mainshock"] = [True]
+    return filters
+
+
+def install(server, get_pyramid):
+    """Serve the tiles of the pyramid returned by `get_pyramid()` on /api/tiles of `server`."""
+    def event_tile(z, x, y):
+        pyramid = get_pyramid()
+        try:
+            body, compressed = pyramid.response(z, x, y, parse_tile_filters(request.args))
+        except TileError as e:
+            return Response(f"{e}\n", status=400, mimetype="text/plain")
+        headers = {"Vary": "Accept-Encoding"}
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            body = compressed
+            headers["Content-Encoding"] = "gzip"
+        # Only a URL naming the current snapshot may be reused by the browser
+        if pyramid.version is not None and request.args.get("v") == str(pyramid.version):
+            headers["Cache-Control"] = f"public, max-age={TILE_MAX_AGE}"
+        else:
+            headers["Cache-Control"] = "no-cache"
+        return Response(body, mimetype="application/json", headers=headers)
+
+    server.add_url_rule("/api/tiles/<int:z>/<int:x>/<int:y>", "event_tile", event_tile)
@@ -0,0 +1,104 @@
+"""Background warm-up of the memoized callback results.
+
+A fresh worker, or one that just swapped in a new snapshot, starts with
+empty caches, so the first visitors would pay for the aggregations and
+figure builds. `Warmup.start(version, tasks)` runs the calls whose results
+the app memoizes in a small thread pool and tracks their progress.
+`install(server, warmup)` serves that progress on `/ready`:
+
+    {"ready": false, "version": "3f2a...", "completed": 40, "failed": 0, "total": 150, "seconds": 1.8}
+
+with status 503 until the first warm-up has finished and 200 afterwards,
+so a load balancer only routes traffic to workers whose caches are hot.
+Later warm-ups (after a snapshot swap) are reported but do not make the
+worker unready, as the previous data keeps serving meanwhile.
+
+SEISMIC_WARMUP_WORKERS sets the pool size (default 2, leaving CPU for
+requests). SEISMIC_WARMUP=0 disables warm-up; the worker is then ready at once.
+"""
+
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify
+
+import metrics
+
+ENABLED = os.environ.get("SEISMIC_WARMUP", "1") != "0"
+WARMUP_WORKERS = int(os.environ.get("SEISMIC_WARMUP_WORKERS", 2))
+
+
+class Warmup:
+    """Progress of the latest warm-up run; a new run supersedes the previous one."""
+
+    def __init__(self, workers=WARMUP_WORKERS, enabled=ENABLED):
+        self.workers = workers
+        self.enabled = enabled
+        self.ready = not enabled
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._run = None
+        if self.ready:
+            self._done.set()
+
+    def start(self, version, tasks):
+        """Run the callables `tasks` in the background for the data `version`."""
+        if not self.enabled:
+            return
+        run = {"version": version, "total": len(tasks), "completed": 0, "failed": 0,
+               "started": time.monotonic(), "seconds": None}
+        with self._lock:
+            self._run = run
+            self._done.clear()
+        if not tasks:
+            self._finish(run)
+            return
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="warmup")
+        for task in tasks:
+            pool.submit(self._execute, run, task)
+        pool.shutdown(wait=False)
+
+    def _execute(self, run, task):
+        if run is not self._run:
+            return # Superseded by a newer snapshot; its caches were cleared anyway
+        try:
+            task()
+            key = "completed"
+        except Exception:
+            traceback.print_exc()
+            key = "failed"
+        with self._lock:
+            run[key] += 1
+            finished = run["completed"] + run["failed"] == run["total"]
+        if finished:
+            self._finish(run)
+
+    def _finish(self, run):
+        run["seconds"] = round(time.monotonic() - run["started"], 3)
+        if not self.ready:
+            metrics.record_startup("warmup", run["seconds"])
+        self.ready = True
+        if run is self._run:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until the latest run has finished; returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def status(self):
+        with self._lock:
+            run = dict(self._run or {})
+        run.pop("started", None)
+        return {"ready": self.ready, **run}
+
+
+def install(server, warmup):
+    """Serve the progress of `warmup` on /ready of `server`."""
+    def ready():
+        status = warmup.status()
+        return jsonify(status), 200 if status["ready"] else 503
+
+    server.add_url_rule("/ready", "ready", ready)